@@ -4,10 +4,14 @@ sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 import asyncio
 import logging
+import threading
 import streamlit as st
 import os
-from constants import DEFAULT_SYSTEM_PROMPT, GENERAL_RAG_PROMPT
-from processing import call_openai_api
+from constants import DEFAULT_SYSTEM_PROMPT, GENERAL_RAG_PROMPT, JOBS_EMBEDDED_WORKERS, WARMUP_ON_STARTUP
+from context_packing import pack_context
+from instrumentation import start_metrics_server
+from resources import warm_up_app
+from worker import start_worker_pool
 from dotenv import load_dotenv
 
 from sidebar import configure_sidebar
@@ -15,6 +19,24 @@ from sidebar import configure_sidebar
 # load the .env file
 load_dotenv()
 OPENAI_API_TOKEN = os.getenv('OPENAI_API_KEY')
+# Prometheus-style /metrics, when METRICS_PORT is set
+start_metrics_server()
+# Ingest and PPT jobs run in worker processes; once per app process, not per script run.
+# Spawned children re-import this script as __mp_main__ and must not start workers themselves
+if JOBS_EMBEDDED_WORKERS and __name__ == "__main__":
+    start_worker_pool()
+
+
+@st.cache_resource
+def start_warm_up():
+    # Once per app process: the first upload and question find everything loaded
+    thread = threading.Thread(target=warm_up_app, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+if WARMUP_ON_STARTUP and __name__ == "__main__":
+    start_warm_up()
 
 
 async def main():
@@ -42,13 +64,15 @@ async def main():
 
             # If the retrieval chain is created, use it to answer the user's question
             if "query_engine" in st.session_state:
-                chunks = st.session_state.query_engine.query(prompt)
+                # Imported on first use (llama_index, langchain); warm_up_app usually got there first
+                from processing import astream_openai_api
 
-                context_str = "\n\n".join([chunk.get("content") for chunk in chunks])
+                retrieved_chunks = st.session_state.query_engine.query(prompt)
+
+                # Deduplicated, highest scoring chunks within the context token budget
+                context_str, chunks, context_report = pack_context(retrieved_chunks)
                 
                 prompt = GENERAL_RAG_PROMPT.format(question=prompt, context=context_str)
-                response = call_openai_api(prompt, DEFAULT_SYSTEM_PROMPT, model="gpt-4o")
-                
 
                 sources = "["
 
@@ -57,6 +81,9 @@ async def main():
                     metadata = chunk.get("metadata")
                     source = metadata.get("filename")
                     page = metadata.get("page_number")
+                    page_end = metadata.get("page_end")
+                    if page_end and page_end != page:
+                        page = f"{page}-{page_end}"
                     if i == len(chunks) - 1:
                         sources += f'{source}, Page: {page}'
                     else:
@@ -64,11 +91,23 @@ async def main():
 
                 sources += "]"
 
-                # Display the response and sources
-                answer = response + "\n\n*Sources:*\n" + sources
-                st.session_state.messages.append({"role": "assistant", "content": answer})
+                # Render the answer as it streams in, then add the sources
                 with st.chat_message("assistant"):
-                    st.markdown(answer)
+                    placeholder = st.empty()
+                    response = ""
+                    answer_metrics = {}
+                    async for delta in astream_openai_api(prompt, DEFAULT_SYSTEM_PROMPT, model="gpt-4o", metrics=answer_metrics):
+                        response += delta
+                        placeholder.markdown(response + "▌")
+
+                    answer = response + "\n\n*Sources:*\n" + sources
+                    placeholder.markdown(answer)
+                    st.caption(
+                        f"Context: {context_report['selected']} of {context_report['candidates']} chunks, "
+                        f"{context_report['tokens']} tokens. "
+                        f"First token after {answer_metrics.get('time_to_first_token', 0):.1f}s."
+                    )
+                st.session_state.messages.append({"role": "assistant", "content": answer})
     except Exception as e:
         logging.error("Error occured :",e)
         raise e
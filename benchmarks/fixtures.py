@@ -0,0 +1,128 @@
+"""
+Synthetic element lists in the shape partition_pdf_elements returns, for benchmarks.
+Every builder is deterministic for a given seed.
+"""
+import os
+import random
+
+from PIL import Image
+
+LAYOUT_WIDTH = 1700
+LAYOUT_HEIGHT = 2200
+FILENAME = "benchmark.pdf"
+
+_WORDS = (
+    "revenue growth market customer product service quarter annual report analysis data model "
+    "performance increase decrease total segment region cost margin forecast strategy risk team "
+    "operations investment capital cash flow result period compared previous year significant"
+).split()
+
+
+def _sentence(rng, min_words=8, max_words=25):
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + "."
+
+
+def _element(rng, page, element_type, text, x, y, w, h, **metadata):
+    return {
+        "element_id": f"{page}-{rng.getrandbits(48):012x}",
+        "type": element_type,
+        "text": text,
+        "metadata": {
+            "filename": FILENAME,
+            "page_number": page,
+            "coordinates": {
+                "points": [[x, y], [x, y + h], [x + w, y + h], [x + w, y]],
+                "layout_width": LAYOUT_WIDTH,
+                "layout_height": LAYOUT_HEIGHT,
+            },
+            **metadata,
+        },
+    }
+
+
+def _table_html(rng, rows=8, cols=5):
+    cells = "".join(
+        "<tr>" + "".join(f"<td>{rng.randint(0, 99999)}</td>" for _ in range(cols)) + "</tr>" for _ in range(rows)
+    )
+    return f"<table>{cells}</table>"
+
+
+def text_heavy(pages=20, seed=0):
+    """
+    Pages of a title followed by a column of narrative paragraphs.
+    """
+    rng = random.Random(seed)
+    elements = []
+    for page in range(1, pages + 1):
+        elements.append(_element(rng, page, "Title", _sentence(rng, 3, 8), 150, 120, 1400, 80))
+        y = 250
+        while y < LAYOUT_HEIGHT - 250:
+            text = " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+            height = 40 + len(text) // 6
+            elements.append(_element(rng, page, "NarrativeText", text, 150, y, 1400, height))
+            y += height + 30
+    return elements
+
+
+def table_heavy(pages=20, seed=0):
+    """
+    Pages with a short caption and two tables each.
+    """
+    rng = random.Random(seed)
+    elements = []
+    for page in range(1, pages + 1):
+        elements.append(_element(rng, page, "NarrativeText", _sentence(rng), 150, 120, 1400, 60))
+        for y in (250, 1200):
+            html = _table_html(rng)
+            text = " ".join(part.split(">")[-1] for part in html.split("</td>") if ">" in part)
+            elements.append(_element(rng, page, "Table", text, 150, y, 1400, 800, text_as_html=html))
+    return elements
+
+
+def image_heavy(image_dir, pages=10, seed=0, images_per_page=3):
+    """
+    Pages with a caption and several pictures written to image_dir: distinct images,
+    repeats of a logo that should be described once, and tiny decorative fragments.
+    """
+    rng = random.Random(seed)
+    os.makedirs(image_dir, exist_ok=True)
+
+    logo_path = os.path.join(image_dir, f"logo-{seed}.png")
+    _write_image(rng, logo_path, 300, 300)
+
+    elements = []
+    for page in range(1, pages + 1):
+        elements.append(_element(rng, page, "NarrativeText", _sentence(rng), 150, 120, 1400, 60))
+        elements.append(_element(rng, page, "Image", "", 1350, 50, 200, 200, image_path=logo_path))
+        for idx in range(images_per_page):
+            image_path = os.path.join(image_dir, f"figure-{seed}-{page}-{idx}.jpg")
+            _write_image(rng, image_path, rng.randint(600, 2400), rng.randint(400, 1800))
+            y = 300 + idx * 600
+            elements.append(_element(rng, page, "Image", "", 150, y, 1400, 550, image_path=image_path))
+        bullet_path = os.path.join(image_dir, f"bullet-{seed}-{page}.png")
+        _write_image(rng, bullet_path, 16, 16)
+        elements.append(_element(rng, page, "Image", "", 100, 2100, 20, 20, image_path=bullet_path))
+    return elements
+
+
+def dense_layout(pages=5, seed=0, boxes_per_page=400):
+    """
+    Pages of many small, partly overlapping text fragments, as OCR produces on scans.
+    """
+    rng = random.Random(seed)
+    elements = []
+    for page in range(1, pages + 1):
+        for _ in range(boxes_per_page):
+            x = rng.uniform(0, LAYOUT_WIDTH - 200)
+            y = rng.uniform(0, LAYOUT_HEIGHT - 40)
+            text = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 6)))
+            elements.append(_element(rng, page, "NarrativeText", text, x, y, rng.uniform(40, 400), rng.uniform(15, 40)))
+    return elements
+
+
+def _write_image(rng, path, width, height):
+    # Smooth gradients with noise compress like real figures, unlike pure noise
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    overlay = Image.frombytes("L", (width, height), rng.randbytes(width * height)).convert("RGB")
+    Image.blend(image, overlay, 0.3).save(path)
@@ -0,0 +1,293 @@
+"""
+Offline benchmark suite: runs the pipeline stages on synthetic fixtures against the local
+mock OpenAI server and writes throughput and peak memory per stage as JSON.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --latency 0.3 --error-rate 0.1 --only overlap,ppt
+    python -m benchmarks.run --output new.json --compare results.json
+
+Caches (partitions, embeddings, LLM responses, Chroma) are pointed at a temporary
+directory, so every run measures the uncached path.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import fixtures
+from mock_openai_server import start_mock_server
+
+QUESTIONS = [
+    "What was the revenue growth compared with the previous year?",
+    "Summarize the main risks mentioned in the report.",
+    "Which segment had the highest margin?",
+    "What does the cash flow analysis show?",
+    "What is the forecast for the next quarter?",
+]
+
+
+def measure(name, fn, items, unit):
+    """
+    Run fn once and record wall time, throughput and peak traced memory.
+    Peak memory comes from tracemalloc, which also slows Python code down; timings are
+    meant to be compared between runs of this suite, not against production.
+    """
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "name": name,
+        "seconds": round(seconds, 4),
+        "items": items,
+        "unit": unit,
+        "items_per_second": round(items / seconds, 2) if seconds else None,
+        "peak_memory_mb": round(peak / 1e6, 2),
+    }
+    print(f"{name:<28} {seconds:8.3f}s {result['items_per_second'] or 0:10.1f} {unit}/s {result['peak_memory_mb']:8.1f} MB")
+    return result
+
+
+def bench_chunk_elements(args, work_dir):
+    from processing import chunk_elements
+
+    elements = fixtures.text_heavy(args.pages, seed=1) + fixtures.table_heavy(args.pages, seed=1)
+    return measure("chunk_elements", lambda: chunk_elements(elements, fixtures.FILENAME), len(elements), "elements")
+
+
+def bench_create_documents(args, work_dir):
+    from processing import chunk_elements, create_documents
+
+    elements = (
+        fixtures.text_heavy(args.pages, seed=2)
+        + fixtures.table_heavy(max(1, args.pages // 4), seed=2)
+        + fixtures.image_heavy(os.path.join(work_dir, "documents"), max(1, args.pages // 4), seed=2)
+    )
+    chunks = chunk_elements(elements, fixtures.FILENAME)
+    return measure("create_documents", lambda: asyncio.run(create_documents(chunks)), len(chunks), "chunks")
+
+
+def bench_image_descriptions(args, work_dir):
+    from processing import get_image_descriptions_batched_async
+
+    elements = fixtures.image_heavy(os.path.join(work_dir, "images"), args.pages, seed=3)
+    image_objects = [element["metadata"] for element in elements if element["type"] == "Image"]
+    return measure(
+        "image_descriptions",
+        lambda: asyncio.run(get_image_descriptions_batched_async(image_objects)),
+        len(image_objects),
+        "images",
+    )
+
+
+def bench_overlap(args, work_dir):
+    from overlap_utils import adjust_overlapping_objects_in_ppt, find_unique_overlapping_and_non_overlapping_objects
+    from ppt_utils import organize_data_by_page
+
+    pages = organize_data_by_page(fixtures.dense_layout(max(1, args.pages // 4), seed=4))
+
+    def run():
+        for page_data in pages:
+            overlaps, _ = find_unique_overlapping_and_non_overlapping_objects(copy.deepcopy(page_data))
+            adjust_overlapping_objects_in_ppt(overlaps)
+
+    return measure("overlap", run, sum(len(page) for page in pages), "boxes")
+
+
+def bench_create_ppt(args, work_dir):
+    from ppt_utils import create_ppt_demo
+
+    elements = (
+        fixtures.text_heavy(args.pages, seed=5)
+        + fixtures.dense_layout(max(1, args.pages // 4), seed=5, boxes_per_page=150)
+        + fixtures.image_heavy(os.path.join(work_dir, "ppt"), max(1, args.pages // 4), seed=5)
+    )
+    pages = len({element["metadata"]["page_number"] for element in elements})
+    return measure("create_ppt_demo", lambda: create_ppt_demo(elements), pages, "slides")
+
+
+def bench_query(args, work_dir):
+    from llama_index.core import Document
+
+    from constants import DEFAULT_SYSTEM_PROMPT, GENERAL_RAG_PROMPT, RETRIEVAL_TOP_K
+    from context_packing import pack_context
+    from processing import astream_openai_api, chunk_elements
+    from rag import get_query_engine_from_documents
+    from vector_store import drop_collection, open_collection
+
+    chunks = chunk_elements(fixtures.text_heavy(args.pages, seed=6), fixtures.FILENAME)
+    documents = [
+        Document(doc_id=str(idx), text=chunk["text"], metadata={"filename": fixtures.FILENAME, "page_number": chunk["metadata"]["page_number"]})
+        for idx, chunk in enumerate(chunks)
+    ]
+    collection_name = f"bench-{os.getpid()}"
+    results = []
+    try:
+        collection = open_collection(collection_name)
+        query_engines = []
+        results.append(measure(
+            "index_documents",
+            lambda: query_engines.append(get_query_engine_from_documents(collection, documents, top_k=RETRIEVAL_TOP_K)),
+            len(documents),
+            "documents",
+        ))
+        query_engine = query_engines[0]
+
+        async def answer_all():
+            for question in QUESTIONS:
+                context_str, _, _ = pack_context(query_engine.query(question))
+                prompt = GENERAL_RAG_PROMPT.format(question=question, context=context_str)
+                async for _ in astream_openai_api(prompt, DEFAULT_SYSTEM_PROMPT, model="gpt-4o"):
+                    pass
+
+        results.append(measure("query_answering", lambda: asyncio.run(answer_all()), len(QUESTIONS), "questions"))
+    finally:
+        drop_collection(collection_name)
+    return results
+
+
+def bench_startup(args, work_dir):
+    # Each import in a fresh interpreter: what a new app or worker process pays before its first request
+    results = []
+    for module_name in ("app_modules", "sidebar", "worker", "streaming_ingest", "partitioning", "ppt_utils"):
+        if module_name == "app_modules":
+            imports = "import constants, context_packing, instrumentation, jobs, resources"
+        else:
+            imports = f"import {module_name}"
+        code = (
+            "import resource, time; start = time.perf_counter(); " + imports + "; "
+            "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+        )
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        seconds, max_rss_kb = output.strip().splitlines()[-1].split()
+        seconds = float(seconds)
+        result = {
+            "name": f"import_{module_name}",
+            "seconds": round(seconds, 4),
+            "items": 1,
+            "unit": "imports",
+            "items_per_second": round(1 / seconds, 2) if seconds else None,
+            "peak_memory_mb": round(int(max_rss_kb) / 1e3, 2),
+        }
+        print(f"{result['name']:<28} {seconds:8.3f}s {'':>17} {result['peak_memory_mb']:8.1f} MB rss")
+        results.append(result)
+    return results
+
+
+BENCHMARKS = {
+    "chunk": bench_chunk_elements,
+    "documents": bench_create_documents,
+    "images": bench_image_descriptions,
+    "overlap": bench_overlap,
+    "ppt": bench_create_ppt,
+    "query": bench_query,
+    "startup": bench_startup,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (time ratio, <1 is faster):")
+    for result in results:
+        old = baseline.get(result["name"])
+        if old and old["seconds"]:
+            print(
+                f"{result['name']:<28} {result['seconds'] / old['seconds']:6.2f}x time, "
+                f"{result['peak_memory_mb'] - old['peak_memory_mb']:+8.1f} MB peak"
+            )
+
+
+def keep_requests_local():
+    """
+    Make any request that is not for the mock server fail instead of reaching the
+    network: HTTP clients (httpx, requests) send it to a proxy on a closed local port.
+    The tiktoken encodings are loaded first, since tiktoken downloads them once.
+    """
+    import tiktoken
+
+    from constants import CHUNK_TOKENIZER_MODEL, IMAGE_DESCRIPTION_MODEL, TABLE_SUMMARY_MODEL
+
+    tiktoken.get_encoding("cl100k_base")
+    for model in (CHUNK_TOKENIZER_MODEL, IMAGE_DESCRIPTION_MODEL, TABLE_SUMMARY_MODEL):
+        tiktoken.encoding_for_model(model)
+    os.environ.update({
+        "HTTP_PROXY": "http://127.0.0.1:9",
+        "HTTPS_PROXY": "http://127.0.0.1:9",
+        "NO_PROXY": "127.0.0.1,localhost",
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the PDF pipeline")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per synthetic document")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help=f"Comma-separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock server seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests answered with 429")
+    parser.add_argument("--rpm", type=int, default=None, help="Mock server requests per minute before 429s")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="Baseline JSON from an earlier run")
+    args = parser.parse_args()
+
+    server, state, base_url = start_mock_server(
+        rpm=args.rpm, error_rate=args.error_rate, retry_after=0.5, latency=args.latency
+    )
+    work_dir = tempfile.mkdtemp(prefix="infi-bench-")
+    # Set before the project modules are imported: they read these at import time
+    os.environ.update({
+        # The openai client reads OPENAI_BASE_URL, llama_index's OpenAI classes OPENAI_API_BASE
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_BASE": base_url,
+        "OPENAI_API_KEY": "mock",
+        "PARTITION_CACHE_DIR": os.path.join(work_dir, "partitions"),
+        "EMBEDDING_CACHE_DIR": os.path.join(work_dir, "embeddings"),
+        "LLM_CACHE_PATH": os.path.join(work_dir, "llm_responses.sqlite"),
+        "CHROMA_PERSIST_DIR": os.path.join(work_dir, "chroma"),
+        "METRICS_PROCESS_DIR": os.path.join(work_dir, "metrics"),
+    })
+    keep_requests_local()
+
+    results = []
+    for name in args.only.split(","):
+        result = BENCHMARKS[name.strip()](args, work_dir)
+        results.extend(result if isinstance(result, list) else [result])
+    server.shutdown()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "options": vars(args),
+        "mock_server": {"requests": state.requests, "throttled": state.throttled},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
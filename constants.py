@@ -1,3 +1,5 @@
+import os
+
 DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant. Please answer the following questions to the best of your ability."
 
 IMAGE_FOLDER = "image_blocks"
@@ -14,3 +16,157 @@ Context: \n\n {context}
 
 Answer:
 """
+
+# On-disk cache for partition_pdf output, keyed by PDF content hash plus partition parameters
+PARTITION_CACHE_DIR = os.getenv("PARTITION_CACHE_DIR", ".cache/partitions")
+PARTITION_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Page-parallel hi_res partitioning
+PARTITION_MAX_WORKERS = int(os.getenv("PARTITION_MAX_WORKERS", os.cpu_count() or 1))
+PARTITION_PAGES_PER_RANGE = int(os.getenv("PARTITION_PAGES_PER_RANGE", 10))
+# Layout model of the hi_res strategy, loaded once per partition worker
+LAYOUT_MODEL_NAME = os.getenv("UNSTRUCTURED_HI_RES_MODEL_NAME", "yolox")
+
+# Per-page strategy triage: born-digital text-only pages use the "fast" strategy
+PARTITION_TRIAGE = os.getenv("PARTITION_TRIAGE", "1") == "1"
+TRIAGE_MIN_TEXT_CHARS = 50
+TRIAGE_MAX_CID_RATIO = 0.1
+TRIAGE_TABLE_RULE_THRESHOLD = 6
+
+# Persistent embedding cache, vectors stored as float32 rows per model
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+EMBEDDING_CACHE_MAX_ROWS = 200_000
+# llama_index's default embedding model, named here for cost estimates
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Durable cache of table summaries and image descriptions
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite")
+TABLE_SUMMARY_MODEL = "gpt-4o"
+IMAGE_DESCRIPTION_MODEL = "gpt-4o-mini"
+
+# Shared OpenAI HTTP connection pool
+OPENAI_MAX_CONNECTIONS = 50
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 20
+OPENAI_TIMEOUT_SECONDS = 120
+
+# Request scheduling against the OpenAI account limits (requests and tokens per minute)
+OPENAI_RATE_LIMITS = {
+    "gpt-4o": {"rpm": 5000, "tpm": 800_000},
+    "gpt-4o-mini": {"rpm": 5000, "tpm": 4_000_000},
+}
+OPENAI_DEFAULT_RATE_LIMIT = {"rpm": 500, "tpm": 200_000}
+OPENAI_MAX_CONCURRENCY = 16
+OPENAI_MIN_CONCURRENCY = 1
+OPENAI_MAX_RETRIES = 6
+OPENAI_BACKOFF_BASE_SECONDS = 1.0
+OPENAI_BACKOFF_MAX_SECONDS = 60.0
+# Rough vision cost used when estimating tokens for a request with images
+IMAGE_TOKEN_ESTIMATE = 765
+
+# Image preprocessing before vision calls
+IMAGE_MIN_SIDE_PX = 40
+IMAGE_MIN_AREA_PX = 5000
+IMAGE_MAX_LONG_SIDE_PX = 2048
+IMAGE_MAX_SHORT_SIDE_PX = 768
+IMAGE_JPEG_QUALITY = 85
+# Identical images share a description. Near-duplicates (dHash within MAX_DISTANCE bits)
+# only do for detailed images of the same aspect ratio whose grayscale thumbnails differ
+# by at most MAX_PIXEL_DIFF on average (0-255); plain figures look alike to a 64-bit hash
+IMAGE_DUPLICATE_MAX_DISTANCE = 5
+IMAGE_DUPLICATE_MIN_DETAIL = 16
+IMAGE_DUPLICATE_MAX_ASPECT_DIFF = 0.02
+IMAGE_DUPLICATE_THUMBNAIL_PX = 128
+IMAGE_DUPLICATE_MAX_PIXEL_DIFF = 1.5
+
+# Packing images into vision requests by estimated token cost
+# (base tokens, tokens per 512px tile) per model for high-detail images
+VISION_TOKEN_COSTS = {
+    "gpt-4o": (85, 170),
+    "gpt-4o-mini": (2833, 5667),
+}
+IMAGE_BATCH_TOKEN_BUDGET = 100_000
+IMAGE_BATCH_MAX_IMAGES = 10
+IMAGE_DESCRIPTION_MAX_TOKENS_PER_IMAGE = 300
+IMAGE_DESCRIPTION_MAX_ATTEMPTS = 3
+
+# Image description pipeline: images are prepared in a thread pool and fed to a fixed
+# number of in-flight requests through a bounded queue of batches
+IMAGE_PREPARE_WORKERS = int(os.getenv("IMAGE_PREPARE_WORKERS", min(4, os.cpu_count() or 1)))
+IMAGE_DESCRIPTION_CONCURRENCY = int(os.getenv("IMAGE_DESCRIPTION_CONCURRENCY", 4))
+IMAGE_PIPELINE_QUEUE_BATCHES = 2
+
+# Persistent per-document Chroma collections
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", ".cache/chroma")
+CHROMA_MAX_COLLECTIONS = 50
+CHROMA_COLLECTION_TTL_SECONDS = 7 * 24 * 3600
+
+# Fitting text into slide text boxes
+PPT_FONT_NAME = "Calibri"
+PPT_MAX_FONT_SIZE = 36
+PPT_MIN_FONT_SIZE = 6
+PPT_LINE_SPACING = 1.2
+
+# Building decks: page layouts are computed in a process pool for larger documents
+PPT_MAX_WORKERS = int(os.getenv("PPT_MAX_WORKERS", os.cpu_count() or 1))
+PPT_PARALLEL_MIN_PAGES = int(os.getenv("PPT_PARALLEL_MIN_PAGES", 8))
+
+# Pictures embedded in generated decks are resampled to their box at this resolution
+PPT_IMAGE_DPI = int(os.getenv("PPT_IMAGE_DPI", 150))
+PPT_IMAGE_JPEG_QUALITY = 85
+# st.download_button reads the whole deck into the app's memory on every rerun, so decks
+# above this size are not offered for download in the UI
+PPT_DOWNLOAD_MAX_BYTES = int(os.getenv("PPT_DOWNLOAD_MAX_BYTES", 200 * 1024 * 1024))
+
+# Packing retrieved chunks into the answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+# Chunks whose word 5-gram Jaccard similarity to an already selected chunk reaches this are dropped
+CONTEXT_DUPLICATE_THRESHOLD = 0.6
+
+# Stage spans are appended here as JSON lines (empty disables) and served on METRICS_PORT
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH", ".cache/metrics/spans.jsonl")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0)) or None
+# Local only by default; set to 0.0.0.0 for a scraper on another host
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# The span log is rotated to METRICS_LOG_PATH + ".1" once it grows past this
+METRICS_LOG_MAX_BYTES = int(os.getenv("METRICS_LOG_MAX_BYTES", 50 * 1024 * 1024))
+# Every process (app, job workers, ingest CLI) writes its stage aggregates here, and
+# /metrics serves their sum; files of processes gone for the retention time are removed
+METRICS_PROCESS_DIR = os.getenv("METRICS_PROCESS_DIR", ".cache/metrics/processes")
+METRICS_FLUSH_SECONDS = 5
+METRICS_PROCESS_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Chunking text elements by model tokens; a Title always starts a new chunk
+CHUNK_TOKENIZER_MODEL = "text-embedding-3-small"
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 512))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 64))
+# Chunks retrieved per question, before context packing
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+
+# Background jobs (ingest, PPT conversion) queued in SQLite and run by worker processes
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", ".cache/jobs/jobs.sqlite")
+JOBS_FILES_DIR = os.getenv("JOBS_FILES_DIR", ".cache/jobs/files")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# The app starts JOB_WORKERS worker processes itself unless workers run separately (python worker.py)
+JOBS_EMBEDDED_WORKERS = os.getenv("JOBS_EMBEDDED_WORKERS", "1") == "1"
+JOBS_POLL_SECONDS = 1.0
+JOBS_HEARTBEAT_SECONDS = 15
+JOBS_STALE_SECONDS = 120
+JOBS_RETENTION_SECONDS = 24 * 3600
+
+# Page manifests of ingested documents, to re-ingest only the changed pages of a revision
+MANIFEST_DIR = os.getenv("MANIFEST_DIR", ".cache/manifests")
+
+# Load the Chroma client, the layout model and the heavy modules when a process starts,
+# instead of on its first request
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+
+# Headless batch ingestion (ingest_cli.py)
+INGEST_CLI_CHECKPOINT = os.getenv("INGEST_CLI_CHECKPOINT", ".cache/ingest_cli/checkpoint.jsonl")
+INGEST_CLI_WORKERS = int(os.getenv("INGEST_CLI_WORKERS", min(4, os.cpu_count() or 1)))
+# USD per million (input, output) tokens, for the cost estimate of a run
+OPENAI_PRICES_PER_MILLION_TOKENS = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-ada-002": (0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+}
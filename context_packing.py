@@ -0,0 +1,82 @@
+from constants import CONTEXT_DUPLICATE_THRESHOLD, CONTEXT_TOKEN_BUDGET
+from instrumentation import count, traced
+from rate_limiter import count_tokens
+
+CONTEXT_SEPARATOR = "\n\n"
+
+
+def shingles(text, size=5):
+    """
+    Set of word n-grams of text, lower-cased, for near-duplicate detection.
+    Texts shorter than size words give a single shingle of all their words.
+    """
+    words = text.lower().split()
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[idx:idx + size]) for idx in range(len(words) - size + 1)}
+
+
+def jaccard_similarity(set1, set2):
+    if not set1 or not set2:
+        return 0.0
+    return len(set1 & set2) / len(set1 | set2)
+
+
+@traced("pack_context")
+def pack_context(chunks, token_budget=CONTEXT_TOKEN_BUDGET, model="gpt-4o",
+                 duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD):
+    """
+    Select retrieved chunks for the answer prompt.
+
+    Chunks are taken in descending score order. Near-duplicates of an already selected
+    chunk are dropped, and chunks that would overflow the token budget are skipped while
+    smaller ones further down may still fill it.
+
+    Args:
+        chunks (list): Chunk dicts with content, score and metadata, as returned by the query engine.
+        token_budget (int): Maximum tokens of the packed context.
+        model (str): Model whose tokenizer is used for counting.
+        duplicate_threshold (float): Shingle Jaccard similarity at which a chunk counts as a duplicate.
+
+    Returns:
+        tuple: (context string, selected chunks, report dict with candidates, selected,
+        dropped_duplicates, dropped_budget and tokens)
+    """
+    ranked = sorted(chunks, key=lambda chunk: chunk.get("score") or 0.0, reverse=True)
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR, model)
+
+    selected = []
+    selected_shingles = []
+    tokens = 0
+    dropped_duplicates = 0
+    dropped_budget = 0
+    for chunk in ranked:
+        content = chunk.get("content") or ""
+        if not content.strip():
+            continue
+
+        chunk_shingles = shingles(content)
+        if any(jaccard_similarity(chunk_shingles, other) >= duplicate_threshold for other in selected_shingles):
+            dropped_duplicates += 1
+            continue
+
+        chunk_tokens = count_tokens(content, model) + (separator_tokens if selected else 0)
+        if tokens + chunk_tokens > token_budget:
+            dropped_budget += 1
+            continue
+
+        selected.append(chunk)
+        selected_shingles.append(chunk_shingles)
+        tokens += chunk_tokens
+
+    context_str = CONTEXT_SEPARATOR.join(chunk.get("content") for chunk in selected)
+    report = {
+        "candidates": len(chunks),
+        "selected": len(selected),
+        "dropped_duplicates": dropped_duplicates,
+        "dropped_budget": dropped_budget,
+        "tokens": count_tokens(context_str, model),
+    }
+    for name, value in report.items():
+        count(name, value)
+    return context_str, selected, report
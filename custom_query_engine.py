@@ -1,11 +1,14 @@
 from llama_index.core.query_engine import CustomQueryEngine
 from llama_index.core.retrievers import BaseRetriever
 
+from instrumentation import count, traced
+
 class RAGStringQueryEngine(CustomQueryEngine):
     """RAG String Query Engine."""
 
     retriever: BaseRetriever
 
+    @traced("retrieve")
     def custom_query(self, query_str):
         """
         Call the custom query engine.
@@ -26,4 +29,5 @@ class RAGStringQueryEngine(CustomQueryEngine):
                 }
             )
 
+        count("chunks", len(chunks))
         return chunks
\ No newline at end of file
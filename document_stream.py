@@ -0,0 +1,86 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+
+from constants import IMAGE_FOLDER
+from instrumentation import span
+from partitioning import iter_partitioned_ranges
+from processing import chunk_elements, create_documents
+
+
+async def stream_documents(file, filename, image_output_dir=IMAGE_FOLDER, prefetch=2, partition_report=None,
+                           page_offset=0, doc_id_prefix=""):
+    """
+    Async iterator over the documents of a PDF, one page range at a time.
+
+    Partitioning runs in a background thread and stays up to `prefetch` ranges ahead, so
+    the LLM calls for one range overlap with the layout work for the next ones.
+
+    When file holds only some pages of a larger document, page_offset shifts the page
+    numbers to the pages of that document and doc_id_prefix keeps the doc ids apart
+    from those of its other parts.
+
+    Yields:
+        tuple: (last page number of the range, documents of the range)
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer has stopped: its loop may be closed by then
+        if stop.is_set():
+            return
+        try:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        except RuntimeError:
+            return
+        while not stop.is_set():
+            try:
+                future.result(timeout=0.1)
+                return
+            except concurrent.futures.TimeoutError:
+                pass
+        future.cancel()
+
+    def produce():
+        ranges = iter_partitioned_ranges(file, image_output_dir, report=partition_report, stop=stop)
+        try:
+            with span("partition", filename=filename):
+                for item in ranges:
+                    if stop.is_set():
+                        return
+                    put(item)
+            item = None
+        except Exception as e:
+            item = e
+        finally:
+            ranges.close()
+        put(item)
+
+    # A daemon thread rather than the loop's executor: on an early stop nobody waits for
+    # the range in flight, which asyncio.run would do for executor threads on shutdown.
+    # The copied context makes the partition span a child of the ingest span.
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), name="partition-producer", daemon=True).start()
+    batch_index = 0
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            end_page, elements_list = item
+            if page_offset:
+                for element in elements_list:
+                    metadata = element.setdefault("metadata", {})
+                    if metadata.get("page_number") is not None:
+                        metadata["page_number"] += page_offset
+            chunks = chunk_elements(elements_list, filename)
+            documents = await create_documents(chunks, doc_id_prefix=f"{doc_id_prefix}{batch_index}-")
+            batch_index += 1
+            yield end_page + page_offset, documents
+    finally:
+        # The producer stops at the next range boundary; the range in flight is not awaited
+        stop.set()
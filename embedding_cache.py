@@ -0,0 +1,256 @@
+import fcntl
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.openai import OpenAIEmbedding
+
+from constants import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_ROWS
+from instrumentation import count, traced
+from rate_limiter import count_tokens
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model, hash of normalized text).
+
+    Vectors live in one float32 file per model, one fixed-size row per text; a SQLite
+    index maps keys to rows and tracks last use. When a model goes over max_rows the file
+    is compacted down to the most recently used rows.
+
+    The app, the job workers and the ingest CLI share the cache: appends hold an
+    exclusive lock on a lock file next to the index, so two processes never hand out the
+    same rows.
+    """
+
+    def __init__(self, cache_dir=EMBEDDING_CACHE_DIR, max_rows=EMBEDDING_CACHE_MAX_ROWS):
+        self.cache_dir = cache_dir
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock_path = os.path.join(self.cache_dir, "cache.lock")
+        # Shared with other processes: wait for their writes, and WAL keeps readers from blocking on them
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "model TEXT NOT NULL, key TEXT NOT NULL, row INTEGER NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, key))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, dim INTEGER NOT NULL)")
+        self._conn.commit()
+
+    @contextmanager
+    def _file_lock(self, mode):
+        # Cross-process lock (fcntl.LOCK_EX or LOCK_SH) on the vectors files and their rows
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _vectors_path(self, model):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        return os.path.join(self.cache_dir, f"{safe_name}.f32")
+
+    def _dim(self, model):
+        row = self._conn.execute("SELECT dim FROM models WHERE model = ?", (model,)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, model, texts):
+        """
+        Look up embeddings for texts.
+
+        Returns:
+            list: One embedding (list of floats) or None per text.
+        """
+        keys = [text_hash(text) for text in texts]
+        results = [None] * len(texts)
+        # Shared lock: rows and file are read together, never halfway through a compaction
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            dim = self._dim(model)
+            if dim is not None:
+                rows = {}
+                for key in set(keys):
+                    found = self._conn.execute(
+                        "SELECT row FROM entries WHERE model = ? AND key = ?", (model, key)
+                    ).fetchone()
+                    if found:
+                        rows[key] = found[0]
+                vectors_path = self._vectors_path(model)
+                row_count = os.path.getsize(vectors_path) // (4 * dim) if os.path.exists(vectors_path) else 0
+                # A row past the end of the file is treated as a miss, never read
+                rows = {key: row for key, row in rows.items() if row < row_count}
+                if rows:
+                    vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(row_count, dim))
+                    for idx, key in enumerate(keys):
+                        if key in rows:
+                            results[idx] = vectors[rows[key]].tolist()
+                    del vectors
+                    now = time.time()
+                    self._conn.executemany(
+                        "UPDATE entries SET last_used = ? WHERE model = ? AND key = ?",
+                        [(now, model, key) for key in rows],
+                    )
+                    self._conn.commit()
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(texts) - hits
+        return results
+
+    def put_many(self, model, texts, embeddings):
+        """
+        Append embeddings for texts that are not cached yet.
+        """
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            dim = self._dim(model)
+            if dim is None:
+                dim = len(embeddings[0])
+                self._conn.execute("INSERT OR IGNORE INTO models (model, dim) VALUES (?, ?)", (model, dim))
+                dim = self._dim(model)
+
+            vectors_path = self._vectors_path(model)
+            next_row = os.path.getsize(vectors_path) // (4 * dim) if os.path.exists(vectors_path) else 0
+            new_rows = []
+            new_vectors = []
+            seen = set()
+            for text, embedding in zip(texts, embeddings):
+                key = text_hash(text)
+                if key in seen or self._conn.execute(
+                    "SELECT 1 FROM entries WHERE model = ? AND key = ?", (model, key)
+                ).fetchone():
+                    continue
+                seen.add(key)
+                new_rows.append((model, key, next_row + len(new_rows), time.time()))
+                new_vectors.append(embedding)
+
+            if new_vectors:
+                with open(vectors_path, "ab") as f:
+                    # Drop the partial row a writer killed mid-append may have left
+                    f.truncate(next_row * 4 * dim)
+                    f.write(np.asarray(new_vectors, dtype=np.float32).tobytes())
+                self._conn.executemany(
+                    "INSERT INTO entries (model, key, row, last_used) VALUES (?, ?, ?, ?)", new_rows
+                )
+            self._conn.commit()
+
+            count = self._conn.execute("SELECT COUNT(*) FROM entries WHERE model = ?", (model,)).fetchone()[0]
+            if count > self.max_rows:
+                self._compact(model, dim)
+
+    def _compact(self, model, dim):
+        """
+        Keep the most recently used rows (90% of max_rows) and rewrite the vectors file.
+        Runs under the exclusive file lock of put_many, so no other process reads or
+        appends to the file while its rows are renumbered.
+        """
+        keep = int(self.max_rows * 0.9)
+        kept = self._conn.execute(
+            "SELECT key, row, last_used FROM entries WHERE model = ? ORDER BY last_used DESC LIMIT ?", (model, keep)
+        ).fetchall()
+        vectors_path = self._vectors_path(model)
+        vectors = np.memmap(vectors_path, dtype=np.float32, mode="r").reshape(-1, dim)
+        compacted = np.ascontiguousarray(vectors[[row for _, row, _ in kept]], dtype=np.float32).reshape(-1, dim)
+        del vectors
+
+        tmp_path = vectors_path + ".tmp"
+        compacted.tofile(tmp_path)
+        # Index and file change together: readers wait on the file lock for both
+        self._conn.execute("DELETE FROM entries WHERE model = ?", (model,))
+        self._conn.executemany(
+            "INSERT INTO entries (model, key, row, last_used) VALUES (?, ?, ?, ?)",
+            [(model, key, new_row, last_used) for new_row, (key, _, last_used) in enumerate(kept)],
+        )
+        os.replace(tmp_path, vectors_path)
+        self._conn.commit()
+        print(f"Compacted embedding cache for {model} to {len(kept)} rows")
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+embedding_cache = EmbeddingCache()
+
+
+class CachedOpenAIEmbedding(OpenAIEmbedding):
+    """
+    OpenAIEmbedding that only sends cache misses to the API.
+    Both document and query embeddings go through the cache.
+    """
+
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self._cache = cache or embedding_cache
+
+    def _cache_model(self):
+        return f"{self.model_name}:{self.dimensions}"
+
+    def _split_misses(self, texts):
+        embeddings = self._cache.get_many(self._cache_model(), texts)
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        count("texts", len(texts))
+        count("cache_hits", len(texts) - len(missing))
+        return embeddings, missing
+
+    def _fill_misses(self, texts, embeddings, missing, new_embeddings):
+        if not missing:
+            return embeddings
+        count("embedding_tokens", sum(count_tokens(texts[idx], self.model_name) for idx in missing))
+        self._cache.put_many(self._cache_model(), [texts[idx] for idx in missing], new_embeddings)
+        for idx, embedding in zip(missing, new_embeddings):
+            embeddings[idx] = embedding
+        return embeddings
+
+    @traced("embed")
+    def _get_text_embeddings(self, texts):
+        embeddings, missing = self._split_misses(texts)
+        new_embeddings = super()._get_text_embeddings([texts[idx] for idx in missing]) if missing else []
+        return self._fill_misses(texts, embeddings, missing, new_embeddings)
+
+    @traced("embed")
+    async def _aget_text_embeddings(self, texts):
+        embeddings, missing = self._split_misses(texts)
+        new_embeddings = await super()._aget_text_embeddings([texts[idx] for idx in missing]) if missing else []
+        return self._fill_misses(texts, embeddings, missing, new_embeddings)
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text):
+        return (await self._aget_text_embeddings([text]))[0]
+
+    @traced("embed")
+    def _get_query_embedding(self, query):
+        embeddings, missing = self._split_misses([query])
+        if missing:
+            return self._fill_misses([query], embeddings, missing, [super()._get_query_embedding(query)])[0]
+        return embeddings[0]
+
+    @traced("embed")
+    async def _aget_query_embedding(self, query):
+        embeddings, missing = self._split_misses([query])
+        if missing:
+            new_embedding = await super()._aget_query_embedding(query)
+            return self._fill_misses([query], embeddings, missing, [new_embedding])[0]
+        return embeddings[0]
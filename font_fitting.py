@@ -0,0 +1,139 @@
+from functools import lru_cache
+
+from PIL import ImageFont
+
+from constants import PPT_FONT_NAME, PPT_LINE_SPACING, PPT_MAX_FONT_SIZE, PPT_MIN_FONT_SIZE
+
+# Approximate advance widths (in em) used when the font file is not installed,
+# close to Calibri's metrics
+_FALLBACK_WIDTHS = [
+    (" ", 0.226),
+    ("ijlI.,;:'!|`", 0.23),
+    ("frt()[]{}\"-/\\", 0.33),
+    ("mwMW%@", 0.82),
+    ("ABCDEFGHJKLNOPQRSTUVXYZ&", 0.58),
+    ("0123456789", 0.507),
+]
+_FALLBACK_DEFAULT_WIDTH = 0.48
+
+# Text box insets python-pptx leaves by default: 0.1" left/right, 0.05" top/bottom
+_INSET_X_INCH = 0.2
+_INSET_Y_INCH = 0.1
+
+
+@lru_cache(maxsize=None)
+def char_width_table(font_name=PPT_FONT_NAME):
+    """
+    Advance widths of the printable ASCII characters in em, measured once per font from
+    its TrueType file when available, otherwise taken from a built-in approximation.
+
+    Returns:
+        tuple: (widths dict, width used for characters outside the table)
+    """
+    try:
+        font = ImageFont.truetype(f"{font_name.lower()}.ttf", 1000)
+        widths = {chr(code): font.getlength(chr(code)) / 1000 for code in range(32, 127)}
+        return widths, widths["n"]
+    except OSError:
+        widths = {}
+        for chars, width in _FALLBACK_WIDTHS:
+            for char in chars:
+                widths[char] = width
+        return widths, _FALLBACK_DEFAULT_WIDTH
+
+
+class TextMeasurer:
+    """
+    Measures text in em for one font, caching word widths so that all the text boxes of
+    a slide (and every font size tried for them) share the work.
+    """
+
+    def __init__(self, font_name=PPT_FONT_NAME):
+        self.widths, self.default_width = char_width_table(font_name)
+        self.space_width = self.widths.get(" ", self.default_width)
+        self._word_widths = {}
+
+    def word_width(self, word):
+        width = self._word_widths.get(word)
+        if width is None:
+            width = sum(self.widths.get(char, self.default_width) for char in word)
+            self._word_widths[word] = width
+        return width
+
+    def paragraph_words(self, text):
+        return [[self.word_width(word) for word in paragraph.split()] for paragraph in text.split("\n")]
+
+    def count_lines(self, paragraphs, max_width_em):
+        """
+        Lines needed to word-wrap the paragraphs (lists of word widths) at max_width_em.
+        Returns None when a single word is wider than the line.
+        """
+        lines = 0
+        for words in paragraphs:
+            lines += 1
+            line_width = 0.0
+            for width in words:
+                if width > max_width_em:
+                    return None
+                if line_width == 0.0:
+                    line_width = width
+                elif line_width + self.space_width + width <= max_width_em:
+                    line_width += self.space_width + width
+                else:
+                    lines += 1
+                    line_width = width
+        return lines
+
+
+def _fits(measurer, paragraphs, font_size, width_inch, height_inch):
+    em_inch = font_size / 72
+    lines = measurer.count_lines(paragraphs, width_inch / em_inch)
+    return lines is not None and lines * PPT_LINE_SPACING * em_inch <= height_inch
+
+
+def fit_font_size(text, width_inch, height_inch, measurer=None,
+                  max_font_size=PPT_MAX_FONT_SIZE, min_font_size=PPT_MIN_FONT_SIZE):
+    """
+    Largest font size at which text, word-wrapped, fits the box.
+
+    Binary search over sizes: wrapping at a larger size never takes fewer lines, so
+    the fit is monotonic. Nothing in the document is touched.
+
+    Args:
+        text (str): Text of the box, paragraphs separated by newlines.
+        width_inch (float): Box width.
+        height_inch (float): Box height.
+        measurer (TextMeasurer): Shared measurer, one is created when omitted.
+
+    Returns:
+        int: Font size in points, min_font_size when nothing fits.
+    """
+    measurer = measurer or TextMeasurer()
+    paragraphs = measurer.paragraph_words(text)
+    width_inch = max(0.0, width_inch - _INSET_X_INCH)
+    height_inch = max(0.0, height_inch - _INSET_Y_INCH)
+
+    low, high = min_font_size, max_font_size
+    best = min_font_size
+    while low <= high:
+        size = (low + high) // 2
+        if _fits(measurer, paragraphs, size, width_inch, height_inch):
+            best = size
+            low = size + 1
+        else:
+            high = size - 1
+    return best
+
+
+def fit_font_sizes(boxes, font_name=PPT_FONT_NAME):
+    """
+    Font sizes for all the text boxes of a slide, sharing one word-width cache.
+
+    Args:
+        boxes (list): (text, width_inch, height_inch) tuples.
+
+    Returns:
+        list: One font size per box.
+    """
+    measurer = TextMeasurer(font_name)
+    return [fit_font_size(text, width, height, measurer) for text, width, height in boxes]
@@ -0,0 +1,204 @@
+import hashlib
+import io
+import math
+
+from PIL import Image, ImageChops, ImageStat
+
+from constants import (
+    IMAGE_DUPLICATE_MAX_ASPECT_DIFF,
+    IMAGE_DUPLICATE_MAX_DISTANCE,
+    IMAGE_DUPLICATE_MAX_PIXEL_DIFF,
+    IMAGE_DUPLICATE_MIN_DETAIL,
+    IMAGE_DUPLICATE_THUMBNAIL_PX,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_MAX_LONG_SIDE_PX,
+    IMAGE_MAX_SHORT_SIDE_PX,
+    IMAGE_MIN_AREA_PX,
+    IMAGE_MIN_SIDE_PX,
+    PPT_IMAGE_DPI,
+    PPT_IMAGE_JPEG_QUALITY,
+)
+
+
+def perceptual_hash(image):
+    """
+    64-bit difference hash: compares neighbouring pixels of a 9x8 grayscale thumbnail,
+    so re-encoded or slightly resized copies of an image hash (nearly) the same.
+    """
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    image_hash = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            image_hash = (image_hash << 1) | (left > right)
+    return image_hash
+
+
+def hamming_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count("1")
+
+
+def image_fingerprint(image):
+    """
+    What DuplicateIndex compares: the dHash, the aspect ratio, a grayscale
+    thumbnail and its standard deviation ("detail"; near zero for mostly blank figures).
+    """
+    thumbnail = image.convert("L").resize((IMAGE_DUPLICATE_THUMBNAIL_PX, IMAGE_DUPLICATE_THUMBNAIL_PX), Image.BOX)
+    return {
+        "phash": perceptual_hash(image),
+        "aspect": image.width / image.height,
+        "thumbnail": thumbnail,
+        "detail": ImageStat.Stat(thumbnail).stddev[0],
+    }
+
+
+def vision_target_size(width, height):
+    """
+    Size the vision model actually looks at in high detail: fit in
+    IMAGE_MAX_LONG_SIDE_PX square, then scale the short side down to IMAGE_MAX_SHORT_SIDE_PX.
+    """
+    scale = min(1.0, IMAGE_MAX_LONG_SIDE_PX / max(width, height))
+    if min(width, height) * scale > IMAGE_MAX_SHORT_SIDE_PX:
+        scale = IMAGE_MAX_SHORT_SIDE_PX / min(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def prepare_image_for_vision(image_path):
+    """
+    Load an extracted image block, downscale it to the vision model's working resolution
+    and recompress it as JPEG.
+
+    Returns:
+        dict | None: fingerprint (see image_fingerprint, plus the sha256 of data), width,
+        height, data (JPEG bytes) and mime type, or None for images below the size
+        threshold (rules, bullets, decorative fragments).
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+        if min(width, height) < IMAGE_MIN_SIDE_PX or width * height < IMAGE_MIN_AREA_PX:
+            return None
+
+        if _has_alpha(image):
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.split()[-1])
+        else:
+            image = image.convert("RGB")
+
+        fingerprint = image_fingerprint(image)
+        target_size = vision_target_size(width, height)
+        if target_size != image.size:
+            image = image.resize(target_size, Image.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+
+    data = output.getvalue()
+    fingerprint["sha256"] = hashlib.sha256(data).hexdigest()
+    return {
+        "fingerprint": fingerprint,
+        "width": target_size[0],
+        "height": target_size[1],
+        "data": data,
+        "mime": "image/jpeg",
+    }
+
+
+def _is_near_duplicate(fingerprint1, fingerprint2):
+    if min(fingerprint1["detail"], fingerprint2["detail"]) < IMAGE_DUPLICATE_MIN_DETAIL:
+        return False
+    if hamming_distance(fingerprint1["phash"], fingerprint2["phash"]) > IMAGE_DUPLICATE_MAX_DISTANCE:
+        return False
+    if abs(fingerprint1["aspect"] / fingerprint2["aspect"] - 1) > IMAGE_DUPLICATE_MAX_ASPECT_DIFF:
+        return False
+    # The hash only sees a 9x8 thumbnail; confirm on a finer one
+    difference = ImageChops.difference(fingerprint1["thumbnail"], fingerprint2["thumbnail"])
+    return ImageStat.Stat(difference).mean[0] <= IMAGE_DUPLICATE_MAX_PIXEL_DIFF
+
+
+class DuplicateIndex:
+    """
+    Groups of identical-looking images, looked up by fingerprint: identical images by
+    sha256, near-duplicates (re-encoded or resized copies) among the groups whose dHash
+    matches in one band. The hash is cut into IMAGE_DUPLICATE_MAX_DISTANCE + 1 bands, so
+    two hashes within that distance always agree on at least one of them.
+    """
+
+    def __init__(self):
+        band_count = IMAGE_DUPLICATE_MAX_DISTANCE + 1
+        bounds = [round(64 * idx / band_count) for idx in range(band_count + 1)]
+        self._bands = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._by_sha256 = {}
+        self._by_band = {}
+        self._order = {}
+
+    def _band_keys(self, image_hash):
+        return [(idx, (image_hash >> start) & mask) for idx, (start, mask) in enumerate(self._bands)]
+
+    def find(self, fingerprint):
+        """
+        Group of an identical image, else the first group of a near-duplicate of the image
+        with this fingerprint.
+
+        Returns:
+            dict | None: The group, or None when the image is new.
+        """
+        group = self._by_sha256.get(fingerprint["sha256"])
+        if group is not None:
+            return group
+        candidates = {}
+        for key in self._band_keys(fingerprint["phash"]):
+            for candidate in self._by_band.get(key, ()):
+                candidates[id(candidate)] = candidate
+        for candidate in sorted(candidates.values(), key=lambda group: self._order[id(group)]):
+            if _is_near_duplicate(candidate["fingerprint"], fingerprint):
+                return candidate
+        return None
+
+    def add(self, group):
+        """
+        Index a new group by the "fingerprint" of its first image.
+        """
+        fingerprint = group["fingerprint"]
+        self._order[id(group)] = len(self._order)
+        self._by_sha256.setdefault(fingerprint["sha256"], group)
+        for key in self._band_keys(fingerprint["phash"]):
+            self._by_band.setdefault(key, []).append(group)
+
+
+def prepare_image_for_slide(image_path, width_inch, height_inch, dpi=PPT_IMAGE_DPI):
+    """
+    Resample an image to the pixels its box on the slide can show at dpi and recompress
+    it: JPEG, or PNG for images with transparency. Images are never upscaled, and the
+    original file is kept when re-encoding would not make it smaller.
+
+    Returns:
+        bytes: Image data to embed.
+    """
+    with open(image_path, "rb") as f:
+        original = f.read()
+
+    with Image.open(io.BytesIO(original)) as image:
+        width, height = image.size
+        target_size = (
+            max(1, min(width, math.ceil(width_inch * dpi))),
+            max(1, min(height, math.ceil(height_inch * dpi))),
+        )
+        if target_size == image.size and image.format in ("JPEG", "PNG"):
+            return original
+
+        output = io.BytesIO()
+        if _has_alpha(image):
+            image = image.convert("RGBA").resize(target_size, Image.LANCZOS)
+            image.save(output, format="PNG", optimize=True)
+        else:
+            image = image.convert("RGB").resize(target_size, Image.LANCZOS)
+            image.save(output, format="JPEG", quality=PPT_IMAGE_JPEG_QUALITY, optimize=True)
+
+    data = output.getvalue()
+    return data if len(data) < len(original) else original
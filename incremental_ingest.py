@@ -0,0 +1,206 @@
+"""
+Incremental re-ingest of revised documents.
+
+Every ingested document leaves a manifest (keyed by its filename) with a fingerprint per
+page and the page range of every indexed document. When a new revision of the file is
+uploaded, its pages are matched to the previous revision by fingerprint: documents whose
+pages are all unchanged are copied over with their embeddings, and only the added or
+changed pages are partitioned, described and embedded again.
+"""
+import hashlib
+import io
+import json
+import os
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+from constants import MANIFEST_DIR
+
+
+# Entries that do not change what a page shows: the link up the page tree, how streams
+# are encoded, metadata, and fonts, whose subsets are renamed on every export (changes to
+# the text they draw show in the content stream and the text layer)
+_IGNORED_KEYS = {"/Parent", "/Length", "/Filter", "/DecodeParms", "/Font", "/Metadata", "/PieceInfo", "/LastModified"}
+
+
+def _stream_data(stream):
+    try:
+        return stream.get_data()
+    except Exception:
+        # Filters pypdf cannot decode: the encoded bytes identify the stream as well
+        return stream._data
+
+
+def _object_digest(obj, memo):
+    # Digest of a PDF object with everything it references. Shared objects (a logo used
+    # on every page) are hashed once per document through memo, keyed by object number
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref not in memo:
+            memo[ref] = "cycle"
+            memo[ref] = _object_digest(obj.get_object(), memo)
+        return memo[ref]
+    digest = hashlib.sha256()
+    if isinstance(obj, StreamObject):
+        digest.update(b"stream:")
+        digest.update(_stream_data(obj))
+    if isinstance(obj, DictionaryObject):
+        for key in sorted(obj):
+            if key not in _IGNORED_KEYS:
+                digest.update(f"{key}=".encode("utf-8"))
+                digest.update(_object_digest(obj.raw_get(key), memo).encode("ascii"))
+    elif isinstance(obj, ArrayObject):
+        digest.update(b"[")
+        for item in obj:
+            digest.update(_object_digest(item, memo).encode("ascii"))
+    else:
+        digest.update(repr(obj).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def page_fingerprints(pdf_bytes):
+    """
+    Fingerprint every page from its text layer, its decoded content stream and every
+    resource it draws, followed recursively: images, form XObjects with their own
+    content and resources, patterns, shadings and graphics states. Changes to vector
+    graphics, inline images or tables drawn as paths therefore change the fingerprint.
+
+    Re-exported pages keep their fingerprint even when the PDF around them changed
+    (object numbers, stream compression, font subsets, metadata).
+
+    Returns:
+        list: Hex digests, one per page.
+    """
+    fingerprints = []
+    memo = {}
+    for page in PdfReader(io.BytesIO(pdf_bytes)).pages:
+        digest = hashlib.sha256()
+        digest.update(" ".join((page.extract_text() or "").split()).encode("utf-8"))
+        contents = page.get_contents()
+        digest.update(b"contents:")
+        digest.update(contents.get_data() if contents is not None else b"")
+        for key in ("/Resources", "/MediaBox", "/CropBox", "/Rotate"):
+            if key in page:
+                digest.update(f"{key}=".encode("utf-8"))
+                digest.update(_object_digest(page.raw_get(key), memo).encode("ascii"))
+        fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+
+def _manifest_path(filename):
+    return os.path.join(MANIFEST_DIR, f"{hashlib.sha256(filename.encode('utf-8')).hexdigest()[:32]}.json")
+
+
+def load_manifest(filename):
+    """
+    Manifest of the last fully ingested revision of a file, or None.
+    """
+    try:
+        with open(_manifest_path(filename)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(filename, collection_name, fingerprints, documents):
+    """
+    Record a fully ingested revision.
+
+    Args:
+        filename (str): Name of the uploaded file, which identifies the document across revisions.
+        collection_name (str): Collection holding the revision.
+        fingerprints (list): Page fingerprints of the revision.
+        documents (dict): doc_id -> [first page, last page] of every indexed document.
+    """
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    path = _manifest_path(filename)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"filename": filename, "collection": collection_name, "pages": fingerprints, "documents": documents}, f)
+    os.replace(path + ".tmp", path)
+
+
+def _match_pages(old_fingerprints, new_fingerprints):
+    # New page -> old page with the same fingerprint, in document order so that a page
+    # inserted in the middle shifts the pages after it instead of scrambling them
+    old_pages = {}
+    for page_number, fingerprint in enumerate(old_fingerprints, start=1):
+        old_pages.setdefault(fingerprint, []).append(page_number)
+    new_to_old = {}
+    last_old_page = 0
+    for page_number, fingerprint in enumerate(new_fingerprints, start=1):
+        candidates = [old_page for old_page in old_pages.get(fingerprint, ()) if old_page > last_old_page]
+        if candidates:
+            new_to_old[page_number] = last_old_page = candidates[0]
+    return new_to_old
+
+
+def page_runs(pages):
+    """
+    Group page numbers into sorted runs of consecutive pages.
+
+    Returns:
+        list: [first page, last page] pairs.
+    """
+    runs = []
+    for page_number in sorted(pages):
+        if runs and runs[-1][1] == page_number - 1:
+            runs[-1][1] = page_number
+        else:
+            runs.append([page_number, page_number])
+    return runs
+
+
+def plan_incremental_ingest(manifest, fingerprints):
+    """
+    Decide which documents of the previous revision can be reused and which pages of the
+    new revision must be processed.
+
+    A document is reused only when all of its pages are unchanged and still consecutive.
+    Chunks may span page boundaries, so a changed page also invalidates every document
+    that shares a page with it, and those pages are processed again too.
+
+    Args:
+        manifest (dict | None): Manifest of the previous revision.
+        fingerprints (list): Page fingerprints of the new revision.
+
+    Returns:
+        dict: "reuse" (doc_id -> page offset to the new revision), "reused_ranges"
+        (doc_id -> [first page, last page] in the new revision), "page_runs" (pages to
+        process) and "reused_pages".
+    """
+    total_pages = len(fingerprints)
+    if not manifest:
+        return {"reuse": {}, "reused_ranges": {}, "page_runs": page_runs(range(1, total_pages + 1)), "reused_pages": 0}
+
+    old_to_new = {old_page: new_page for new_page, old_page in _match_pages(manifest["pages"], fingerprints).items()}
+    to_process = set(range(1, total_pages + 1)) - set(old_to_new.values())
+    documents = {doc_id: (first, last) for doc_id, (first, last) in manifest["documents"].items()}
+
+    reuse = {}
+    changed = True
+    while changed:
+        changed = False
+        reuse = {}
+        for doc_id, (first, last) in documents.items():
+            new_pages = [old_to_new.get(old_page) for old_page in range(first, last + 1)]
+            reusable = all(
+                new_page is not None and new_page == new_pages[0] + idx and new_page not in to_process
+                for idx, new_page in enumerate(new_pages)
+            )
+            if reusable:
+                reuse[doc_id] = new_pages[0] - first
+                continue
+            dirty_pages = {new_page for new_page in new_pages if new_page is not None} - to_process
+            if dirty_pages:
+                to_process |= dirty_pages
+                changed = True
+
+    return {
+        "reuse": reuse,
+        "reused_ranges": {
+            doc_id: [documents[doc_id][0] + offset, documents[doc_id][1] + offset] for doc_id, offset in reuse.items()
+        },
+        "page_runs": page_runs(to_process),
+        "reused_pages": total_pages - len(to_process),
+    }
@@ -0,0 +1,282 @@
+"""
+Headless batch ingestion of a directory of PDFs into the persistent vector store.
+
+    python ingest_cli.py ~/reports --workers 4 --llm-concurrency 16
+    python ingest_cli.py ~/reports --summary run.json    # rerun the same command to resume
+
+Worker processes partition, chunk and describe one file at a time; the requests they
+send to the LLM share one concurrency limit and one set of rate limits. The main process
+embeds each file's documents into the file's own collection, since the embedded Chroma
+store takes writes from one process only. Collections are pinned, so the app never
+evicts them, and every indexed file is appended to the checkpoint: a rerun after a crash
+skips the files already done.
+"""
+__import__('pysqlite3')
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from constants import (
+    EMBEDDING_MODEL,
+    IMAGE_FOLDER,
+    INGEST_CLI_CHECKPOINT,
+    INGEST_CLI_WORKERS,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_PRICES_PER_MILLION_TOKENS,
+    WARMUP_ON_STARTUP,
+)
+from instrumentation import metrics, span
+
+load_dotenv()
+
+
+def find_pdfs(directory):
+    """
+    All PDF files under directory, in a stable order.
+    """
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(".pdf"))
+    return paths
+
+
+def load_checkpoint(path):
+    """
+    Checkpoint entries of the files indexed by earlier runs, by content hash.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A run killed mid-write leaves a partial last line
+                continue
+            if entry.get("status") == "done":
+                done[entry["sha256"]] = entry
+    return done
+
+
+def append_checkpoint(path, entry):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _counter_totals(snapshot):
+    totals = {}
+    for stage in snapshot.values():
+        for name, value in stage["counters"].items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def _init_worker(process_count, request_gate):
+    from rate_limiter import share_limits_across_processes
+
+    share_limits_across_processes(process_count, request_gate)
+    if WARMUP_ON_STARTUP:
+        from resources import get_layout_model
+
+        try:
+            get_layout_model()
+        except Exception as e:
+            print("Layout model warm-up failed", e)
+
+
+def process_file(path):
+    """
+    Worker entry point: the documents of one PDF and the LLM usage spent on them.
+    """
+    from partitioning import count_pdf_pages
+    from rag import build_documents
+
+    with open(path, "rb") as f:
+        pdf_file = io.BytesIO(f.read())
+    pdf_file.name = os.path.basename(path)
+
+    # One file at a time per worker: the growth of the counters is this file's usage
+    before = _counter_totals(metrics.snapshot())
+    # unstructured names image blocks by page only: every file gets its own folder, so
+    # workers do not overwrite, describe or delete each other's figures
+    os.makedirs(IMAGE_FOLDER, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="ingest-cli-", dir=IMAGE_FOLDER) as image_output_dir:
+        # Files are the unit of parallelism here, no page-range pool inside the worker
+        documents = asyncio.run(build_documents(pdf_file, image_output_dir=image_output_dir, parallel=False))
+    after = _counter_totals(metrics.snapshot())
+
+    return {
+        "pages": count_pdf_pages(pdf_file.getvalue()),
+        "documents": [{"doc_id": doc.doc_id, "text": doc.text, "metadata": doc.metadata} for doc in documents],
+        "usage": {name: value - before.get(name, 0) for name, value in after.items() if value != before.get(name, 0)},
+    }
+
+
+def index_documents(collection, documents):
+    """
+    Embed and write a file's documents into its collection, then pin it and mark it complete.
+
+    Returns:
+        dict: Counter growth of the embedding calls (texts, cache_hits, embedding_tokens).
+    """
+    from llama_index.core import Document
+
+    from rag import create_index
+    from vector_store import mark_complete, pin_collection
+
+    before = _counter_totals(metrics.snapshot())
+    create_index(collection, [Document(**document) for document in documents])
+    pin_collection(collection)
+    mark_complete(collection)
+    after = _counter_totals(metrics.snapshot())
+    return {name: value - before.get(name, 0) for name, value in after.items() if value != before.get(name, 0)}
+
+
+def estimate_cost(usage):
+    """
+    USD cost of the LLM and embedding tokens in usage, from OPENAI_PRICES_PER_MILLION_TOKENS.
+    """
+    cost = 0.0
+    for name, value in usage.items():
+        kind, _, model = name.partition(":")
+        if kind in ("prompt_tokens", "completion_tokens") and model in OPENAI_PRICES_PER_MILLION_TOKENS:
+            input_price, output_price = OPENAI_PRICES_PER_MILLION_TOKENS[model]
+            cost += value * (input_price if kind == "prompt_tokens" else output_price) / 1e6
+    input_price, _ = OPENAI_PRICES_PER_MILLION_TOKENS.get(EMBEDDING_MODEL, (0.0, 0.0))
+    cost += usage.get("embedding_tokens", 0) * input_price / 1e6
+    return cost
+
+
+def _add_usage(totals, usage):
+    for name, value in usage.items():
+        totals[name] = totals.get(name, 0) + value
+
+
+def print_summary(summary):
+    print()
+    print(f"Files: {summary['indexed']} indexed, {summary['skipped']} skipped, {summary['failed']} failed")
+    print(f"Pages: {summary['pages']} in {summary['seconds']:.0f}s ({summary['pages_per_second']:.2f} pages/s)")
+    print(f"Documents: {summary['documents']}")
+    usage = summary["usage"]
+    print(
+        f"LLM: {usage.get('llm_calls', 0)} calls, {usage.get('prompt_tokens', 0)} prompt and "
+        f"{usage.get('completion_tokens', 0)} completion tokens; "
+        f"embeddings: {usage.get('embedding_tokens', 0)} tokens"
+    )
+    print(f"Estimated cost: ${summary['cost_usd']:.2f}")
+
+
+def run(directory, workers=INGEST_CLI_WORKERS, llm_concurrency=OPENAI_MAX_CONCURRENCY, checkpoint_path=INGEST_CLI_CHECKPOINT):
+    """
+    Index every PDF under directory that is not indexed yet.
+
+    Returns:
+        dict: Run summary with file counts, pages, pages/s, token usage and estimated cost.
+    """
+    from rag import prepare_collection
+
+    done = load_checkpoint(checkpoint_path)
+    paths = find_pdfs(directory)
+    print(f"Found {len(paths)} PDFs under {directory}, {len(done)} indexed by earlier runs")
+
+    summary = {"indexed": 0, "skipped": 0, "failed": 0, "pages": 0, "documents": 0, "usage": {}}
+    start_time = time.time()
+    context = multiprocessing.get_context("spawn")
+    request_gate = context.BoundedSemaphore(llm_concurrency)
+    pending = {}
+
+    def handle(future):
+        path, sha256, collection, file_start = pending.pop(future)
+        try:
+            result = future.result()
+            with span("ingest", filename=os.path.basename(path), pages=result["pages"]):
+                embedding_usage = index_documents(collection, result["documents"])
+        except Exception as e:
+            print(f"Failed {path}: {type(e).__name__}: {e}")
+            summary["failed"] += 1
+            append_checkpoint(checkpoint_path, {"path": path, "sha256": sha256, "status": "failed", "error": str(e)})
+            return
+        usage = {**result["usage"]}
+        _add_usage(usage, embedding_usage)
+        _add_usage(summary["usage"], usage)
+        summary["indexed"] += 1
+        summary["pages"] += result["pages"]
+        summary["documents"] += len(result["documents"])
+        append_checkpoint(checkpoint_path, {
+            "path": path,
+            "sha256": sha256,
+            "status": "done",
+            "collection": collection.name,
+            "pages": result["pages"],
+            "documents": len(result["documents"]),
+            "seconds": round(time.time() - file_start, 2),
+            "usage": usage,
+        })
+        elapsed = time.time() - start_time
+        print(f"[{summary['indexed'] + summary['failed']}] {path}: {result['pages']} pages, "
+              f"{len(result['documents'])} documents ({summary['pages'] / elapsed:.2f} pages/s overall)")
+
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(workers, request_gate)
+    ) as executor:
+        for path in paths:
+            with open(path, "rb") as f:
+                pdf_bytes = f.read()
+            sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+            if sha256 in done:
+                summary["skipped"] += 1
+                continue
+            # Collections are not evicted: a corpus run keeps every one of them
+            collection, complete = prepare_collection(pdf_bytes, evict=False)
+            if complete:
+                summary["skipped"] += 1
+                continue
+            # Keep a couple of files queued per worker; handle results while the rest run
+            while len(pending) >= 2 * workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    handle(future)
+            pending[executor.submit(process_file, path)] = (path, sha256, collection, time.time())
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                handle(future)
+
+    summary["seconds"] = time.time() - start_time
+    summary["pages_per_second"] = summary["pages"] / summary["seconds"] if summary["seconds"] else 0.0
+    summary["cost_usd"] = round(estimate_cost(summary["usage"]), 4)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index a directory of PDFs into the persistent vector store")
+    parser.add_argument("directory", help="Directory searched recursively for PDFs")
+    parser.add_argument("--workers", type=int, default=INGEST_CLI_WORKERS, help="Worker processes")
+    parser.add_argument("--llm-concurrency", type=int, default=OPENAI_MAX_CONCURRENCY,
+                        help="LLM requests in flight across all workers")
+    parser.add_argument("--checkpoint", default=INGEST_CLI_CHECKPOINT, help="JSON lines file of indexed files")
+    parser.add_argument("--summary", default=None, help="Also write the run summary as JSON to this file")
+    args = parser.parse_args()
+
+    summary = run(args.directory, args.workers, args.llm_concurrency, args.checkpoint)
+    print_summary(summary)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
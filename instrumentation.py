@@ -0,0 +1,338 @@
+"""
+Lightweight tracing for the pipeline stages.
+
+A span times one stage and carries counters (pages, chunks, llm_calls, prompt_tokens,
+cache_hits, retries, ...). Spans nest through a context variable, so stages running in
+asyncio tasks attach to the span that started them. Finished spans are appended to a
+JSON lines file (rotated at METRICS_LOG_MAX_BYTES) and aggregated per stage. Every
+process writes its aggregates to METRICS_PROCESS_DIR, and the Prometheus-style text
+endpoint of the app serves their sum, so the work done in job workers shows up there.
+
+    with span("partition", filename=file.name) as stage:
+        ...
+        stage.count("pages", page_count)
+    count("llm_calls")  # adds to whichever span is current
+"""
+import asyncio
+import atexit
+import contextvars
+import functools
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from constants import (
+    METRICS_FLUSH_SECONDS,
+    METRICS_HOST,
+    METRICS_LOG_MAX_BYTES,
+    METRICS_LOG_PATH,
+    METRICS_PORT,
+    METRICS_PROCESS_DIR,
+    METRICS_PROCESS_RETENTION_SECONDS,
+)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.attributes = attributes or {}
+        self.counters = {}
+        self.error = None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def count(self, name, value=1):
+        # Plain dict update: spans are shared by the tasks of one stage on one event loop,
+        # and the GIL keeps the rare cross-thread update from corrupting the dict
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "trace_id": self.trace_id,
+            "start": round(self.start_time, 6),
+            "duration": round(self.duration, 6) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "counters": self.counters,
+            "error": self.error,
+        }
+
+
+class MetricsRegistry:
+    """
+    Per-stage aggregates of finished spans, the JSON lines export, and the file through
+    which this process shares its aggregates with the /metrics endpoint.
+    """
+
+    def __init__(self, log_path=METRICS_LOG_PATH, process_dir=METRICS_PROCESS_DIR, log_max_bytes=METRICS_LOG_MAX_BYTES):
+        self.log_path = log_path
+        self.process_dir = process_dir
+        self.log_max_bytes = log_max_bytes
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._log_file = None
+        self._log_lines = 0
+        self._dirty = False
+        self._flusher = None
+        self._process_file = None
+        # The flush thread and /metrics both flush; one at a time writes the shared .tmp file
+        self._flush_lock = threading.Lock()
+
+    def record(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            stage = self.stages.setdefault(span.name, {"count": 0, "errors": 0, "seconds": 0.0, "counters": {}})
+            stage["count"] += 1
+            stage["seconds"] += span.duration
+            if span.error:
+                stage["errors"] += 1
+            for name, value in span.counters.items():
+                stage["counters"][name] = stage["counters"].get(name, 0) + value
+            self._dirty = True
+
+            if self.log_path:
+                self._write_log_line(line)
+            if self.process_dir and self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _write_log_line(self, line):
+        if self._log_file is None:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            self._log_file = open(self.log_path, "a", buffering=1)
+        self._log_file.write(line + "\n")
+        self._log_lines += 1
+        if self._log_lines % 100 == 0:
+            self._rotate_log()
+
+    def _rotate_log(self):
+        # Every process appends to the same log; whichever finds it too big rotates it
+        # and the others reopen the new file at their next check
+        try:
+            if os.path.getsize(self.log_path) > self.log_max_bytes:
+                os.replace(self.log_path, self.log_path + ".1")
+            same_file = os.path.samestat(os.stat(self.log_path), os.fstat(self._log_file.fileno()))
+        except OSError:
+            same_file = False
+        if not same_file:
+            self._log_file.close()
+            self._log_file = open(self.log_path, "a", buffering=1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {**stage, "counters": dict(stage["counters"])} for name, stage in self.stages.items()
+            }
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except OSError as e:
+                print("Writing process metrics failed", e)
+
+    def flush(self):
+        """
+        Write this process's aggregates to its file in process_dir.
+        """
+        if not self.process_dir:
+            return
+        with self._flush_lock:
+            if self._process_file is None:
+                os.makedirs(self.process_dir, exist_ok=True)
+                process_id = f"{socket.gethostname()}-{os.getpid()}-{int(time.time() * 1000)}"
+                self._process_file = os.path.join(self.process_dir, f"{process_id}.json")
+            if not self._dirty:
+                if os.path.exists(self._process_file):
+                    # Keep the file of an idle process from expiring
+                    os.utime(self._process_file)
+                return
+            with self._lock:
+                self._dirty = False
+            stages = self.snapshot()
+            with open(self._process_file + ".tmp", "w") as f:
+                json.dump({"pid": os.getpid(), "updated": time.time(), "stages": stages}, f)
+            os.replace(self._process_file + ".tmp", self._process_file)
+
+    def aggregate_processes(self):
+        """
+        Stage aggregates summed over every process writing to process_dir, this one
+        included. Files not updated for METRICS_PROCESS_RETENTION_SECONDS are removed.
+
+        Returns:
+            dict: Stage name to count, errors, seconds and counters.
+        """
+        if not self.process_dir:
+            return self.snapshot()
+        self.flush()
+        totals = {}
+        now = time.time()
+        for name in os.listdir(self.process_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.process_dir, name)
+            try:
+                if now - os.path.getmtime(path) > METRICS_PROCESS_RETENTION_SECONDS:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    stages = json.load(f)["stages"]
+            except (OSError, ValueError, KeyError):
+                continue
+            for stage_name, stage in stages.items():
+                total = totals.setdefault(stage_name, {"count": 0, "errors": 0, "seconds": 0.0, "counters": {}})
+                total["count"] += stage["count"]
+                total["errors"] += stage["errors"]
+                total["seconds"] += stage["seconds"]
+                for counter, value in stage["counters"].items():
+                    total["counters"][counter] = total["counters"].get(counter, 0) + value
+        return totals
+
+    def render_prometheus(self):
+        """
+        Aggregates of all processes in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP infi_stage_runs_total Finished spans per stage.",
+            "# TYPE infi_stage_runs_total counter",
+            "# HELP infi_stage_errors_total Spans per stage that ended with an exception.",
+            "# TYPE infi_stage_errors_total counter",
+            "# HELP infi_stage_seconds_total Time spent per stage.",
+            "# TYPE infi_stage_seconds_total counter",
+            "# HELP infi_stage_counter_total Counters recorded on the spans of a stage.",
+            "# TYPE infi_stage_counter_total counter",
+        ]
+        for name, stage in sorted(self.aggregate_processes().items()):
+            lines.append(f'infi_stage_runs_total{{stage="{name}"}} {stage["count"]}')
+            lines.append(f'infi_stage_errors_total{{stage="{name}"}} {stage["errors"]}')
+            lines.append(f'infi_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}')
+            for counter, value in sorted(stage["counters"].items()):
+                lines.append(f'infi_stage_counter_total{{stage="{name}",counter="{counter}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a stage as a child of the current span.
+
+    Yields:
+        Span: The span, to add counters with span.count(name, value).
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - current._start
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # An async generator closed from another context, e.g. during garbage collection
+            pass
+        metrics.record(current)
+
+
+def traced(name):
+    """
+    Decorator running each call of a function or coroutine function in a span.
+    """
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    return _current_span.get()
+
+
+def count(name, value=1):
+    """
+    Add to a counter of the current span; a no-op outside of any span.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.count(name, value)
+
+
+def _make_metrics_handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            payload = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return MetricsHandler
+
+
+_metrics_server = None
+_metrics_server_attempted = False
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, registry=metrics, host=METRICS_HOST):
+    """
+    Serve /metrics on host:port in a background thread, once per process. Does nothing
+    when port is not set.
+
+    Returns:
+        ThreadingHTTPServer | None: The server.
+    """
+    global _metrics_server, _metrics_server_attempted
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if not _metrics_server_attempted:
+            _metrics_server_attempted = True
+            try:
+                _metrics_server = ThreadingHTTPServer((host, port), _make_metrics_handler(registry))
+            except OSError as e:
+                # Another process (e.g. a second Streamlit worker) already serves the port
+                print(f"Metrics endpoint not started on port {port}: {e}")
+                return None
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+            print(f"Metrics served on http://{host}:{port}/metrics")
+        return _metrics_server
@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+from constants import JOBS_DB_PATH, JOBS_FILES_DIR, JOBS_RETENTION_SECONDS, JOBS_STALE_SECONDS
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job handler once cancellation of its job was requested.
+    """
+
+
+def _connect():
+    os.makedirs(os.path.dirname(JOBS_DB_PATH) or ".", exist_ok=True)
+    # Short-lived connections: the queue is shared by the app and the worker processes
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, filename TEXT, input_path TEXT, "
+        "params TEXT, stage TEXT, progress REAL NOT NULL DEFAULT 0, message TEXT, result TEXT, error TEXT, "
+        "cancel_requested INTEGER NOT NULL DEFAULT 0, worker TEXT, created REAL NOT NULL, started REAL, "
+        "finished REAL, heartbeat REAL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+    return conn
+
+
+def _job_dict(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"] or "{}")
+    job["result"] = json.loads(job["result"] or "null")
+    return job
+
+
+def submit_job(kind, file_bytes, filename, params=None):
+    """
+    Queue a job on an uploaded file. The file is copied next to the queue, so the job
+    survives the browser session that submitted it.
+
+    Args:
+        kind (str): Job type, "ingest" or "ppt".
+        file_bytes (bytes): Content of the uploaded file.
+        filename (str): Name of the uploaded file.
+        params (dict | None): Extra handler arguments.
+
+    Returns:
+        str: The job id.
+    """
+    job_id = uuid.uuid4().hex
+    input_path = os.path.join(job_files_dir(job_id), f"input{os.path.splitext(filename)[1]}")
+    with open(input_path, "wb") as f:
+        f.write(file_bytes)
+
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, filename, input_path, params, stage, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, filename, input_path, json.dumps(params or {}), QUEUED, time.time()),
+        )
+    finally:
+        conn.close()
+    print(f"Queued {kind} job {job_id} for {filename}")
+    return job_id
+
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        return _job_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    finally:
+        conn.close()
+
+
+def claim_next_job(worker_id, kinds=None):
+    """
+    Atomically take the oldest queued job and mark it running for worker_id.
+
+    Returns:
+        dict | None: The job, or None when the queue is empty.
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        query = "SELECT * FROM jobs WHERE status = ?"
+        args = [QUEUED]
+        if kinds:
+            query += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            args.extend(kinds)
+        row = conn.execute(query + " ORDER BY created LIMIT 1", args).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker = ?, started = ?, heartbeat = ?, stage = ? WHERE id = ?",
+            (RUNNING, worker_id, now, now, "starting", row["id"]),
+        )
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        conn.execute("COMMIT")
+        return _job_dict(row)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def update_progress(job_id, stage=None, progress=None, message=None, result=None):
+    """
+    Record the progress of a running job; doubles as its heartbeat.
+
+    Raises:
+        JobCancelled: When cancellation of the job was requested.
+    """
+    conn = _connect()
+    try:
+        updates = {"heartbeat": time.time()}
+        if stage is not None:
+            updates["stage"] = stage
+        if progress is not None:
+            updates["progress"] = max(0.0, min(1.0, progress))
+        if message is not None:
+            updates["message"] = message
+        if result is not None:
+            updates["result"] = json.dumps(result)
+        conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in updates)} WHERE id = ?",
+            (*updates.values(), job_id),
+        )
+        cancel_requested = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if cancel_requested and cancel_requested[0]:
+        raise JobCancelled(job_id)
+
+
+def finish_job(job_id, status, result=None, error=None):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, stage = ?, result = COALESCE(?, result), error = ?, finished = ?, "
+            "progress = CASE WHEN ? = ? THEN 1 ELSE progress END WHERE id = ?",
+            (status, status, json.dumps(result) if result is not None else None, error, time.time(),
+             status, DONE, job_id),
+        )
+    finally:
+        conn.close()
+
+
+def cancel_job(job_id):
+    """
+    Cancel a job: a queued job is cancelled right away, a running one stops at its next
+    progress update.
+    """
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, stage = ?, finished = ? WHERE id = ? AND status = ?",
+            (CANCELLED, CANCELLED, time.time(), job_id, QUEUED),
+        )
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING))
+    finally:
+        conn.close()
+
+
+def requeue_stale_jobs(stale_seconds=JOBS_STALE_SECONDS):
+    """
+    Put running jobs whose worker stopped sending heartbeats back in the queue.
+
+    Returns:
+        int: Number of jobs requeued.
+    """
+    conn = _connect()
+    try:
+        stale_before = time.time() - stale_seconds
+        conn.execute(
+            "UPDATE jobs SET status = ?, stage = ?, finished = ? "
+            "WHERE status = ? AND heartbeat < ? AND cancel_requested = 1",
+            (CANCELLED, CANCELLED, time.time(), RUNNING, stale_before),
+        )
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, stage = ?, worker = NULL WHERE status = ? AND heartbeat < ?",
+            (QUEUED, QUEUED, RUNNING, stale_before),
+        )
+        if cursor.rowcount:
+            print(f"Requeued {cursor.rowcount} jobs of unresponsive workers")
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+def job_files_dir(job_id):
+    """
+    Folder for the files a job hands over to the app (document batches, decks).
+    """
+    path = os.path.join(JOBS_FILES_DIR, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def purge_finished_jobs(retention_seconds=JOBS_RETENTION_SECONDS):
+    """
+    Delete jobs that finished more than retention_seconds ago, with their files.
+    """
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT id FROM jobs WHERE status IN ({', '.join('?' for _ in FINISHED_STATUSES)}) "
+            "AND finished < ?",
+            (*FINISHED_STATUSES, time.time() - retention_seconds),
+        ).fetchall()
+        for row in rows:
+            shutil.rmtree(os.path.join(JOBS_FILES_DIR, row["id"]), ignore_errors=True)
+            conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+    finally:
+        conn.close()
+
+
+def queue_position(job_id):
+    """
+    Number of queued jobs ahead of job_id.
+    """
+    conn = _connect()
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND created < (SELECT created FROM jobs WHERE id = ?)",
+            (QUEUED, job_id),
+        ).fetchone()[0]
+    finally:
+        conn.close()
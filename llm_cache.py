@@ -0,0 +1,72 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from constants import LLM_CACHE_PATH
+
+
+def hash_content(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite cache of LLM outputs that depend only on their input content.
+
+    Entries are keyed by kind, content hash, model and a hash of the prompt, so a changed
+    prompt template never returns a stale answer; purge_stale drops those entries for good.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        # Shared by the job workers and batch ingest processes: wait for their writes, and
+        # WAL keeps readers from blocking on them
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, kind TEXT NOT NULL, prompt_hash TEXT NOT NULL, model TEXT NOT NULL, "
+            "response TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(kind, content_hash, model, prompt_hash):
+        return hashlib.sha256(f"{kind}:{content_hash}:{model}:{prompt_hash}".encode("utf-8")).hexdigest()
+
+    def get(self, kind, content_hash, model, prompt):
+        """
+        Return the cached response, or None if the content was not seen with this model and prompt.
+        """
+        key = self._key(kind, content_hash, model, hash_content(prompt))
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, kind, content_hash, model, prompt, response):
+        prompt_hash = hash_content(prompt)
+        key = self._key(kind, content_hash, model, prompt_hash)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, kind, prompt_hash, model, response, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, prompt_hash, model, response, time.time()),
+            )
+            self._conn.commit()
+
+    def purge_stale(self, kind, prompt):
+        """
+        Delete the entries of a kind that were produced with a different prompt.
+        """
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM responses WHERE kind = ? AND prompt_hash != ?", (kind, hash_content(prompt))
+            ).rowcount
+            self._conn.commit()
+        if deleted:
+            print(f"Invalidated {deleted} cached {kind} responses after a prompt change")
@@ -0,0 +1,210 @@
+"""
+Local stand-in for the OpenAI API (chat completions and embeddings), for exercising rate
+limiting, retries and benchmarks without network.
+
+Run it and point the app at it:
+
+    python mock_openai_server.py --port 8001 --rpm 60 --error-rate 0.2 --latency 0.3
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_BASE=http://localhost:8001/v1 OPENAI_API_KEY=mock streamlit run app.py
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOpenAIState:
+    """
+    Behaviour and counters of the mock server, shared by all handler threads.
+    """
+
+    def __init__(self, rpm=None, error_rate=0.0, retry_after=1.0, latency=0.0):
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.requests = 0
+        self.throttled = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def should_throttle(self):
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            throttle = random.random() < self.error_rate or (self.rpm is not None and len(self._recent) >= self.rpm)
+            if throttle:
+                self.throttled += 1
+            else:
+                self._recent.append(now)
+            return throttle
+
+
+def _chat_reply(request):
+    # Image batches get one description per image, in the JSON shape the prompt asks for
+    content = request["messages"][-1]["content"]
+    if isinstance(content, list):
+        images = sum(1 for part in content if part.get("type") == "image_url")
+        if images:
+            return json.dumps({"descriptions": [
+                {"index": idx, "description": "The image shows a mock figure."} for idx in range(images)
+            ]})
+    return "This is a mock answer."
+
+
+def _embedding(text, dimensions):
+    # Deterministic unit vector per input, so equal texts embed equally across runs
+    rng = random.Random(hashlib.sha256(str(text).encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector]
+
+
+def _embeddings_reply(request):
+    inputs = request.get("input", [])
+    if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+    dimensions = request.get("dimensions") or 1536
+    data = []
+    for idx, text in enumerate(inputs):
+        embedding = _embedding(text, dimensions)
+        if request.get("encoding_format") == "base64":
+            embedding = base64.b64encode(struct.pack(f"<{dimensions}f", *embedding)).decode("ascii")
+        data.append({"object": "embedding", "index": idx, "embedding": embedding})
+    tokens = sum(len(str(text).split()) for text in inputs)
+    return {
+        "object": "list",
+        "data": data,
+        "model": request.get("model", "mock"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+def make_handler(state):
+    class MockOpenAIHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body, headers=None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_stream(self, request, reply):
+            # Server-sent events, one chunk per word, like the real streaming API
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            words = reply.split(" ")
+            for idx, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": word if idx == 0 else " " + word},
+                        "finish_reason": "stop" if idx == len(words) - 1 else None,
+                    }],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage_chunk = {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": len(words), "total_tokens": 10 + len(words)},
+                }
+                self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            if state.latency:
+                time.sleep(state.latency)
+
+            if state.should_throttle():
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                    {"Retry-After": str(state.retry_after)},
+                )
+                return
+
+            if self.path.endswith("/chat/completions") and request.get("stream"):
+                self._send_stream(request, _chat_reply(request))
+            elif self.path.endswith("/chat/completions"):
+                reply = _chat_reply(request)
+                self._send_json(200, {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": reply},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": len(reply.split()), "total_tokens": 10 + len(reply.split())},
+                })
+            elif self.path.endswith("/embeddings"):
+                self._send_json(200, _embeddings_reply(request))
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    return MockOpenAIHandler
+
+
+def start_mock_server(port=0, **state_options):
+    """
+    Start the mock server in a background thread.
+
+    Returns:
+        tuple: (server, state, base_url for OPENAI_BASE_URL)
+    """
+    state = MockOpenAIState(**state_options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI API server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute before answering 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    args = parser.parse_args()
+
+    server, state, base_url = start_mock_server(
+        args.port, rpm=args.rpm, error_rate=args.error_rate, retry_after=args.retry_after, latency=args.latency
+    )
+    print(f"Mock OpenAI server listening on {base_url}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"requests={state.requests} throttled={state.throttled}")
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,55 @@
+import asyncio
+import atexit
+import threading
+
+import httpx
+from openai import AsyncOpenAI
+
+from constants import OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_TIMEOUT_SECONDS
+
+# httpx async pools are bound to the event loop that opened them, and Streamlit runs every
+# script run in a fresh loop. One client lives on a background loop of its own instead, so
+# its connections are kept across runs and closed once, when the process exits.
+_client = None
+_client_loop = None
+_client_lock = threading.Lock()
+
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
+def _close_client():
+    try:
+        asyncio.run_coroutine_threadsafe(_client.close(), _client_loop).result(timeout=5)
+    except Exception as e:
+        print("Closing the OpenAI client failed", e)
+    _client_loop.call_soon_threadsafe(_client_loop.stop)
+
+
+def _get_client():
+    global _client, _client_loop
+    with _client_lock:
+        if _client is None:
+            _client_loop = asyncio.new_event_loop()
+            threading.Thread(target=_client_loop.run_forever, name="openai-client", daemon=True).start()
+            # Retries are owned by rate_limiter.RequestScheduler
+            _client = AsyncOpenAI(
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=_pool_limits(), timeout=OPENAI_TIMEOUT_SECONDS),
+            )
+            atexit.register(_close_client)
+        return _client, _client_loop
+
+
+async def create_chat_completion(**request):
+    """
+    client.chat.completions.create on the shared AsyncOpenAI client, awaitable from any
+    event loop. Cancelling the caller cancels the request.
+    """
+    client, loop = _get_client()
+    future = asyncio.run_coroutine_threadsafe(client.chat.completions.create(**request), loop)
+    return await asyncio.wrap_future(future)
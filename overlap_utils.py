@@ -1,3 +1,5 @@
+import numpy as np
+
 
 # Function to calculate the overlapping area
 def calculate_overlap_area(r1, r2):
@@ -21,16 +23,119 @@ def extract_coordinates_from_object(obj):
     return x1, y1, w, h
 
 
+def bounding_boxes(objects):
+    """
+    (n, 4) array of x_min, y_min, x_max, y_max taken from points[0] and points[2],
+    the same corners check_overlap and extract_coordinates_from_object use.
+    """
+    if not objects:
+        return np.empty((0, 4), dtype=float)
+    points = [obj["metadata"]["coordinates"]["points"] for obj in objects]
+    return np.array([[p[0][0], p[0][1], p[2][0], p[2][1]] for p in points], dtype=float)
+
+
+def _sweep_candidates(boxes, axis):
+    # Boxes in order of their start on axis, and for each the end (exclusive, in that
+    # order) of the boxes starting before it ends there
+    order = np.argsort(boxes[:, axis], kind="stable")
+    sorted_min = boxes[order, axis]
+    candidate_ends = np.searchsorted(sorted_min, boxes[order, axis + 2], side="right")
+    return order, candidate_ends
+
+
+def find_overlapping_pairs(boxes):
+    """
+    All index pairs (i < j) of boxes that overlap or touch, found with a sweep line.
+
+    The sweep runs along the axis on which fewer boxes overlap: y on ordinary pages,
+    where full-width text lines all overlap on x, x for side-by-side columns. Boxes are
+    sorted by their start on that axis; for each box only the boxes starting before its
+    end are candidates, and those are filtered on both axes at once with NumPy. This
+    costs O(n log n + c), c being the number of candidates on the chosen axis, instead
+    of O(n^2).
+    """
+    n = len(boxes)
+    if n < 2:
+        return []
+    sweeps = [_sweep_candidates(boxes, axis) for axis in (0, 1)]
+    order, candidate_ends = min(
+        sweeps, key=lambda sweep: int((sweep[1] - np.arange(1, n + 1)).clip(min=0).sum())
+    )
+
+    pairs = []
+    for position in range(n):
+        end = candidate_ends[position]
+        if end <= position + 1:
+            continue
+        i = order[position]
+        candidates = order[position + 1:end]
+        box = boxes[i]
+        other = boxes[candidates]
+        hits = candidates[
+            (other[:, 0] <= box[2]) & (box[0] <= other[:, 2]) &
+            (other[:, 1] <= box[3]) & (box[1] <= other[:, 3])
+        ]
+        i = int(i)
+        pairs.extend((min(i, j), max(i, j)) for j in hits.tolist())
+    return pairs
+
+
+def find_overlap_groups(objects):
+    """
+    Connected components of the overlap graph of objects.
+
+    Returns:
+        list: Sorted lists of object indices, one per group of two or more objects.
+    """
+    parent = list(range(len(objects)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in find_overlapping_pairs(bounding_boxes(objects)):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i in range(len(objects)):
+        groups.setdefault(find(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
 # Function to adjust overlapping objects
 def adjust_overlapping_objects_in_ppt(objects):
+    """
+    Split the overlap of every overlapping pair of objects between the two of them.
+
+    Gives the same result as visiting every ordered pair (i, j) in turn: adjusting only
+    ever shrinks boxes, so pairs that do not overlap up front never do later. Only the
+    overlapping pairs are visited, group by group, on cached points, and each adjusted
+    object's points are written once at the end.
+    """
     adjusted_objects= objects.copy()
-
-    for i, obj1  in enumerate(adjusted_objects):
-        for j, obj2 in enumerate(adjusted_objects):
-            if i != j:
-
-                r1 = extract_coordinates_from_object(obj1)
-                r2 = extract_coordinates_from_object(obj2)
+    pairs = find_overlapping_pairs(bounding_boxes(adjusted_objects))
+    if not pairs:
+        return adjusted_objects
+
+    neighbours = {}
+    for i, j in pairs:
+        neighbours.setdefault(i, []).append(j)
+        neighbours.setdefault(j, []).append(i)
+
+    # Points are cached and rewritten with the exact arithmetic of the pairwise scan, so the
+    # floating point results (and the touching-edge decisions depending on them) match it
+    points = {}
+    for members in find_overlap_groups(adjusted_objects):
+        for i in members:
+            points[i] = adjusted_objects[i]["metadata"]["coordinates"]["points"]
+        for i in members:
+            for j in sorted(neighbours[i]):
+                r1 = _rect_from_points(points[i])
+                r2 = _rect_from_points(points[j])
 
                 # Calculate overlap area
                 overlap_w, overlap_h = calculate_overlap_area(r1, r2)
@@ -46,18 +151,28 @@ def adjust_overlapping_objects_in_ppt(objects):
                     new_h1 = h1 - overlap_h / 2
                     new_h2 = h2 - overlap_h / 2
 
-                    # Update the rectangles with new positions and sizes
-                    adjusted_objects[i]["metadata"]["coordinates"]["points"] = [
+                    points[i] = [
                         [x1, y1], [x1, y1 + new_h1], [x1 + new_w1, y1 + new_h1], [x1 + new_w1, y1]
                     ]
-                    adjusted_objects[j]["metadata"]["coordinates"]["points"] = [
+                    points[j] = [
                         [x2 + overlap_w / 2, y2 + overlap_h / 2],
                         [x2 + overlap_w / 2, y2 + new_h2 + overlap_h / 2],
                         [x2 + new_w2 + overlap_w / 2, y2 + new_h2 + overlap_h / 2],
                         [x2 + new_w2 + overlap_w / 2, y2 + overlap_h / 2]
                     ]
+
+    # Write each adjusted object's points once
+    for i, new_points in points.items():
+        adjusted_objects[i]["metadata"]["coordinates"]["points"] = new_points
     return adjusted_objects
 
+
+def _rect_from_points(points):
+    x1, y1 = points[0]
+    x2, y2 = points[2]
+    return x1, y1, x2 - x1, y2 - y1
+
+
 def check_overlap(rect1, rect2):
     # Extract the top-left and bottom-right coordinates of each rectangle
     x1_min, y1_min = rect1[0]
@@ -70,27 +185,22 @@ def check_overlap(rect1, rect2):
     return not (x1_max < x2_min or x2_max < x1_min or y1_max < y2_min or y2_max < y1_min)
 
 def find_unique_overlapping_and_non_overlapping_objects(data):
-    overlapping_objects = set()
+    """
+    Split a page's objects into those overlapping at least one other object and the rest.
+    Uses the same touching-counts rule as check_overlap, through the sweep in
+    find_overlapping_pairs. Both lists keep page order.
+    """
     all_objects = {}
-    
-    # Iterate over each pair of objects
-    for i in range(len(data)):
-      obj1 = data[i]
-      rect1 = obj1['metadata']['coordinates']['points']
-      all_objects[obj1['element_id']] = obj1
-      
-      for j in range(i + 1, len(data)):
-        obj2 = data[j]
-        rect2 = obj2['metadata']['coordinates']['points']
-        all_objects[obj2['element_id']] = obj2
-        
-        # Check if the two objects overlap
-        if check_overlap(rect1, rect2):
-          overlapping_objects.add(obj1['element_id'])
-          overlapping_objects.add(obj2['element_id'])
-    
+    for obj in data:
+        all_objects[obj['element_id']] = obj
+
+    overlapping_objects = set()
+    for i, j in find_overlapping_pairs(bounding_boxes(data)):
+        overlapping_objects.add(data[i]['element_id'])
+        overlapping_objects.add(data[j]['element_id'])
+
     # Create lists of overlapping and non-overlapping objects
-    overlapping_list = [all_objects[id] for id in overlapping_objects]
+    overlapping_list = [obj for id, obj in all_objects.items() if id in overlapping_objects]
     non_overlapping_list = [obj for id, obj in all_objects.items() if id not in overlapping_objects]
-    
-    return overlapping_list, non_overlapping_list
\ No newline at end of file
+
+    return overlapping_list, non_overlapping_list
@@ -0,0 +1,110 @@
+import io
+
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTChar, LTContainer, LTCurve, LTImage
+
+from constants import TRIAGE_MAX_CID_RATIO, TRIAGE_MIN_TEXT_CHARS, TRIAGE_TABLE_RULE_THRESHOLD
+
+
+def _walk_layout(layout_obj):
+    yield layout_obj
+    if isinstance(layout_obj, LTContainer):
+        for child in layout_obj:
+            yield from _walk_layout(child)
+
+
+def triage_page(page_layout):
+    """
+    Decide the partition strategy for one page from its pdfminer layout.
+
+    A page gets "fast" only when it has a usable embedded text layer and no images or
+    table-like ruling lines. Everything else (scans, figures, tables) needs "hi_res".
+
+    Returns:
+        dict: page_number, strategy, reason and the counts the decision was based on.
+    """
+    text_chars = 0
+    cid_chars = 0
+    images = 0
+    rules = 0
+    for layout_obj in _walk_layout(page_layout):
+        if isinstance(layout_obj, LTChar):
+            char_text = layout_obj.get_text()
+            if char_text.startswith("(cid:"):
+                cid_chars += 1
+            elif not char_text.isspace():
+                text_chars += 1
+        elif isinstance(layout_obj, LTImage):
+            images += 1
+        elif isinstance(layout_obj, LTCurve):
+            # LTRect and LTLine are LTCurve subclasses; ruled tables draw many of them
+            rules += 1
+
+    if text_chars < TRIAGE_MIN_TEXT_CHARS:
+        strategy, reason = "hi_res", "no usable text layer"
+    elif cid_chars > TRIAGE_MAX_CID_RATIO * (text_chars + cid_chars):
+        strategy, reason = "hi_res", "unmapped glyphs in text layer"
+    elif images:
+        strategy, reason = "hi_res", "contains images"
+    elif rules >= TRIAGE_TABLE_RULE_THRESHOLD:
+        strategy, reason = "hi_res", "possible table"
+    else:
+        strategy, reason = "fast", "text only"
+
+    return {
+        "page_number": page_layout.pageid,
+        "strategy": strategy,
+        "reason": reason,
+        "text_chars": text_chars,
+        "images": images,
+        "rules": rules,
+    }
+
+
+def triage_pages(pdf_bytes):
+    """
+    Run the strategy triage over every page of a PDF.
+
+    Args:
+        pdf_bytes (bytes): Raw PDF contents.
+
+    Returns:
+        list: One decision dict per page, in page order.
+    """
+    # No LAParams: the raw character and graphics objects are all the triage needs
+    return [triage_page(page_layout) for page_layout in extract_pages(io.BytesIO(pdf_bytes), laparams=None)]
+
+
+def group_pages_by_strategy(decisions, max_pages_per_range):
+    """
+    Group consecutive pages that share a strategy into ranges.
+
+    Returns:
+        list: (strategy, start_page, end_page) tuples with 1-based inclusive pages.
+    """
+    ranges = []
+    for decision in decisions:
+        page_number = decision["page_number"]
+        strategy = decision["strategy"]
+        if ranges:
+            last_strategy, start_page, end_page = ranges[-1]
+            if (last_strategy == strategy and end_page == page_number - 1
+                    and page_number - start_page < max_pages_per_range):
+                ranges[-1] = (strategy, start_page, page_number)
+                continue
+        ranges.append((strategy, page_number, page_number))
+    return ranges
+
+
+def summarize_page_strategies(decisions):
+    """
+    Summarize how many pages avoided hi_res partitioning.
+    """
+    total_pages = len(decisions)
+    fast_pages = sum(1 for decision in decisions if decision["strategy"] == "fast")
+    return {
+        "pages": total_pages,
+        "fast_pages": fast_pages,
+        "hi_res_pages": total_pages - fast_pages,
+        "hi_res_saved_pct": round(100 * fast_pages / total_pages, 1) if total_pages else 0.0,
+    }
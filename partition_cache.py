@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from constants import PARTITION_CACHE_DIR, PARTITION_CACHE_MAX_BYTES
+
+ELEMENTS_FILE = "elements.json"
+INFO_FILE = "info.json"
+IMAGES_DIR = "images"
+
+
+def compute_cache_key(pdf_bytes, params):
+    """
+    Build the cache key for a partition run.
+
+    Args:
+        pdf_bytes (bytes): Raw PDF contents.
+        params (dict): The partition parameters that affect the output.
+
+    Returns:
+        str: Hex SHA-256 of the PDF digest and the serialized parameters.
+    """
+    pdf_digest = hashlib.sha256(pdf_bytes).hexdigest()
+    params_json = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(f"{pdf_digest}:{params_json}".encode("utf-8")).hexdigest()
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class PartitionCache:
+    """
+    Content-addressed on-disk cache of partition_pdf output.
+
+    Each entry is a directory holding the serialized element dicts and a copy of the
+    extracted image blocks. The mtime of the elements file tracks last use and entries
+    are evicted least recently used first once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=PARTITION_CACHE_DIR, max_bytes=PARTITION_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, image_output_dir):
+        """
+        Load a cached partition result.
+
+        Cached image blocks are copied into image_output_dir and the image_path of each
+        element is rewritten to point at the copy, so callers can delete them as usual.
+
+        Returns:
+            list | None: The element dicts, or None on a cache miss.
+        """
+        entry_dir = self._entry_dir(key)
+        elements_path = os.path.join(entry_dir, ELEMENTS_FILE)
+        try:
+            with open(elements_path, "r", encoding="utf-8") as f:
+                elements_list = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        os.makedirs(image_output_dir, exist_ok=True)
+        for element in elements_list:
+            metadata = element.get("metadata", {})
+            image_name = metadata.get("image_path")
+            if not image_name:
+                continue
+            cached_image = os.path.join(entry_dir, IMAGES_DIR, image_name)
+            target_path = os.path.join(image_output_dir, image_name)
+            if not os.path.exists(cached_image):
+                # Entry is incomplete, treat it as a miss
+                return None
+            shutil.copyfile(cached_image, target_path)
+            metadata["image_path"] = target_path
+
+        now = time.time()
+        os.utime(elements_path, (now, now))
+        return elements_list
+
+    def get_info(self, key):
+        """
+        Return the extra information stored alongside an entry, or None if there is none.
+        """
+        try:
+            with open(os.path.join(self._entry_dir(key), INFO_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_complete(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, ELEMENTS_FILE), "r", encoding="utf-8") as f:
+                elements_list = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return all(
+            os.path.exists(os.path.join(entry_dir, IMAGES_DIR, element["metadata"]["image_path"]))
+            for element in elements_list
+            if element.get("metadata", {}).get("image_path")
+        )
+
+    def open_entry(self):
+        """
+        Start an entry that is filled range by range with add_to_entry and stored with
+        commit_entry (or dropped with discard_entry).
+
+        Returns:
+            dict: The staging entry.
+        """
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(os.path.join(tmp_dir, IMAGES_DIR))
+        return {"dir": tmp_dir, "elements": []}
+
+    def add_to_entry(self, entry, elements_list):
+        """
+        Copy elements and the image blocks they reference into a staging entry. The
+        caller may change or delete its elements and images afterwards.
+        """
+        stored_elements = json.loads(json.dumps(elements_list, default=str))
+        for element in stored_elements:
+            metadata = element.get("metadata", {})
+            image_path = metadata.get("image_path")
+            if not image_path:
+                continue
+            image_name = os.path.basename(image_path)
+            if os.path.exists(image_path):
+                shutil.copyfile(image_path, os.path.join(entry["dir"], IMAGES_DIR, image_name))
+            metadata["image_path"] = image_name
+        entry["elements"].extend(stored_elements)
+
+    def discard_entry(self, entry):
+        shutil.rmtree(entry["dir"], ignore_errors=True)
+
+    def commit_entry(self, key, entry, info=None):
+        """
+        Store a staging entry under key. An incomplete entry already stored under the
+        key (images missing) is replaced; a complete one is kept.
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            if info is not None:
+                with open(os.path.join(entry["dir"], INFO_FILE), "w", encoding="utf-8") as f:
+                    json.dump(info, f)
+            with open(os.path.join(entry["dir"], ELEMENTS_FILE), "w", encoding="utf-8") as f:
+                json.dump(entry["elements"], f)
+
+            if os.path.exists(entry_dir) and not self._is_complete(entry_dir):
+                print(f"Replacing incomplete partition cache entry {key}")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            try:
+                os.rename(entry["dir"], entry_dir)
+            except OSError:
+                # Another session stored the same document first
+                self.discard_entry(entry)
+        except Exception:
+            self.discard_entry(entry)
+            raise
+
+        self.evict()
+
+    def put(self, key, elements_list, info=None):
+        """
+        Store a partition result. Image blocks referenced by the elements are copied into
+        the entry so it stays valid after the working image folder is cleared. info is an
+        optional JSON-serializable dict kept next to the elements.
+        """
+        entry_dir = self._entry_dir(key)
+        if self._is_complete(entry_dir):
+            return
+
+        entry = self.open_entry()
+        try:
+            self.add_to_entry(entry, elements_list)
+        except Exception:
+            self.discard_entry(entry)
+            raise
+        self.commit_entry(key, entry, info=info)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            elements_path = os.path.join(entry_dir, ELEMENTS_FILE)
+            if name.startswith(".tmp-") or not os.path.exists(elements_path):
+                continue
+            size = _dir_size(entry_dir)
+            entries.append((os.path.getmtime(elements_path), size, entry_dir))
+            total_size += size
+
+        entries.sort()
+        for _, size, entry_dir in entries:
+            if total_size <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+            print(f"Evicted partition cache entry {os.path.basename(entry_dir)}")
@@ -0,0 +1,382 @@
+import hashlib
+import io
+import os
+import shutil
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+from pypdf import PdfReader, PdfWriter
+from unstructured.__version__ import __version__ as unstructured_version
+
+from constants import IMAGE_FOLDER, LAYOUT_MODEL_NAME, PARTITION_MAX_WORKERS, PARTITION_PAGES_PER_RANGE, PARTITION_TRIAGE
+from instrumentation import count, traced
+from page_triage import group_pages_by_strategy, summarize_page_strategies, triage_pages
+from partition_cache import PartitionCache, compute_cache_key
+from resources import get_partition_pool, reset_partition_pool
+from utils import read_file_bytes
+
+partition_cache = PartitionCache()
+
+
+def count_pdf_pages(pdf_bytes):
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def extract_pdf_pages(reader, start_page, end_page):
+    """
+    Write pages start_page..end_page (1-based, inclusive) of a PdfReader into a new PDF.
+    """
+    writer = PdfWriter()
+    for page_index in range(start_page - 1, end_page):
+        writer.add_page(reader.pages[page_index])
+    range_io = io.BytesIO()
+    writer.write(range_io)
+    return range_io.getvalue()
+
+
+def split_pdf_into_ranges(pdf_bytes, pages_per_range):
+    """
+    Split a PDF into consecutive page ranges.
+
+    Args:
+        pdf_bytes (bytes): Raw PDF contents.
+        pages_per_range (int): Maximum number of pages per range.
+
+    Returns:
+        list: (start_page, end_page, range_bytes) tuples with 1-based inclusive pages.
+    """
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    total_pages = len(reader.pages)
+    ranges = []
+    for start_page in range(1, total_pages + 1, pages_per_range):
+        end_page = min(start_page + pages_per_range - 1, total_pages)
+        ranges.append((start_page, end_page, extract_pdf_pages(reader, start_page, end_page)))
+    return ranges
+
+
+def _partition_page_range(range_bytes, start_page, image_output_dir, filename, strategy="hi_res"):
+    """
+    Worker entry point: partition of a single page range.
+    Image blocks go to a per-range folder so file names from different ranges cannot clash.
+    """
+    # Imported on first use: unstructured pulls in torch and the OCR stack
+    from unstructured.partition.pdf import partition_pdf
+
+    if strategy == "fast":
+        elements = partition_pdf(file=io.BytesIO(range_bytes), metadata_filename=filename, strategy="fast")
+        return [element.to_dict() for element in elements]
+
+    range_image_dir = os.path.join(image_output_dir, f"pages-{start_page}")
+    elements = partition_pdf(
+        file=io.BytesIO(range_bytes),
+        metadata_filename=filename,
+        strategy="hi_res",
+        hi_res_model_name=LAYOUT_MODEL_NAME,
+        infer_table_structure=True,
+        extract_images_in_pdf=True,
+        extract_image_block_output_dir=range_image_dir,
+    )
+    return [element.to_dict() for element in elements]
+
+
+def _merge_range_elements(range_results, image_output_dir):
+    """
+    Merge per-range element lists back into one document-ordered list.
+
+    Page numbers are shifted from range-relative to document pages, element ids are
+    re-derived from the range start so they stay unique across ranges (parent_id links
+    are remapped to match) and image blocks are moved into image_output_dir.
+    """
+    merged = []
+    for start_page, elements_list in sorted(range_results, key=lambda result: result[0]):
+        page_offset = start_page - 1
+        id_map = {}
+        for element in elements_list:
+            old_id = element.get("element_id")
+            new_id = hashlib.sha256(f"{start_page}:{old_id}".encode("utf-8")).hexdigest()[:32]
+            id_map[old_id] = new_id
+            element["element_id"] = new_id
+
+            metadata = element.setdefault("metadata", {})
+            if metadata.get("page_number") is not None:
+                metadata["page_number"] += page_offset
+
+            image_path = metadata.get("image_path")
+            if image_path and os.path.exists(image_path):
+                target_path = os.path.join(image_output_dir, f"p{start_page}-{os.path.basename(image_path)}")
+                shutil.move(image_path, target_path)
+                metadata["image_path"] = target_path
+
+        for element in elements_list:
+            metadata = element["metadata"]
+            if metadata.get("parent_id") in id_map:
+                metadata["parent_id"] = id_map[metadata["parent_id"]]
+
+        shutil.rmtree(os.path.join(image_output_dir, f"pages-{start_page}"), ignore_errors=True)
+        merged.extend(elements_list)
+    return merged
+
+
+def _iter_range_partitions(range_specs, filename, image_output_dir, max_workers, stop=None):
+    """
+    Partition (start_page, end_page, range_bytes, strategy) specs, in a process pool when
+    more than one worker is available, yielding (end_page, element dicts) per range in
+    page order as soon as each range and all ranges before it are done. Once stop (a
+    threading.Event) is set, no further range is started or waited for.
+    """
+    workers = max(1, min(max_workers, len(range_specs)))
+    if workers == 1:
+        for start_page, end_page, range_bytes, strategy in range_specs:
+            if stop is not None and stop.is_set():
+                return
+            elements_list = _partition_page_range(range_bytes, start_page, image_output_dir, filename, strategy)
+            if stop is not None and stop.is_set():
+                shutil.rmtree(os.path.join(image_output_dir, f"pages-{start_page}"), ignore_errors=True)
+                return
+            yield end_page, _merge_range_elements([(start_page, elements_list)], image_output_dir)
+        return
+
+    print(f"Partitioning {len(range_specs)} page ranges with {workers} workers..")
+    # The pool outlives this document: its workers keep the layout model loaded
+    executor = get_partition_pool(max_workers)
+    futures = []
+    try:
+        futures = [
+            (start_page, end_page, executor.submit(_partition_page_range, range_bytes, start_page, image_output_dir, filename, strategy))
+            for start_page, end_page, range_bytes, strategy in range_specs
+        ]
+        for start_page, end_page, future in futures:
+            # Poll, so a stopped consumer does not wait for a range nobody will read
+            while stop is not None and not future.done():
+                if stop.is_set():
+                    return
+                wait([future], timeout=0.1)
+            yield end_page, _merge_range_elements([(start_page, future.result())], image_output_dir)
+    except BrokenProcessPool:
+        reset_partition_pool()
+        raise
+    finally:
+        # Consumers may stop early; do not keep partitioning pages nobody will read
+        for _, _, future in futures:
+            future.cancel()
+
+
+def _partition_ranges(range_specs, filename, image_output_dir, max_workers):
+    elements_list = []
+    for _, range_elements in _iter_range_partitions(range_specs, filename, image_output_dir, max_workers):
+        elements_list.extend(range_elements)
+    return elements_list
+
+
+def _build_range_specs(pdf_bytes, pages_per_range, triage):
+    """
+    Split a PDF into (start_page, end_page, range_bytes, strategy) partition specs.
+
+    Returns:
+        tuple: (range specs, per-page triage decisions or None when triage is off)
+    """
+    if not triage:
+        range_specs = [
+            (start_page, end_page, range_bytes, "hi_res")
+            for start_page, end_page, range_bytes in split_pdf_into_ranges(pdf_bytes, pages_per_range)
+        ]
+        return range_specs, None
+
+    decisions = triage_pages(pdf_bytes)
+    summary = summarize_page_strategies(decisions)
+    print(f"Triage: {summary['fast_pages']} fast / {summary['hi_res_pages']} hi_res pages "
+          f"({summary['hi_res_saved_pct']}% of hi_res work skipped)")
+
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    range_specs = [
+        (start_page, end_page, extract_pdf_pages(reader, start_page, end_page), strategy)
+        for strategy, start_page, end_page in group_pages_by_strategy(decisions, pages_per_range)
+    ]
+    return range_specs, decisions
+
+
+def partition_pdf_parallel(pdf_bytes, filename=None, image_output_dir=IMAGE_FOLDER,
+                           max_workers=PARTITION_MAX_WORKERS, pages_per_range=PARTITION_PAGES_PER_RANGE):
+    """
+    Partition a PDF with hi_res by splitting it into page ranges processed in a process pool.
+
+    Args:
+        pdf_bytes (bytes): Raw PDF contents.
+        filename (str): Filename recorded in the element metadata.
+        image_output_dir (str): Folder the extracted image blocks end up in.
+        max_workers (int): Number of worker processes.
+        pages_per_range (int): Pages handed to a worker at a time.
+
+    Returns:
+        list: The element dicts in page order.
+    """
+    range_specs, _ = _build_range_specs(pdf_bytes, pages_per_range, triage=False)
+    return _partition_ranges(range_specs, filename, image_output_dir, max_workers)
+
+
+def partition_pdf_triaged(pdf_bytes, filename=None, image_output_dir=IMAGE_FOLDER,
+                          max_workers=PARTITION_MAX_WORKERS, pages_per_range=PARTITION_PAGES_PER_RANGE):
+    """
+    Partition a PDF page by page with the cheapest strategy that works for each page.
+
+    Born-digital text-only pages use the "fast" strategy; scanned pages and pages with
+    images or tables use hi_res. Consecutive pages with the same strategy are partitioned
+    together and the results are merged into one element stream in page order.
+
+    Returns:
+        tuple: (element dicts, per-page triage decisions)
+    """
+    range_specs, decisions = _build_range_specs(pdf_bytes, pages_per_range, triage=True)
+    elements_list = _partition_ranges(range_specs, filename, image_output_dir, max_workers)
+    return elements_list, decisions
+
+
+def _partition_cache_key(pdf_bytes, triage, pages_per_range):
+    # Every mode partitions the same page ranges and merges them the same way, only in
+    # or out of the process pool, so serial and parallel runs share their entries
+    params = {
+        "strategy": "triage" if triage else "hi_res",
+        "infer_table_structure": True,
+        "extract_images_in_pdf": True,
+        "pages_per_range": pages_per_range,
+        "unstructured_version": unstructured_version,
+    }
+    return compute_cache_key(pdf_bytes, params)
+
+
+def _count_elements(elements_list, pages=True):
+    count("elements", len(elements_list))
+    if pages:
+        count("pages", max((element.get("metadata", {}).get("page_number") or 1 for element in elements_list), default=0))
+
+
+def iter_partitioned_ranges(file, image_output_dir=IMAGE_FOLDER, use_cache=True,
+                            max_workers=PARTITION_MAX_WORKERS, pages_per_range=PARTITION_PAGES_PER_RANGE,
+                            triage=PARTITION_TRIAGE, report=None, stop=None):
+    """
+    Partition a PDF range by range, yielding each range as soon as it is ready. Setting
+    stop (a threading.Event) ends partitioning at the next range boundary.
+
+    The output is the same element stream partition_pdf_elements produces and shares its
+    cache entries: a cached document is replayed range by range and a freshly
+    partitioned one is stored once the last range is done.
+
+    Yields:
+        tuple: (last page number of the range, element dicts of the range)
+    """
+    pdf_bytes = read_file_bytes(file)
+    filename = getattr(file, "name", None)
+    if report is None:
+        report = {}
+    cache_key = _partition_cache_key(pdf_bytes, triage, pages_per_range)
+
+    if use_cache:
+        elements_list = partition_cache.get(cache_key, image_output_dir)
+        if elements_list is not None:
+            count("cache_hits")
+            report["cache_hit"] = True
+            report.update(partition_cache.get_info(cache_key) or {})
+            _count_elements(elements_list)
+            range_elements = []
+            range_end = pages_per_range
+            for element in elements_list:
+                page_number = element.get("metadata", {}).get("page_number") or 1
+                if page_number > range_end and range_elements:
+                    yield range_end, range_elements
+                    range_elements = []
+                while page_number > range_end:
+                    range_end += pages_per_range
+                range_elements.append(element)
+            if range_elements:
+                yield range_end, range_elements
+            return
+    report["cache_hit"] = False
+
+    range_specs, decisions = _build_range_specs(pdf_bytes, pages_per_range, triage)
+    info = None
+    if decisions is not None:
+        info = {"page_strategies": decisions, "strategy_summary": summarize_page_strategies(decisions)}
+        report.update(info)
+
+    # Consumers shift page numbers and delete the images of each range they are given,
+    # so every range is copied into the cache entry before it is handed out
+    entry = partition_cache.open_entry() if use_cache else None
+    try:
+        for end_page, range_elements in _iter_range_partitions(range_specs, filename, image_output_dir, max_workers, stop):
+            _count_elements(range_elements, pages=False)
+            if entry is not None:
+                partition_cache.add_to_entry(entry, range_elements)
+            yield end_page, range_elements
+        if stop is not None and stop.is_set():
+            return  # stopped part way: the entry is incomplete and discarded below
+        count("pages", range_specs[-1][1] if range_specs else 0)
+        if entry is not None:
+            partition_cache.commit_entry(cache_key, entry, info=info)
+            entry = None
+    finally:
+        if entry is not None:
+            partition_cache.discard_entry(entry)
+
+
+@traced("partition")
+def partition_pdf_elements(file, image_output_dir=IMAGE_FOLDER, use_cache=True, parallel=None,
+                           max_workers=PARTITION_MAX_WORKERS, pages_per_range=PARTITION_PAGES_PER_RANGE,
+                           triage=PARTITION_TRIAGE, report=None):
+    """
+    Partition a PDF into element dicts, reusing a cached result for documents seen before.
+
+    Args:
+        file: Uploaded PDF file or file-like object.
+        image_output_dir (str): Folder the extracted image blocks are written to.
+        use_cache (bool): Whether to consult and populate the partition cache.
+        parallel (bool | None): Partition the page ranges in a process pool rather than
+            one after the other in this process; the output is the same. None picks the
+            pool when the document spans more than one range and more than one worker is
+            configured.
+        max_workers (int): Worker processes for the parallel mode.
+        pages_per_range (int): Pages partitioned together.
+        triage (bool): Pick "fast" or hi_res per page instead of hi_res everywhere.
+        report (dict | None): Filled with "cache_hit" and, in triage mode,
+            "page_strategies" (the per-page decisions) and "strategy_summary".
+
+    Returns:
+        list: The element dicts, as produced by element.to_dict().
+    """
+    pdf_bytes = read_file_bytes(file)
+    filename = getattr(file, "name", None)
+    if report is None:
+        report = {}
+    if parallel is None:
+        parallel = max_workers > 1 and count_pdf_pages(pdf_bytes) > pages_per_range
+
+    cache_key = _partition_cache_key(pdf_bytes, triage, pages_per_range)
+
+    if use_cache:
+        elements_list = partition_cache.get(cache_key, image_output_dir)
+        if elements_list is not None:
+            count("cache_hits")
+            report["cache_hit"] = True
+            report.update(partition_cache.get_info(cache_key) or {})
+            _count_elements(elements_list)
+            return elements_list
+    report["cache_hit"] = False
+
+    info = None
+    if triage:
+        elements_list, decisions = partition_pdf_triaged(
+            pdf_bytes, filename, image_output_dir,
+            max_workers=max_workers if parallel else 1, pages_per_range=pages_per_range
+        )
+        info = {"page_strategies": decisions, "strategy_summary": summarize_page_strategies(decisions)}
+        report.update(info)
+    else:
+        elements_list = partition_pdf_parallel(
+            pdf_bytes, filename, image_output_dir,
+            max_workers=max_workers if parallel else 1, pages_per_range=pages_per_range
+        )
+
+    if use_cache:
+        partition_cache.put(cache_key, elements_list, info=info)
+
+    _count_elements(elements_list)
+    return elements_list
@@ -1,10 +1,19 @@
+import hashlib
+import multiprocessing
 import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 
 from pptx.util import Inches, Pt
 from pptx import Presentation
 from pptx.dml.color import RGBColor
 
+from constants import PPT_FONT_NAME, PPT_IMAGE_DPI, PPT_MAX_WORKERS, PPT_PARALLEL_MIN_PAGES
+from font_fitting import fit_font_sizes
+from image_preprocessing import prepare_image_for_slide
 from overlap_utils import adjust_overlapping_objects_in_ppt, find_unique_overlapping_and_non_overlapping_objects
 
 def organize_data_by_page(json_data):
@@ -19,7 +28,215 @@ def organize_data_by_page(json_data):
     # Sort pages and return as a list of lists
     return [pages[key] for key in sorted(pages.keys())]
 
-def create_ppt_demo(json_data, slide_width_inch=13.33, slide_height_inch=7.5):
+def element_box_inches(coordinates, px_to_inch_x, px_to_inch_y):
+    """
+    Bounding box of an element's points as a dict of left, top, width and height in inches.
+    """
+    left_px = min(point[0] for point in coordinates)
+    top_px = min(point[1] for point in coordinates)
+    right_px = max(point[0] for point in coordinates)
+    bottom_px = max(point[1] for point in coordinates)
+
+    return {
+        "left": left_px * px_to_inch_x,
+        "top": top_px * px_to_inch_y,
+        "width": (right_px - left_px) * px_to_inch_x,
+        "height": (bottom_px - top_px) * px_to_inch_y,
+    }
+
+
+class SlideImages:
+    """
+    Picture data for a deck, resampled to display resolution.
+
+    Identical image files (by content) are resampled once, to the largest box any of
+    their occurrences gets, so every slide embeds the same bytes and python-pptx stores
+    a single image part for them. Boxes are taken before overlap resolution, which only
+    shrinks them, so the resolution is enough for every occurrence.
+    """
+
+    def __init__(self, json_data, slide_width_inch=13.33, slide_height_inch=7.5, dpi=PPT_IMAGE_DPI):
+        self.dpi = dpi
+        self.images = 0
+        self.original_bytes = 0
+        self.embedded_bytes = 0
+        self._keys = {}
+        self._boxes = {}
+        self._data = {}
+
+        for element in json_data:
+            image_path = element['metadata'].get('image_path')
+            if element['type'] != 'Image' or not image_path or not os.path.exists(image_path):
+                continue
+            if image_path not in self._keys:
+                with open(image_path, "rb") as f:
+                    self._keys[image_path] = hashlib.sha256(f.read()).hexdigest()
+            key = self._keys[image_path]
+
+            coordinates = element['metadata']['coordinates']
+            box = element_box_inches(
+                coordinates['points'],
+                slide_width_inch / coordinates['layout_width'],
+                slide_height_inch / coordinates['layout_height'],
+            )
+            width, height = self._boxes.get(key, (0.0, 0.0))
+            self._boxes[key] = (max(width, box["width"]), max(height, box["height"]))
+
+    def get(self, image_path):
+        """
+        Returns:
+            BytesIO | None: Image data for add_picture, None for images that were not planned.
+        """
+        key = self._keys.get(image_path)
+        if key is None:
+            return None
+        self.images += 1
+        if key not in self._data:
+            width, height = self._boxes[key]
+            try:
+                self._data[key] = prepare_image_for_slide(image_path, width, height, self.dpi)
+            except OSError as e:
+                print("Error resampling image", image_path, e)
+                with open(image_path, "rb") as f:
+                    self._data[key] = f.read()
+            self.original_bytes += os.path.getsize(image_path)
+            self.embedded_bytes += len(self._data[key])
+        return BytesIO(self._data[key])
+
+    def stats(self):
+        return {
+            "images": self.images,
+            "unique_images": len(self._data),
+            "image_original_bytes": self.original_bytes,
+            "image_embedded_bytes": self.embedded_bytes,
+        }
+
+
+def compute_page_layout(page_data, slide_width_inch=13.33, slide_height_inch=7.5):
+    """
+    Work out the shapes of one slide without touching a presentation: overlap resolution,
+    conversion from layout pixels to inches and font fitting. Picklable in and out, so
+    pages can be laid out in worker processes.
+
+    Args:
+        page_data (list): Elements of one page.
+
+    Returns:
+        list: Shape dicts with kind ("table", "image", "text"), left, top, width and
+        height in inches, plus text and font_size for text or image_path for images.
+    """
+    # Get unique overlap and non overlap elements
+    overlaps,non_overlaps = find_unique_overlapping_and_non_overlapping_objects(page_data)
+
+    # Adjust the coordinates of the overlapping objects
+    adjusted_overlaps_objects = adjust_overlapping_objects_in_ppt(overlaps)
+
+    # Merge the adjusting overlapping objects and non overlapping objects
+    adjusted_elements = adjusted_overlaps_objects + non_overlaps
+
+    # Get layout dimensions from the first element in page_data
+    layout_width_px = adjusted_elements[0]['metadata']['coordinates']['layout_width']
+    layout_height_px = adjusted_elements[0]['metadata']['coordinates']['layout_height']
+
+    # Calculate pixel to inch conversion factors
+    px_to_inch_x = slide_width_inch / layout_width_px
+    px_to_inch_y = slide_height_inch / layout_height_px
+
+    shapes = []
+    for element in adjusted_elements:
+        element_type = element['type']
+        shape = element_box_inches(element['metadata']['coordinates']['points'], px_to_inch_x, px_to_inch_y)
+        if element_type == 'Table':
+            shape["kind"] = "table"
+        elif element_type == 'Image':
+            shape["kind"] = "image"
+            shape["image_path"] = element['metadata'].get('image_path')
+        else:
+            # Text box for other types (e.g., Title, NarrativeText, ListItem)
+            shape["kind"] = "text"
+            shape["text"] = element['text']
+        shapes.append(shape)
+
+    # Size all text boxes of the slide at once
+    text_shapes = [shape for shape in shapes if shape["kind"] == "text"]
+    font_sizes = fit_font_sizes([(shape["text"], shape["width"], shape["height"]) for shape in text_shapes])
+    for shape, font_size in zip(text_shapes, font_sizes):
+        shape["font_size"] = font_size
+    return shapes
+
+
+def _add_placeholder(slide, shape, label):
+    # Light gray block standing in for tables and missing images
+    block = slide.shapes.add_shape(
+        1,  # Rectangle shape
+        Inches(shape["left"]), Inches(shape["top"]),
+        Inches(shape["width"]), Inches(shape["height"])
+    )
+    fill = block.fill
+    fill.solid()
+    fill.fore_color.rgb = RGBColor(192, 192, 192)
+    block.text_frame.text = label
+
+
+def add_slide_from_layout(prs, shapes, slide_images=None):
+    """
+    Add a blank slide with the shapes computed by compute_page_layout. Pictures come
+    from slide_images when given, otherwise the files are embedded as they are.
+    """
+    slide_layout = prs.slide_layouts[6]  # Blank layout
+    slide = prs.slides.add_slide(slide_layout)
+
+    for shape in shapes:
+        if shape["kind"] == "table":
+            _add_placeholder(slide, shape, "TP")
+        elif shape["kind"] == "image":
+            image_path = shape.get("image_path")
+            image = slide_images.get(image_path) if slide_images else None
+            if image is None and image_path and os.path.exists(image_path):
+                image = image_path
+            if image is not None:
+                slide.shapes.add_picture(image, Inches(shape["left"]), Inches(shape["top"]),
+                                         Inches(shape["width"]), Inches(shape["height"]))
+            else:
+                # If image is not found, add a placeholder shape
+                _add_placeholder(slide, shape, "IP")
+        else:
+            textbox = slide.shapes.add_textbox(Inches(shape["left"]), Inches(shape["top"]),
+                                               Inches(shape["width"]), Inches(shape["height"]))
+            text_frame = textbox.text_frame
+            text_frame.text = shape["text"]
+            text_frame.word_wrap = True
+            # Font name and size are written once per run
+            set_text_frame_font(text_frame, shape["font_size"])
+    return slide
+
+
+def iter_page_layouts(pages_data, slide_width_inch=13.33, slide_height_inch=7.5, max_workers=1):
+    """
+    Yield the layout of each page in page order, computed in a process pool when more
+    than one worker is given. At most two pages per worker are in flight, so finished
+    layouts do not pile up while the main process assembles slides.
+    """
+    workers = max(1, min(max_workers, len(pages_data)))
+    if workers == 1:
+        for page_data in pages_data:
+            print("Processing page data",page_data[0]['metadata'].get('page_number', 1))
+            yield compute_page_layout(page_data, slide_width_inch, slide_height_inch)
+        return
+
+    print(f"Laying out {len(pages_data)} pages with {workers} workers..")
+    # spawn keeps the workers independent of the threads running in the Streamlit server
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = deque()
+        for page_data in pages_data:
+            pending.append(executor.submit(compute_page_layout, page_data, slide_width_inch, slide_height_inch))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def build_presentation(json_data, slide_width_inch=13.33, slide_height_inch=7.5, max_workers=1, slide_images=None):
     prs = Presentation()
 
     # Set slide dimensions
@@ -28,89 +245,19 @@ def create_ppt_demo(json_data, slide_width_inch=13.33, slide_height_inch=7.5):
 
     # Organize data by page
     pages_data = organize_data_by_page(json_data)
+    if len(pages_data) < PPT_PARALLEL_MIN_PAGES:
+        # Starting worker processes costs more than laying out a few pages
+        max_workers = 1
+
+    for shapes in iter_page_layouts(pages_data, slide_width_inch, slide_height_inch, max_workers):
+        add_slide_from_layout(prs, shapes, slide_images)
+    return prs
+
+
+def create_ppt_demo(json_data, slide_width_inch=13.33, slide_height_inch=7.5):
+    slide_images = SlideImages(json_data, slide_width_inch, slide_height_inch)
+    prs = build_presentation(json_data, slide_width_inch, slide_height_inch, slide_images=slide_images)
 
-    for page_data in pages_data:
-            
-        print("Processing page data",page_data[0]['metadata'].get('page_number', 1))    
-        
-        # Get unique overlap and non overlap elements
-        overlaps,non_overlaps = find_unique_overlapping_and_non_overlapping_objects(page_data)
-        
-        # Adjust the coordinates of the overlapping objects
-        adjusted_overlaps_objects = adjust_overlapping_objects_in_ppt(overlaps)
-
-        # Merge the adjusting overlapping objects and non overlapping objects
-        adjusted_elements = adjusted_overlaps_objects + non_overlaps
-
-        # Get layout dimensions from the first element in page_data
-        layout_width_px = adjusted_elements[0]['metadata']['coordinates']['layout_width']
-        layout_height_px = adjusted_elements[0]['metadata']['coordinates']['layout_height']
-
-        # Calculate pixel to inch conversion factors
-        px_to_inch_x = slide_width_inch / layout_width_px
-        px_to_inch_y = slide_height_inch / layout_height_px
-
-        # Add a blank slide layout
-        slide_layout = prs.slide_layouts[6]  # Blank layout
-        slide = prs.slides.add_slide(slide_layout)
-
-        for element in adjusted_elements:
-            text = element['text']
-            element_type = element['type']
-            coordinates = element['metadata']['coordinates']['points']
-
-            # Calculate bounding box dimensions in inches
-            left_px = min(point[0] for point in coordinates)
-            top_px = min(point[1] for point in coordinates)
-            right_px = max(point[0] for point in coordinates)
-            bottom_px = max(point[1] for point in coordinates)
-
-            left_inch = left_px * px_to_inch_x
-            top_inch = top_px * px_to_inch_y
-            width_inch = (right_px - left_px) * px_to_inch_x
-            height_inch = (bottom_px - top_px) * px_to_inch_y
-
-            if element_type == 'Table':
-                # Add a colored block (rectangle) for Table type
-                shape = slide.shapes.add_shape(
-                    1,  # Rectangle shape
-                    Inches(left_inch), Inches(top_inch),
-                    Inches(width_inch), Inches(height_inch)
-                )
-                fill = shape.fill
-                fill.solid()
-                fill.fore_color.rgb = RGBColor(192, 192, 192)  # Light gray color for Table blocks
-                shape.text_frame.text = "TP"
-            elif element_type == 'Image':
-                # Add the image to the slide
-                image_path = element['metadata'].get('image_path')
-                if image_path and os.path.exists(image_path):
-                    slide.shapes.add_picture(image_path, Inches(left_inch), Inches(top_inch),
-                                             Inches(width_inch), Inches(height_inch))
-                else:
-                    # If image is not found, add a placeholder shape
-                    shape = slide.shapes.add_shape(
-                        1,  # Rectangle shape
-                        Inches(left_inch), Inches(top_inch),
-                        Inches(width_inch), Inches(height_inch)
-                    )
-                    fill = shape.fill
-                    fill.solid()
-                    fill.fore_color.rgb = RGBColor(192, 192, 192)  # Light gray color for missing images
-                    shape.text_frame.text = "IP"
-            else:
-                # Add text box for other types (e.g., Title, NarrativeText, ListItem)
-                textbox = slide.shapes.add_textbox(Inches(left_inch), Inches(top_inch), Inches(width_inch), Inches(height_inch))
-                text_frame = textbox.text_frame
-                text_frame.text = text
-                text_frame.word_wrap = True
-
-                # Dynamically adjust the font size based on the bounding box
-                optimal_font_size = fit_text_in_box(text_frame, width_inch, height_inch)
-                for paragraph in text_frame.paragraphs:
-                    for run in paragraph.runs:
-                        run.font.size = Pt(optimal_font_size)
-    
     ppt_io = BytesIO()
     prs.save(ppt_io)
     ppt_io.seek(0)  # Reset buffer pointer
@@ -119,21 +266,44 @@ def create_ppt_demo(json_data, slide_width_inch=13.33, slide_height_inch=7.5):
     # # Save the presentation
     # prs.save('output_presentation_multiple_pages.pptx')
 
-def fit_text_in_box(text_frame, width_inch, height_inch, font_name='Calibri'):
-    max_font_size = 36
-    min_font_size = 6
 
-    for font_size in range(max_font_size, min_font_size - 1, -1):
-        for paragraph in text_frame.paragraphs:
-            for run in paragraph.runs:
-                run.font.name = font_name
-                run.font.size = Pt(font_size)
+def create_ppt_file(json_data, slide_width_inch=13.33, slide_height_inch=7.5, max_workers=PPT_MAX_WORKERS,
+                    dpi=PPT_IMAGE_DPI, report=None):
+    """
+    Build the deck with page layouts computed in parallel and save it to a temporary file
+    instead of memory. The caller owns the file and should delete it when done.
+
+    Args:
+        json_data (list): Partitioned elements of the document.
+        dpi (int): Resolution pictures are resampled to for their box on the slide.
+        report (dict | None): Filled with slides, seconds, deck_bytes and image stats.
+
+    Returns:
+        str: Path of the .pptx file.
+    """
+    start_time = time.time()
+    slide_images = SlideImages(json_data, slide_width_inch, slide_height_inch, dpi)
+    prs = build_presentation(json_data, slide_width_inch, slide_height_inch, max_workers, slide_images)
+
+    with tempfile.NamedTemporaryFile(suffix=".pptx", delete=False) as ppt_file:
+        prs.save(ppt_file)
 
-        lines = text_frame.text.count("\n") + 1
-        approx_text_height = lines * 1.2 * (font_size / 72)
-        approx_text_width = len(text_frame.text) * 0.6 * (font_size / 72)
+    if report is None:
+        report = {}
+    report.update(slide_images.stats())
+    report["slides"] = len(prs.slides)
+    report["seconds"] = time.time() - start_time
+    report["deck_bytes"] = os.path.getsize(ppt_file.name)
+    print(
+        f"Built deck of {report['slides']} slides ({report['deck_bytes'] / 1e6:.1f} MB) in {report['seconds']:.2f}s, "
+        f"{report['unique_images']} unique images embedded in {report['image_embedded_bytes'] / 1e6:.1f} MB "
+        f"(from {report['image_original_bytes'] / 1e6:.1f} MB)"
+    )
+    return ppt_file.name
 
-        if approx_text_height <= height_inch and approx_text_width <= width_inch:
-            return font_size  # Return the next smaller font size
+def set_text_frame_font(text_frame, font_size, font_name=PPT_FONT_NAME):
+    for paragraph in text_frame.paragraphs:
+        for run in paragraph.runs:
+            run.font.name = font_name
+            run.font.size = Pt(font_size)
 
-    return min_font_size
\ No newline at end of file
@@ -1,19 +1,44 @@
 import asyncio
 import base64
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
-import os
-import aiohttp
 from llama_index.core import Document
-from openai import OpenAI
-import requests
-from constants import DEFAULT_SYSTEM_PROMPT
+from constants import (
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_TOKENIZER_MODEL,
+    DEFAULT_SYSTEM_PROMPT,
+    IMAGE_BATCH_MAX_IMAGES,
+    IMAGE_BATCH_TOKEN_BUDGET,
+    IMAGE_DESCRIPTION_CONCURRENCY,
+    IMAGE_DESCRIPTION_MAX_ATTEMPTS,
+    IMAGE_DESCRIPTION_MAX_TOKENS_PER_IMAGE,
+    IMAGE_DESCRIPTION_MODEL,
+    IMAGE_PIPELINE_QUEUE_BATCHES,
+    IMAGE_PREPARE_WORKERS,
+    TABLE_SUMMARY_MODEL,
+    VISION_TOKEN_COSTS,
+)
 from langchain_core.prompts import PromptTemplate
 
-from utils import delete_all_files_in_folder
+from image_preprocessing import DuplicateIndex, prepare_image_for_vision
+from instrumentation import count, span, traced
+from llm_cache import LLMResponseCache, hash_content
+from rate_limiter import get_encoding, scheduled_chat_completion
+from utils import delete_files
+
+# Joins the elements of a text chunk; counted as one token
+CHUNK_SEPARATOR = "\n"
 
 def encode_image(image_path):
   with open(image_path, "rb") as image_file:
-    return base64.b64encode(image_file.read()).decode('utf-8')
+    return encode_image_bytes(image_file.read())
+
+def encode_image_bytes(image_bytes):
+  return base64.b64encode(image_bytes).decode('utf-8')
 
 table_template = """Analyze the table provided in the context below. Summarize the key insights, trends, and significant points that can be extracted from the data.
 
@@ -28,21 +53,19 @@ table_prompt_template = PromptTemplate(
     template=table_template
 )
 
-def call_openai_api(query,system_prompt,model="gpt-4o"):
-    client = OpenAI()
-    response = client.chat.completions.create(
-    model=model,
-    messages=[
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": query},
-    ]
-    )
-    # print("response ",response.choices[0].message.content)
-    return response.choices[0].message.content
+image_description_prompt = (
+    "Describe each image with clear, precise sentences. Start with 'The image shows' and detail the main subject and key features. "
+    "Use formal language, avoid opinions, and keep a neutral tone. "
+    "Each image is preceded by its label 'Image <index>'. Reply with a JSON object of the form "
+    '{"descriptions": [{"index": <index>, "description": "<description>"}]} with one entry per image.'
+)
 
-def call_openai_api_sync(query, system_prompt, model="gpt-4o"):
-    client = OpenAI()
-    response = client.chat.completions.create(
+llm_cache = LLMResponseCache()
+llm_cache.purge_stale("table_summary", DEFAULT_SYSTEM_PROMPT + table_template)
+llm_cache.purge_stale("image_description", image_description_prompt)
+
+async def acall_openai_api(query, system_prompt, model="gpt-4o"):
+    response = await scheduled_chat_completion(
         model=model,
         messages=[
             {"role": "system", "content": system_prompt},
@@ -51,28 +74,75 @@ def call_openai_api_sync(query, system_prompt, model="gpt-4o"):
     )
     return response.choices[0].message.content
 
-async def async_call_openai(query, system_prompt, semaphore, model="gpt-4o"):
-    async with semaphore:  # Use semaphore to control concurrency
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, call_openai_api_sync, query, system_prompt, model)
-
-
-async def process_table_chunk(chunk, idx, system_prompt,semaphore):
-    text = await async_call_openai(table_prompt_template.format(table_html=chunk.get("metadata").get("text_as_html")), system_prompt,semaphore)
+async def astream_openai_api(query, system_prompt, model="gpt-4o", metrics=None):
+    """
+    Stream a chat completion, yielding text deltas as they arrive.
+
+    Args:
+        query (str): User prompt.
+        system_prompt (str): System prompt.
+        model (str): Model to use.
+        metrics (dict | None): Filled with time_to_first_token, total_time and
+            output_chunks (seconds from the call, and deltas received).
+
+    Yields:
+        str: Pieces of the answer text.
+    """
+    if metrics is None:
+        metrics = {}
+    start_time = time.perf_counter()
+    with span("generate", model=model) as stage:
+        # Rate limits and retries apply to opening the stream; tokens then flow without a slot held
+        stream = await scheduled_chat_completion(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": query},
+            ],
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        metrics["output_chunks"] = 0
+        async for event in stream:
+            if event.usage:
+                stage.count("prompt_tokens", event.usage.prompt_tokens)
+                stage.count("completion_tokens", event.usage.completion_tokens)
+            if not event.choices:
+                continue
+            delta = event.choices[0].delta.content
+            if not delta:
+                continue
+            if "time_to_first_token" not in metrics:
+                metrics["time_to_first_token"] = time.perf_counter() - start_time
+                stage.attributes["time_to_first_token"] = round(metrics["time_to_first_token"], 4)
+            metrics["output_chunks"] += 1
+            yield delta
+        metrics["total_time"] = time.perf_counter() - start_time
+
+
+@traced("table_summarize")
+async def process_table_chunk(chunk, idx, system_prompt,doc_id_prefix=""):
+    table_html = chunk.get("metadata").get("text_as_html") or ""
+    table_hash = hash_content(table_html)
+    text = llm_cache.get("table_summary", table_hash, TABLE_SUMMARY_MODEL, system_prompt + table_template)
+    count("tables")
+    if text is not None:
+        count("cache_hits")
+    else:
+        text = await acall_openai_api(table_prompt_template.format(table_html=table_html), system_prompt, model=TABLE_SUMMARY_MODEL)
+        llm_cache.put("table_summary", table_hash, TABLE_SUMMARY_MODEL, system_prompt + table_template, text)
     metadata = {
         "filename": chunk.get("metadata").get("filename"),
         "page_number": chunk.get("metadata").get("page_number"),
         "type": chunk.get("type"),
     }
-    return Document(doc_id=str(idx), text=text, metadata=metadata)
+    return Document(doc_id=f"{doc_id_prefix}{idx}", text=text, metadata=metadata)
 
 
-async def create_documents(chunks, max_concurrent_calls=5):
-    print("Length of chunks",len(chunks))
+async def create_documents(chunks, doc_id_prefix=""):
     docs= []
     image_paths= []
     tasks=[]
-    semaphore = asyncio.Semaphore(max_concurrent_calls)
     for idx,chunk in enumerate(chunks,start=1):
 
         text = chunk.get("text")
@@ -85,7 +155,7 @@ async def create_documents(chunks, max_concurrent_calls=5):
                 print("Error getting image description",e)
         if chunk.get("type") == "Table":
             try:
-                tasks.append(process_table_chunk(chunk, idx, DEFAULT_SYSTEM_PROMPT,semaphore))
+                tasks.append(process_table_chunk(chunk, idx, DEFAULT_SYSTEM_PROMPT,doc_id_prefix))
                 continue
             except Exception as e:
                 print("Error getting table description",e)
@@ -93,162 +163,381 @@ async def create_documents(chunks, max_concurrent_calls=5):
         metadata = {
             "filename":metadata.get("filename"),
             "page_number":metadata.get("page_number"),
+            "page_end":metadata.get("page_end"),
             "type": chunk.get("type"),
         }
-        doc = Document(doc_id=str(idx),text=text, metadata=metadata)
+        doc = Document(doc_id=f"{doc_id_prefix}{idx}",text=text, metadata=metadata)
         docs.append(doc)
     
-    print("Length of docs before processing images and tables",len(docs))
-    print("Length of image paths",len(image_paths))
-    if image_paths:
-        image_descriptions =await get_image_descriptions_batched_async(image_paths)
-        print("Length of image descriptions ",len(image_descriptions))
-        print("Image descriptions ",image_descriptions)
-        for idx,image_description in enumerate(image_descriptions,start=1):
-            metadata = {
-                "filename":image_description.get("filename"),
-                "page_number":image_description.get("page_number"),
-                "type": "Image",
-            }
-            doc = Document(doc_id=f"Image-{idx}",text=image_description.get("description"), metadata=metadata)
-            docs.append(doc)
-    
-    len_of_docs_after_image = len(docs)
-    if tasks:
-        table_docs = await asyncio.gather(*tasks)
-        docs.extend(table_docs)
+    # Image descriptions and table summaries run side by side
+    image_descriptions, *table_docs = await asyncio.gather(
+        get_image_descriptions_batched_async(image_paths) if image_paths else asyncio.sleep(0, result=[]),
+        *tasks,
+    )
+    for idx,image_description in enumerate(image_descriptions,start=1):
+        metadata = {
+            "filename":image_description.get("filename"),
+            "page_number":image_description.get("page_number"),
+            "type": "Image",
+        }
+        doc = Document(doc_id=f"{doc_id_prefix}Image-{idx}",text=image_description.get("description"), metadata=metadata)
+        docs.append(doc)
+    docs.extend(table_docs)
     
-    print("Length of tables ",len(tasks))
-    print("Length of docs of tables ",len(docs)-len_of_docs_after_image)
-    delete_all_files_in_folder(folder_path="image_blocks")
+    # Only remove this batch's images; other batches may still be using the folder
+    delete_files([image_obj.get("image_path") for image_obj in image_paths])
 
-    print("Total length of docs",len(docs))
+    count("documents", len(docs))
     return docs
 
-def chunk_elements(elements,filename, max_words=400):
+def _text_chunk(parts, filename):
+    pages = [page for _, _, page in parts if page is not None]
+    return {
+        "type": "COMBINED_ELEMENT",
+        "text": CHUNK_SEPARATOR.join(text for text, _, _ in parts),
+        "total_tokens": sum(tokens for _, tokens, _ in parts) + len(parts) - 1,
+        "metadata": {
+            "filename": filename,
+            "page_number": min(pages) if pages else None,
+            "page_end": max(pages) if pages else None,
+            "text_as_html": None,
+        },
+    }
+
+
+def _split_long_text(text, encoding, max_tokens, overlap_tokens):
+    # Windows of max_tokens tokens, consecutive windows sharing overlap_tokens
+    tokens = encoding.encode_ordinary(text)
+    step = max(1, max_tokens - overlap_tokens)
+    return [
+        (encoding.decode(tokens[start:start + max_tokens]), len(tokens[start:start + max_tokens]))
+        for start in range(0, max(1, len(tokens) - overlap_tokens), step)
+    ]
+
+
+@traced("chunk")
+def chunk_elements(elements, filename, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Group partitioned elements into chunks of at most max_tokens model tokens.
+
+    Images and tables get a chunk each and end the text chunk before them. Text elements
+    are packed in order; a Title starts a new chunk, so sections are not mixed, and a chunk closed for size hands
+    its trailing elements (up to overlap_tokens) on to the next one. Elements longer
+    than a chunk are split into overlapping token windows.
+
+    Args:
+        elements (list): Element dicts from partition_pdf_elements.
+        filename (str): Name of the source document.
+        max_tokens (int): Token limit of a text chunk.
+        overlap_tokens (int): Tokens of context repeated from the previous chunk.
+
+    Returns:
+        list: Chunk dicts with type, text and metadata (filename, page_number and
+        page_end for the pages the chunk spans, image_path, text_as_html).
+    """
+    encoding = get_encoding(CHUNK_TOKENIZER_MODEL)
+    texts = [
+        element.get("text") or ""
+        for element in elements
+        if element.get("type") not in ("Image", "Table")
+    ]
+    # One batched call counts every text element
+    token_counts = iter([len(tokens) for tokens in encoding.encode_ordinary_batch(texts)])
+
     chunks = []
-    current_chunk = {"metadata": {}, "text": "", "total_words": 0}
+    parts = []
+    total_tokens = 0
+
+    def close_chunk(keep_overlap):
+        nonlocal parts, total_tokens
+        if parts:
+            chunks.append(_text_chunk(parts, filename))
+        carried = []
+        carried_tokens = 0
+        if keep_overlap:
+            for part in reversed(parts[1:]):
+                if carried_tokens + part[1] + 1 > overlap_tokens:
+                    break
+                carried.insert(0, part)
+                carried_tokens += part[1] + 1
+        parts = carried
+        total_tokens = sum(tokens for _, tokens, _ in carried) + max(0, len(carried) - 1)
 
     for element in elements:
         element_type = element.get("type")
-        element_text = element.get("text", "")
+        element_text = element.get("text") or ""
         element_metadata = element.get("metadata", {})
+        page_number = element_metadata.get("page_number")
+
+        if element_type in ("Image", "Table"):
+            # Close the open text first, so chunks keep the order of the document
+            close_chunk(keep_overlap=False)
+            chunks.append({
+                "type": element_type,
+                "text": element_text,
+                "metadata": {
+                    "filename": filename,
+                    "page_number": page_number,
+                    "page_end": page_number,
+                    "image_path": element_metadata.get("image_path"),
+                    "text_as_html": element_metadata.get("text_as_html"),
+                },
+            })
+            continue
 
-        # Calculate word count for the current element
-        element_words = len(element_text.split())
-
-        # Handle Image or Table types by creating a new chunk
-        if element_type in ["Image", "Table"]:
-            if current_chunk["text"]:
-                chunks.append(current_chunk)
-                current_chunk = {"metadata": {}, "text": "", "type":element_type,"total_words": 0}
-            current_chunk["type"] = element_type
-            current_chunk["text"] = element_text
-            current_chunk["metadata"] = {
-                "filename": filename,
-                "page_number": element_metadata.get("page_number"),
-                "image_path": element_metadata.get("image_path"),
-                "text_as_html": element_metadata.get("text_as_html")
-            }
-            chunks.append(current_chunk)
-            current_chunk = {"metadata": {}, "text": "","type":element_type ,"total_words": 0}
-        else:
-            # Check if adding this element exceeds the max word limit
-            if current_chunk["total_words"] + element_words > max_words:
-                chunks.append(current_chunk)
-                current_chunk = {"metadata": {}, "text": "", "total_words": 0}
-
-            # Add the element's text to the current chunk
-            current_chunk["text"] += " " + element_text if current_chunk["text"] else element_text
-            current_chunk["total_words"] += element_words
-            current_chunk["metadata"] = {
-                "filename": filename,
-                "page_number": element_metadata.get("page_number"),
-                "text_as_html": element_metadata.get("text_as_html")
-            }
-            current_chunk["type"] = "COMBINED_ELEMENT"
+        element_tokens = next(token_counts)
+        if not element_text.strip():
+            continue
 
-    # Add the last chunk if it has any text
-    if current_chunk["text"]:
-        chunks.append(current_chunk)
+        if element_type == "Title":
+            close_chunk(keep_overlap=False)
 
-    return chunks
+        if element_tokens > max_tokens:
+            close_chunk(keep_overlap=False)
+            for window_text, window_tokens in _split_long_text(element_text, encoding, max_tokens, overlap_tokens):
+                chunks.append(_text_chunk([(window_text, window_tokens, page_number)], filename))
+            continue
 
-async def get_image_descriptions_batched_async(image_objects, batch_size=4):
-    api_key = os.getenv("OPENAI_API_KEY")
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
+        if parts and total_tokens + element_tokens + 1 > max_tokens:
+            close_chunk(keep_overlap=True)
+            if total_tokens + element_tokens + 1 > max_tokens:
+                parts, total_tokens = [], 0
 
-    descriptions = []
-    num_batches = ceil(len(image_objects) / batch_size)
-
-    async with aiohttp.ClientSession(headers=headers) as session:
-        tasks = []
-
-        for i in range(num_batches):
-            batch = image_objects[i * batch_size:(i + 1) * batch_size]
-            images = []
-            for image_obj in batch:
-                base64_image = encode_image(image_obj.get("image_path"))
-                images.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
-                    }
-                })
-
-            print("Images in batch: ", len(images))
-            payload = {
-                "model": "gpt-4o-mini",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": (
-                                    "Describe each image with clear, precise sentences. Start with 'The image shows' and detail the main subject and key features. "
-                                    "Use formal language, avoid opinions, and keep a neutral tone. Separate each description with '###'."
-                                )
-                            },
-                           *images
-                        ]
-                    }
-                ],
-                "max_tokens": 2500
-            }
+        parts.append((element_text, element_tokens, page_number))
+        total_tokens += element_tokens + (1 if len(parts) > 1 else 0)
 
-            # Create a task for each batch
-            tasks.append(asyncio.create_task(fetch_image_descriptions(session, payload, batch)))
+    close_chunk(keep_overlap=False)
 
-        # Await all tasks and collect results
-        results = await asyncio.gather(*tasks)
-        
-        # Flatten the list of descriptions
-        for result in results:
-            descriptions.extend(result)
-    
-    return descriptions
+    count("elements", len(elements))
+    count("chunks", len(chunks))
+    return chunks
+
+def estimate_image_tokens(width, height, model=IMAGE_DESCRIPTION_MODEL):
+    """
+    Vision input tokens of a high-detail image already sized by image_preprocessing:
+    a base cost plus a cost per 512px tile.
+    """
+    base_tokens, tile_tokens = VISION_TOKEN_COSTS.get(model, VISION_TOKEN_COSTS["gpt-4o"])
+    return base_tokens + tile_tokens * ceil(width / 512) * ceil(height / 512)
+
+
+def build_image_batch_payload(prepared_images):
+    content = [{"type": "text", "text": image_description_prompt}]
+    for idx, prepared in enumerate(prepared_images):
+        content.append({"type": "text", "text": f"Image {idx}"})
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{prepared['mime']};base64,{encode_image_bytes(prepared['data'])}"
+            }
+        })
+    return {
+        "model": IMAGE_DESCRIPTION_MODEL,
+        "messages": [{"role": "user", "content": content}],
+        "response_format": {"type": "json_object"},
+        "max_tokens": IMAGE_DESCRIPTION_MAX_TOKENS_PER_IMAGE * len(prepared_images) + 100
+    }
 
-async def fetch_image_descriptions(session, payload, batch):
-    url = "https://api.openai.com/v1/chat/completions"
-    async with session.post(url, json=payload) as response:
-        response_json = await response.json()
 
-        descriptions = []
-        descriptions_split = response_json["choices"][0]["message"]["content"].split('###')
+async def describe_image_batch(batch_entries):
+    """
+    Describe one packed batch, re-requesting only the images missing from the reply.
+
+    A reply cut off at max_tokens or not valid JSON would fail the same way again at the
+    same size, so each retry sends the missing images in batches half the size of the
+    last ones, down to single images.
+
+    Returns:
+        dict: Group index to description, for every image that got one.
+    """
+    results = {}
+    remaining = batch_entries
+    batch_size = len(batch_entries)
+
+    async def describe(entries):
+        payload = build_image_batch_payload([entry["group"]["prepared"] for entry in entries])
+        estimated_tokens = sum(entry["tokens"] for entry in entries) + payload["max_tokens"]
+        descriptions = await fetch_image_descriptions(payload, len(entries), estimated_tokens)
+        for position, entry in enumerate(entries):
+            if position in descriptions:
+                results[entry["idx"]] = descriptions[position]
+                llm_cache.put("image_description", entry["image_hash"], IMAGE_DESCRIPTION_MODEL, image_description_prompt, descriptions[position])
+
+    for attempt in range(IMAGE_DESCRIPTION_MAX_ATTEMPTS):
+        await asyncio.gather(*(
+            describe(remaining[start:start + batch_size]) for start in range(0, len(remaining), batch_size)
+        ))
+        remaining = [entry for entry in remaining if entry["idx"] not in results]
+        if not remaining:
+            break
+        batch_size = max(1, batch_size // 2)
+        print(f"{len(remaining)} images missing from the reply (attempt {attempt + 1}), retrying {batch_size} per request")
+    return results
+
+
+# PIL releases the GIL while decoding and resizing, so threads are enough to prepare images
+_image_prepare_executor = ThreadPoolExecutor(max_workers=IMAGE_PREPARE_WORKERS, thread_name_prefix="image-prepare")
+
+
+def _prepare_image(image_obj):
+    try:
+        return prepare_image_for_vision(image_obj.get("image_path"))
+    except OSError as e:
+        print("Error preparing image", image_obj.get("image_path"), e)
+        return None
+
+
+async def iter_prepared_images(image_objects, window=IMAGE_PREPARE_WORKERS * 2):
+    """
+    Async iterator over (image object, prepared image or None), in order, preparing at
+    most window images ahead of the consumer.
+    """
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    image_objects = iter(image_objects)
+    try:
+        while True:
+            while len(pending) < window:
+                image_obj = next(image_objects, None)
+                if image_obj is None:
+                    break
+                pending.append((image_obj, loop.run_in_executor(_image_prepare_executor, _prepare_image, image_obj)))
+            if not pending:
+                return
+            image_obj, future = pending.popleft()
+            yield image_obj, await future
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+@traced("image_describe")
+async def get_image_descriptions_batched_async(image_objects, token_budget=IMAGE_BATCH_TOKEN_BUDGET, max_images=IMAGE_BATCH_MAX_IMAGES,
+                                               concurrency=IMAGE_DESCRIPTION_CONCURRENCY, queue_batches=IMAGE_PIPELINE_QUEUE_BATCHES):
+    """
+    Describe images through a bounded producer/consumer pipeline.
+
+    Images are prepared (downscaled, recompressed, deduplicated) a few at a time in a
+    thread pool and packed into batches that go through a queue of queue_batches batches
+    to `concurrency` request workers. A full queue holds the preparation back, and the
+    image data is released as soon as its batch is answered, so memory stays flat
+    however many images a document has.
+
+    Returns:
+        list: Description dicts (image_path, filename, page_number, description), one per
+        described image occurrence.
+    """
+    groups = []
+    duplicate_index = DuplicateIndex()
+    batch_queue = asyncio.Queue(maxsize=queue_batches)
+    skipped = 0
+    cache_hits = 0
+    batches = 0
+
+    async def describe_batches():
+        while True:
+            batch = await batch_queue.get()
+            if batch is None:
+                return
+            try:
+                results = await describe_image_batch(batch)
+            except Exception as e:
+                print("Error describing image batch", e)
+                results = {}
+            for entry in batch:
+                entry["group"]["description"] = results.get(entry["idx"])
+                # Answered or given up on: the image data is not needed any more
+                entry["group"]["prepared"] = None
+
+    workers = [asyncio.create_task(describe_batches()) for _ in range(concurrency)]
+    try:
+        current = []
+        current_tokens = 0
+        async for image_obj, prepared in iter_prepared_images(image_objects):
+            # Tiny decorative images are dropped, near-duplicates share one description
+            if prepared is None:
+                skipped += 1
+                continue
+            group = duplicate_index.find(prepared["fingerprint"])
+            if group is not None:
+                group["occurrences"].append(image_obj)
+                continue
+            group = {"fingerprint": prepared["fingerprint"], "prepared": prepared, "occurrences": [image_obj], "description": None}
+            groups.append(group)
+            duplicate_index.add(group)
+
+            # Images already described with this model and prompt are served from the cache
+            image_hash = prepared["fingerprint"]["sha256"]
+            cached = llm_cache.get("image_description", image_hash, IMAGE_DESCRIPTION_MODEL, image_description_prompt)
+            if cached is not None:
+                group["description"] = cached
+                group["prepared"] = None
+                cache_hits += 1
+                continue
 
-        descriptions_split = descriptions_split[:len(batch)]
-        
-        # Extract descriptions for each image and associate with image_obj data
-        for idx, image_content in enumerate(descriptions_split):
+            tokens = estimate_image_tokens(prepared["width"], prepared["height"])
+            if current and (current_tokens + tokens > token_budget or len(current) >= max_images):
+                await batch_queue.put(current)
+                batches += 1
+                current = []
+                current_tokens = 0
+            current.append({"idx": len(groups) - 1, "group": group, "image_hash": image_hash, "tokens": tokens})
+            current_tokens += tokens
+        if current:
+            await batch_queue.put(current)
+            batches += 1
+        for _ in workers:
+            await batch_queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+    print(f"Images: {len(image_objects)} extracted, {len(groups)} unique, {skipped} skipped as too small")
+    count("images", len(image_objects))
+    count("unique_images", len(groups))
+    count("cache_hits", cache_hits)
+    count("batches", batches)
+
+    # Fan each description back out to every occurrence of the image
+    descriptions = []
+    for group in groups:
+        if group["description"] is None:
+            continue
+        for image_obj in group["occurrences"]:
             descriptions.append({
-                "image_path": batch[idx].get("image_path"),
-                "filename": batch[idx].get("filename"),
-                "page_number": batch[idx].get("page_number"),
-                "description": image_content.strip()
+                "image_path": image_obj.get("image_path"),
+                "filename": image_obj.get("filename"),
+                "page_number": image_obj.get("page_number"),
+                "description": group["description"]
             })
-        
-        return descriptions
\ No newline at end of file
+
+    return descriptions
+
+async def fetch_image_descriptions(payload, image_count, estimated_tokens):
+    """
+    Send one image batch and parse the JSON reply.
+
+    Returns:
+        dict: Position in the batch to description, for the images the reply covered.
+    """
+    try:
+        response = await scheduled_chat_completion(estimated_tokens=estimated_tokens, **payload)
+        if response.choices[0].finish_reason == "length":
+            print(f"Image descriptions cut off at max_tokens ({image_count} images)")
+        reply = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        # Out of retries or unparseable reply: the caller re-requests what is missing
+        print("Error getting image descriptions", e)
+        return {}
+
+    descriptions = {}
+    for item in reply.get("descriptions", []) if isinstance(reply, dict) else []:
+        try:
+            position = int(item.get("index"))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        description = str(item.get("description") or "").strip()
+        if 0 <= position < image_count and description:
+            descriptions[position] = description
+    return descriptions
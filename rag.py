@@ -1,89 +1,128 @@
 import os
-import time
 
-import chromadb
-from llama_index.core import StorageContext,VectorStoreIndex,ServiceContext
+from llama_index.core import Settings,StorageContext,VectorStoreIndex,ServiceContext
 
-from unstructured.partition.pdf import partition_pdf
+from constants import EMBEDDING_MODEL
 from custom_query_engine import RAGStringQueryEngine
 from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.embeddings.openai import OpenAIEmbedding
 from dotenv import load_dotenv
 
+from embedding_cache import CachedOpenAIEmbedding
+from instrumentation import count, span, traced
+from partitioning import partition_pdf_elements
 from processing import chunk_elements, create_documents
+from vector_store import collection_name_for, drop_collection, evict_collections, is_complete, open_collection
 
 load_dotenv()
 
-chroma_client = chromadb.EphemeralClient()
-chroma_collection = chroma_client.get_or_create_collection("chatbot-1")
-
 api_key =  os.getenv("OPENAI_API_KEY")
 
-def get_query_engine_from_documents(documents, top_k=20):
-    """ 
-    Generate retriever from text
+def _service_context():
+    embeddings = CachedOpenAIEmbedding(model=EMBEDDING_MODEL,api_key=api_key,embed_batch_size=100)
+    return ServiceContext.from_defaults(embed_model=embeddings)
+
+
+def create_index(collection, documents=()):
+    """
+    Create a vector index over a Chroma collection.
 
     Args:
-        text (list):  text.
-        top_k (int): Top k of the document
+        collection (Collection): The document's Chroma collection.
+        documents (list): Documents to embed and insert right away, may be empty.
 
     Returns:
-        retriever (Retriever): The retriever.
+        index (VectorStoreIndex): The index.
     """
-    current_time = time.time()
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    vector_store = ChromaVectorStore(chroma_collection=collection)
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    embeddings = OpenAIEmbedding(api_key=api_key,embed_batch_size=100)
-    service_context = ServiceContext.from_defaults(embed_model=embeddings)
-    index = VectorStoreIndex.from_documents(
-        documents, storage_context=storage_context,service_context=service_context
-    )   
+    return VectorStoreIndex.from_documents(
+        list(documents), storage_context=storage_context,service_context=_service_context()
+    )
 
+
+def load_index(collection):
+    """
+    Open the index of an already ingested collection without embedding anything.
+    """
+    vector_store = ChromaVectorStore(chroma_collection=collection)
+    return VectorStoreIndex.from_vector_store(vector_store, service_context=_service_context())
+
+
+def prepare_collection(pdf_bytes, keep=(), evict=True):
+    """
+    Open the collection for a document, evicting stale collections of other documents
+    except those named in keep (unless evict is False). A collection left incomplete by
+    an interrupted ingest is dropped and recreated.
+
+    Returns:
+        tuple: (collection, True if the document is already fully ingested)
+    """
+    name = collection_name_for(pdf_bytes)
+    if evict:
+        evict_collections(keep={name, *keep})
+    collection = open_collection(name)
+    if is_complete(collection):
+        print(f"Reusing ingested collection {name}")
+        return collection, True
+    if collection.count():
+        drop_collection(name)
+        collection = open_collection(name)
+    return collection, False
+
+
+@traced("index_insert")
+def insert_documents(index, documents):
+    """
+    Split, embed and insert documents into an existing index in one batch.
+    """
+    nodes = Settings.node_parser.get_nodes_from_documents(documents)
+    index.insert_nodes(nodes)
+    count("documents", len(documents))
+    count("nodes", len(nodes))
+
+
+def get_query_engine_from_index(index, top_k=20):
     retriever = index.as_retriever(similarity_top_k=top_k)
     query_engine = RAGStringQueryEngine(
         retriever=retriever
     )
-    
     print(f"Retriever created with top k {top_k}")
-    print("Completed the function in :",time.time()-current_time)
-
     return query_engine
 
 
-async def create_pdf_retrieval_chain(file):
-    start_time = time.time()
-    docs = []
+def get_query_engine_from_documents(collection, documents, top_k=20):
+    """ 
+    Generate retriever from text
 
-    print("Resetting collection..")
-    reset_collection()
+    Args:
+        text (list):  text.
+        top_k (int): Top k of the document
 
-    filename = file.name
-    print("Partioning..")
-    elements = partition_pdf(file=file,strategy="hi_res",infer_table_structure=True,extract_images_in_pdf=True,extract_image_block_output_dir="image_blocks")
+    Returns:
+        retriever (Retriever): The retriever.
+    """
+    with span("index_insert") as stage:
+        index = create_index(collection, documents)
+        stage.count("documents", len(documents))
+    query_engine = get_query_engine_from_index(index, top_k)
 
-    elements_list = [element.to_dict() for element in elements]
-    
-    print("chunking..")
-    chunks = chunk_elements(elements_list,filename)
+    return query_engine
 
-    documents = await create_documents(chunks)
-    docs.extend(documents)
-    
 
-    query_engine = get_query_engine_from_documents(docs, top_k=15)
+async def build_documents(file, partition_report=None, **partition_options):
+    """
+    Partition, chunk and describe a PDF into the documents to index. Touches no vector
+    store, so it can run in any process.
 
-    end_time = time.time()
-    print(f"Time taken to create retrieval chain: {end_time - start_time:.2f} seconds")
-    return query_engine
+    Args:
+        file: Uploaded PDF file or file-like object with a name.
+        partition_report (dict | None): Filled by partition_pdf_elements.
+        partition_options: Extra partition_pdf_elements arguments, e.g. parallel=False.
+
+    Returns:
+        list: The documents.
+    """
+    elements_list = partition_pdf_elements(file, report=partition_report, **partition_options)
+    chunks = chunk_elements(elements_list, file.name)
+    return await create_documents(chunks)
 
-def reset_collection():
-    all_ids = chroma_collection.get()['ids']
-    total_ids = len(all_ids)
-    batch_size = 100
-    
-    for i in range(0, total_ids, batch_size):
-        batch = all_ids[i:i+batch_size]
-        chroma_collection.delete(ids=batch)
-        print(f"Deleted batch {i//batch_size + 1}: {len(batch)} documents")
-    
-    print(f"Cleared {total_ids} documents from the collection.")
\ No newline at end of file
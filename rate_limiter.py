@@ -0,0 +1,321 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from functools import lru_cache
+
+import tiktoken
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from constants import (
+    IMAGE_TOKEN_ESTIMATE,
+    OPENAI_BACKOFF_BASE_SECONDS,
+    OPENAI_BACKOFF_MAX_SECONDS,
+    OPENAI_DEFAULT_RATE_LIMIT,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_MAX_RETRIES,
+    OPENAI_MIN_CONCURRENCY,
+    OPENAI_RATE_LIMITS,
+)
+from instrumentation import count
+from openai_client import create_chat_completion
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model="gpt-4o"):
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def estimate_chat_tokens(messages, model, max_tokens=None):
+    """
+    Estimate the tokens a chat request counts against the tokens-per-minute limit:
+    the prompt text, a flat cost per image and the completion budget.
+    """
+    tokens = 0
+    for message in messages:
+        tokens += 4  # per-message framing
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += count_tokens(content, model)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += count_tokens(part.get("text", ""), model)
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens + (max_tokens or 1000)
+
+
+def get_retry_after(error):
+    """
+    Read the Retry-After (or retry-after-ms) header of a failed request, in seconds.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date form, fall back to exponential backoff
+        return None
+    return None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at capacity_per_minute / 60 per second.
+    Shared by every event loop in the process, since the account limits are too.
+    """
+
+    def __init__(self, capacity_per_minute):
+        self.capacity = capacity_per_minute
+        self.rate = capacity_per_minute / 60
+        self.tokens = capacity_per_minute
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, amount):
+        """
+        Take amount tokens if available.
+
+        Returns:
+            float: 0 when the tokens were taken, otherwise seconds to wait before retrying.
+        """
+        # Requests larger than the bucket would never fit, let them through on a full bucket
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    async def acquire(self, amount):
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for the given time, e.g. after the server sent Retry-After.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+async def _notify_all(condition):
+    async with condition:
+        condition.notify_all()
+
+
+class AdaptiveConcurrency:
+    """
+    Async concurrency limit that halves on throttling and grows back by one after a run of
+    successful requests (AIMD). The limit and the requests in flight are shared by every
+    event loop in the process; only the condition a request waits on belongs to its loop.
+    """
+
+    def __init__(self, initial=OPENAI_MAX_CONCURRENCY, minimum=OPENAI_MIN_CONCURRENCY,
+                 maximum=OPENAI_MAX_CONCURRENCY, increase_after=10):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_after = increase_after
+        self.in_flight = 0
+        self._successes = 0
+        self._lock = threading.Lock()
+        self._conditions = weakref.WeakKeyDictionary()
+
+    def _condition(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            condition = self._conditions.get(loop)
+            if condition is None:
+                condition = self._conditions[loop] = asyncio.Condition()
+            return condition
+
+    def _try_enter(self):
+        with self._lock:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    async def __aenter__(self):
+        condition = self._condition()
+        async with condition:
+            await condition.wait_for(self._try_enter)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        with self._lock:
+            self.in_flight -= 1
+            loops = list(self._conditions.items())
+        # A freed slot may be taken from any loop; wake the waiters of each on its own thread
+        for loop, condition in loops:
+            try:
+                loop.call_soon_threadsafe(lambda condition=condition: asyncio.ensure_future(_notify_all(condition)))
+            except RuntimeError:
+                pass  # loop already closed
+
+    def on_success(self):
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.increase_after and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+
+    def on_throttle(self):
+        with self._lock:
+            self._successes = 0
+            new_limit = max(self.minimum, self.limit // 2)
+            changed = new_limit != self.limit
+            self.limit = new_limit
+        if changed:
+            print(f"Throttled by the API, lowering concurrency to {new_limit}")
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_rate_limit_share = 1.0
+_request_gate = None
+
+
+def get_model_buckets(model):
+    """
+    Return the (requests, tokens) buckets for a model, shared process-wide.
+    """
+    with _buckets_lock:
+        if model not in _buckets:
+            limits = OPENAI_RATE_LIMITS.get(model, OPENAI_DEFAULT_RATE_LIMIT)
+            _buckets[model] = (
+                TokenBucket(limits["rpm"] * _rate_limit_share),
+                TokenBucket(limits["tpm"] * _rate_limit_share),
+            )
+        return _buckets[model]
+
+
+def share_limits_across_processes(process_count, request_gate=None):
+    """
+    Configure this process as one of process_count processes using the same account:
+    it gets its share of the rate limits, and every request also holds request_gate
+    (a multiprocessing semaphore shared by all of them), which caps the requests in
+    flight across processes. Call before the first request.
+    """
+    global _rate_limit_share, _request_gate
+    with _buckets_lock:
+        _rate_limit_share = 1.0 / max(1, process_count)
+        _request_gate = request_gate
+        _buckets.clear()
+
+
+async def _acquire_request_gate(gate):
+    # A multiprocessing semaphore would block the event loop, poll it instead
+    while not gate.acquire(block=False):
+        await asyncio.sleep(0.05)
+
+
+class RequestScheduler:
+    """
+    Schedules OpenAI requests within the requests/tokens per minute limits, retries
+    throttled and transient failures with jittered exponential backoff (honoring
+    Retry-After) and adapts concurrency to the throttling it sees.
+    """
+
+    def __init__(self, max_retries=OPENAI_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.concurrency = AdaptiveConcurrency()
+        self.retries = 0
+        self.throttled = 0
+
+    def _backoff(self, attempt):
+        # Full jitter keeps retrying requests from hitting the API in lockstep
+        return random.uniform(0, min(OPENAI_BACKOFF_MAX_SECONDS, OPENAI_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+    async def run(self, model, request_fn, estimated_tokens):
+        """
+        Run request_fn (a coroutine factory) once capacity is available, retrying as needed.
+        """
+        request_bucket, token_bucket = get_model_buckets(model)
+        for attempt in range(self.max_retries + 1):
+            await request_bucket.acquire(1)
+            await token_bucket.acquire(estimated_tokens)
+            async with self.concurrency:
+                gate = _request_gate
+                if gate is not None:
+                    await _acquire_request_gate(gate)
+                try:
+                    result = await request_fn()
+                    self.concurrency.on_success()
+                    count("llm_calls")
+                    usage = getattr(result, "usage", None)
+                    if usage is not None:
+                        count("prompt_tokens", usage.prompt_tokens)
+                        count("completion_tokens", usage.completion_tokens)
+                        # Per model as well, for cost estimates
+                        count(f"prompt_tokens:{model}", usage.prompt_tokens)
+                        count(f"completion_tokens:{model}", usage.completion_tokens)
+                    return result
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        raise
+                    retry_after = get_retry_after(e)
+                    count("retries")
+                    if isinstance(e, RateLimitError):
+                        count("throttled")
+                        self.throttled += 1
+                        self.concurrency.on_throttle()
+                        if retry_after:
+                            request_bucket.pause(retry_after)
+                            token_bucket.pause(retry_after)
+                    delay = retry_after if retry_after is not None else self._backoff(attempt)
+                    print(f"{type(e).__name__} from {model}, retry {attempt + 1} in {delay:.1f}s")
+                finally:
+                    if gate is not None:
+                        gate.release()
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+
+# One scheduler per process: Streamlit runs every script run in a fresh event loop, and the
+# concurrency it has learned (like the Retry-After pauses of the buckets) must outlive the loop
+_scheduler = RequestScheduler()
+
+
+def get_request_scheduler():
+    return _scheduler
+
+
+async def scheduled_chat_completion(estimated_tokens=None, **request):
+    """
+    client.chat.completions.create through the request scheduler. estimated_tokens
+    overrides the tiktoken-based estimate when the caller knows better (e.g. image costs).
+    """
+    if estimated_tokens is None:
+        estimated_tokens = estimate_chat_tokens(request["messages"], request["model"], request.get("max_tokens"))
+    return await get_request_scheduler().run(
+        request["model"],
+        lambda: create_chat_completion(**request),
+        estimated_tokens,
+    )
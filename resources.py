@@ -0,0 +1,146 @@
+"""
+Heavy resources loaded once per process and shared by every script run and job in it:
+the Chroma client, the hi_res layout and table models and the partition process pool.
+
+Loads are timed in "load_<name>" spans, so the metrics tell cold-start cost apart from
+the work itself. warm_up_app and warm_up_worker load them ahead of the first request.
+"""
+import atexit
+import importlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from constants import CHROMA_PERSIST_DIR, LAYOUT_MODEL_NAME, PARTITION_MAX_WORKERS
+from instrumentation import span
+
+_resources = {}
+_resources_lock = threading.Lock()
+_load_locks = {}
+_partition_pool_size = None
+
+
+def _load(name, loader):
+    # One lock per resource: a slow load (the layout model) does not hold up the others
+    with _resources_lock:
+        if name in _resources:
+            return _resources[name]
+        load_lock = _load_locks.setdefault(name, threading.Lock())
+    with load_lock:
+        if name not in _resources:
+            with span(f"load_{name}") as stage:
+                resource = loader()
+            with _resources_lock:
+                _resources[name] = resource
+            print(f"Loaded {name} in {stage.duration or 0:.2f}s")
+        return _resources[name]
+
+
+def get_chroma_client():
+    def load():
+        import chromadb
+
+        return chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+
+    return _load("chroma_client", load)
+
+
+def get_layout_model():
+    """
+    Load the hi_res layout model and the table structure model.
+
+    unstructured keeps loaded models in module globals, so later partition_pdf calls in
+    this process reuse them instead of loading their own.
+    """
+    def load():
+        from unstructured_inference.models.base import get_model
+        from unstructured_inference.models.tables import load_agent
+
+        model = get_model(LAYOUT_MODEL_NAME)
+        load_agent()
+        return model
+
+    return _load("layout_model", load)
+
+
+def _init_partition_worker():
+    try:
+        get_layout_model()
+    except Exception as e:
+        # Leave the pool usable: partition_pdf loads the model itself on first use
+        print("Layout model warm-up failed", e)
+
+
+def _partition_worker_ready(_):
+    return True
+
+
+def get_partition_pool(max_workers=PARTITION_MAX_WORKERS):
+    """
+    Long-lived process pool for hi_res partitioning. Its workers load the layout model
+    when they start and keep it for every later page range. max_workers only applies to
+    the first call, which creates the pool; a pool started again after
+    reset_partition_pool keeps that size.
+    """
+    def load():
+        global _partition_pool_size
+        if _partition_pool_size is None:
+            _partition_pool_size = max_workers
+        # spawn keeps the workers independent of the threads running in the Streamlit server
+        pool = ProcessPoolExecutor(
+            max_workers=_partition_pool_size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_partition_worker,
+        )
+        atexit.register(pool.shutdown, wait=False, cancel_futures=True)
+        return pool
+
+    return _load("partition_pool", load)
+
+
+def reset_partition_pool():
+    """
+    Drop the partition pool, e.g. after one of its workers died; the next call to
+    get_partition_pool starts a new one.
+    """
+    with _resources_lock:
+        pool = _resources.pop("partition_pool", None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def preload_modules(module_names):
+    """
+    Import modules ahead of their first use, timing each import.
+    """
+    for module_name in module_names:
+        _load(f"module_{module_name}", lambda: importlib.import_module(module_name))
+
+
+def warm_up_app():
+    """
+    Load what the first question and upload need: the Chroma client and the indexing
+    and answering modules. Meant to run in a background thread at startup.
+    """
+    try:
+        preload_modules(("streaming_ingest", "processing"))
+        get_chroma_client()
+    except Exception as e:
+        print("App warm-up failed", e)
+
+
+def warm_up_worker(partition_workers=PARTITION_MAX_WORKERS):
+    """
+    Load what the first job needs: the job handler modules and, through the partition
+    pool initializer, the layout model in every partition worker.
+
+    Args:
+        partition_workers (int): Size of the partition pool of this worker.
+    """
+    try:
+        preload_modules(("document_stream", "ppt_utils"))
+        pool = get_partition_pool(partition_workers)
+        # Tasks submitted together start one worker each; wait until they are all up
+        list(pool.map(_partition_worker_ready, range(partition_workers)))
+    except Exception as e:
+        print("Worker warm-up failed", e)
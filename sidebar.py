@@ -1,40 +1,145 @@
+import os
 import time
 import streamlit as st
 
-from ppt_utils import create_ppt_demo
-from rag import create_pdf_retrieval_chain
-from unstructured.partition.pdf import partition_pdf
+from constants import PPT_DOWNLOAD_MAX_BYTES
+from jobs import DONE, FAILED, FINISHED_STATUSES, QUEUED, cancel_job, get_job, queue_position, submit_job
 
-from utils import delete_all_files_in_folder
+from utils import read_file_bytes
+from vector_store import collection_name_for
+
+def show_partition_report(partition_report):
+    if not partition_report:
+        return
+    if partition_report.get("cache_hit"):
+        st.caption("Partition results loaded from cache.")
+    summary = partition_report.get("strategy_summary")
+    if summary:
+        st.caption(
+            f"{summary['fast_pages']} of {summary['pages']} pages used the fast strategy "
+            f"({summary['hi_res_saved_pct']}% of hi_res work skipped)."
+        )
+
+def show_ppt_report(ppt_report):
+    if not ppt_report:
+        return
+    st.caption(
+        f"Built {ppt_report['slides']} slides ({ppt_report['deck_bytes'] / 1e6:.1f} MB) in {ppt_report['seconds']:.1f}s. "
+        f"{ppt_report['unique_images']} unique images, {ppt_report['image_original_bytes'] / 1e6:.1f} MB "
+        f"resampled to {ppt_report['image_embedded_bytes'] / 1e6:.1f} MB."
+    )
+
+def show_ingest_progress(ingest_progress):
+    progress = ingest_progress.snapshot()
+    if progress["error"]:
+        st.error(f"Processing failed: {progress['error']}")
+    elif not progress["done"]:
+        st.progress(
+            progress["fraction"],
+            text=f"Indexed {progress['pages_done']} of {progress['total_pages']} pages. "
+                 "You can already ask about the indexed pages.",
+        )
+        st.button("Refresh progress", key="refresh_ingest_progress")
+    else:
+        st.success(f"Files are ready for questions. Ask away! (processed in {progress['elapsed']:.0f}s)")
+
+def show_job_status(job, key):
+    """
+    Queue position or stage of an unfinished job, with refresh and cancel buttons.
+    """
+    if job["status"] == QUEUED:
+        st.info(f"Waiting for a worker ({queue_position(job['id'])} jobs ahead).")
+    else:
+        st.progress(job["progress"], text=f"{job['stage'].capitalize()}. {job['message'] or ''}")
+    refresh_column, cancel_column = st.columns(2)
+    refresh_column.button("Refresh", key=f"refresh_{key}")
+    if cancel_column.button("Cancel", key=f"cancel_{key}"):
+        cancel_job(job["id"])
+        st.rerun()
+
+def show_ppt_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        st.session_state.pop("ppt_job", None)
+        st.query_params.pop("ppt_job", None)
+        return
+    if job["status"] not in FINISHED_STATUSES:
+        show_job_status(job, "ppt_job")
+    elif job["status"] == DONE:
+        show_partition_report(job["result"].get("partition_report"))
+        show_ppt_report(job["result"].get("ppt_report"))
+        ppt_path = job["result"]["ppt_path"]
+        deck_bytes = os.path.getsize(ppt_path)
+        if deck_bytes > PPT_DOWNLOAD_MAX_BYTES:
+            # The download button would hold the whole deck in memory on every rerun
+            st.warning(
+                f"The presentation is {deck_bytes / 1e6:.0f} MB, above the {PPT_DOWNLOAD_MAX_BYTES / 1e6:.0f} MB "
+                f"that can be downloaded here. It was saved on the server as {ppt_path}."
+            )
+        else:
+            with open(ppt_path, "rb") as ppt_file:
+                st.download_button(
+                    label="Download Presentation",
+                    data=ppt_file,
+                    file_name="output_presentation.pptx",
+                    mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
+                )
+        st.success("PPT conversion complete!")
+    elif job["status"] == FAILED:
+        st.error(f"PPT conversion failed: {job['error']}")
+    else:
+        st.warning("PPT conversion cancelled.")
+
+def attach_to_ingest_job(job_id):
+    # streaming_ingest pulls in llama_index and Chroma, only needed once there is a document
+    from streaming_ingest import attach_ingest_job
+
+    attached = attach_ingest_job(job_id)
+    if attached is None:
+        st.query_params.pop("ingest_job", None)
+        return
+    st.session_state.query_engine, st.session_state.ingest_progress = attached
+    st.session_state.ingest_job = job_id
 
 async def configure_sidebar():
     with st.sidebar:
         st.header("Upload PDF Files")
+        if "query_engine" not in st.session_state and "ingest_job" in st.query_params:
+            # Page reloaded while a document was being ingested: pick up its job again
+            attach_to_ingest_job(st.query_params["ingest_job"])
         if "query_engine" not in st.session_state:
             uploaded_file = st.file_uploader("Choose PDF files", type=['pdf'], accept_multiple_files=False, key="file_uploader")
             if uploaded_file:
-                with st.spinner("Processing file..."):
-                    st.session_state.query_engine = await create_pdf_retrieval_chain(file=uploaded_file)
-                    st.success("Uploaded files processed. You can now ask questions.")
-        else:
-            st.success("Files are ready for questions. Ask away!")
+                from streaming_ingest import start_ingest_job
+
+                job_id, query_engine, ingest_progress = start_ingest_job(uploaded_file)
+                st.session_state.query_engine = query_engine
+                st.session_state.ingest_progress = ingest_progress
+                st.session_state.collection_name = collection_name_for(read_file_bytes(uploaded_file))
+                if job_id:
+                    st.session_state.ingest_job = job_id
+                    st.query_params["ingest_job"] = job_id
+        ingest_job = get_job(st.session_state["ingest_job"]) if "ingest_job" in st.session_state else None
+        if ingest_job and ingest_job["status"] not in FINISHED_STATUSES:
+            show_job_status(ingest_job, "ingest_job")
+        if "ingest_progress" in st.session_state:
+            show_ingest_progress(st.session_state.ingest_progress)
+        if "query_engine" in st.session_state and st.button("Chat with another document", key="new_document"):
+            # The document's collection stays on disk for the next upload of the same file
+            for key in ("query_engine", "ingest_progress", "ingest_job", "collection_name", "messages"):
+                st.session_state.pop(key, None)
+            st.query_params.pop("ingest_job", None)
+            st.rerun()
+        if ingest_job and ingest_job["result"]:
+            show_partition_report(ingest_job["result"].get("partition_report"))
         
         uploaded_pdf_for_ppt_conversion = st.file_uploader("Choose PDF file for PPT conversion", type=['pdf'], accept_multiple_files=False, key="ppt_file_uploader")
         
         if uploaded_pdf_for_ppt_conversion:
             if st.button("Convert to PPT", key="convert_to_ppt"):
-                with st.spinner("Converting PDF to PPT..."):
-                    print("Partioning..")
-                    elements = partition_pdf(file=uploaded_pdf_for_ppt_conversion,strategy="hi_res",infer_table_structure=True,extract_images_in_pdf=True,extract_image_block_output_dir="image_blocks")
-
-                    elements_list = [element.to_dict() for element in elements]
-
-                    ppt_io = create_ppt_demo(elements_list)
-                    st.download_button(
-                        label="Download Presentation",
-                        data=ppt_io,
-                        file_name="output_presentation.pptx",
-                        mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-                    )
-                    delete_all_files_in_folder(folder_path="image_blocks")
-                st.success("PPT conversion complete!")
\ No newline at end of file
+                job_id = submit_job("ppt", read_file_bytes(uploaded_pdf_for_ppt_conversion), uploaded_pdf_for_ppt_conversion.name)
+                st.session_state.ppt_job = job_id
+                st.query_params["ppt_job"] = job_id
+        ppt_job = st.session_state.get("ppt_job") or st.query_params.get("ppt_job")
+        if ppt_job:
+            show_ppt_job(ppt_job)
@@ -0,0 +1,219 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from llama_index.core import Document
+
+from constants import JOBS_POLL_SECONDS, RETRIEVAL_TOP_K
+from incremental_ingest import load_manifest, save_manifest
+from instrumentation import span
+from jobs import CANCELLED, DONE, FAILED, get_job, job_files_dir, submit_job
+from partitioning import count_pdf_pages
+from rag import create_index, get_query_engine_from_index, insert_documents, load_index, prepare_collection
+from vector_store import copy_documents, find_collection, is_complete, mark_complete
+from utils import read_file_bytes
+
+
+class IngestProgress:
+    """
+    Thread-safe progress of an ingest, shared between the indexing thread and the UI.
+    """
+
+    def __init__(self, total_pages):
+        self._lock = threading.Lock()
+        self.total_pages = total_pages
+        self.pages_done = 0
+        self.documents_indexed = 0
+        self.started_at = time.time()
+        self.first_indexed_at = None
+        self.finished_at = None
+        self.error = None
+
+    def record_batch(self, pages_done, documents_indexed):
+        with self._lock:
+            self.pages_done = max(self.pages_done, pages_done)
+            self.documents_indexed += documents_indexed
+            if documents_indexed and self.first_indexed_at is None:
+                self.first_indexed_at = time.time()
+
+    def finish(self, error=None):
+        with self._lock:
+            self.finished_at = time.time()
+            self.error = error
+            if error is None:
+                self.pages_done = self.total_pages
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    def snapshot(self):
+        with self._lock:
+            now = self.finished_at or time.time()
+            return {
+                "total_pages": self.total_pages,
+                "pages_done": self.pages_done,
+                "fraction": self.pages_done / self.total_pages if self.total_pages else 1.0,
+                "documents_indexed": self.documents_indexed,
+                "elapsed": now - self.started_at,
+                "time_to_first_index": (self.first_indexed_at - self.started_at) if self.first_indexed_at else None,
+                "done": self.finished_at is not None,
+                "error": str(self.error) if self.error else None,
+            }
+
+
+def _reuse_ingested(collection, progress, top_k):
+    progress.record_batch(progress.total_pages, collection.count())
+    progress.finish()
+    return get_query_engine_from_index(load_index(collection), top_k), progress
+
+
+_job_ingests = {}
+_job_ingests_lock = threading.Lock()
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _page_range(metadata):
+    first = metadata.get("page_number") or 1
+    return [first, metadata.get("page_end") or first]
+
+
+def _reuse_previous_revision(plan, collection, progress, indexed):
+    """
+    Copy the documents the plan reuses from the previous revision's collection.
+    """
+    if not plan["reuse"]:
+        return
+    previous = find_collection(plan["previous_collection"])
+    if previous is None:
+        raise RuntimeError(f"Previous revision {plan['previous_collection']} was evicted, upload the file again")
+    with span("reuse_revision") as stage:
+        stage.count("nodes", copy_documents(previous, collection, plan["reuse"]))
+        stage.count("documents", len(plan["reuse"]))
+    indexed.update(plan["reused_ranges"])
+    progress.record_batch(plan["reused_pages"], len(plan["reuse"]))
+
+
+def index_job_batches(job_id, index, collection, progress, indexed, poll_seconds=JOBS_POLL_SECONDS):
+    """
+    Insert the document batches of an ingest job as the worker writes them, until the
+    job is done. Documents the job reuses from a previous revision are copied first.
+
+    Args:
+        indexed (dict): Filled with doc_id -> [first page, last page] of every document.
+
+    Returns:
+        dict: The ingest plan of the job.
+
+    Raises:
+        RuntimeError: When the job failed, was cancelled or disappeared.
+    """
+    files_dir = job_files_dir(job_id)
+    plan = None
+    consumed = set()
+    while True:
+        # Status first: once a job is done, all its batch files are on disk
+        job = get_job(job_id)
+        if job is None:
+            raise RuntimeError(f"Ingest job {job_id} no longer exists")
+        if plan is None:
+            # The worker writes the plan before any batch
+            plan = _read_json(os.path.join(files_dir, "plan.json"))
+            if plan is not None:
+                _reuse_previous_revision(plan, collection, progress, indexed)
+        if plan is not None:
+            for batch_path in sorted(glob.glob(os.path.join(files_dir, "batch-*.json"))):
+                if batch_path in consumed:
+                    continue
+                batch = _read_json(batch_path)
+                documents = [Document(**document) for document in batch["documents"]]
+                if documents:
+                    insert_documents(index, documents)
+                consumed.add(batch_path)
+                for document in documents:
+                    indexed[document.doc_id] = _page_range(document.metadata)
+                progress.record_batch(plan["reused_pages"] + batch["pages_processed"], len(documents))
+        if job["status"] == DONE and plan is not None:
+            return plan
+        if job["status"] in (FAILED, CANCELLED):
+            raise RuntimeError(job["error"] or f"Ingest job {job['status']}")
+        time.sleep(poll_seconds)
+
+
+def attach_ingest_job(job_id, top_k=RETRIEVAL_TOP_K):
+    """
+    Index the output of a queued ingest job in a background thread of this process and
+    return a query engine right away.
+
+    Attaching again to the same job, e.g. after a browser refresh, returns the running
+    indexer instead of starting a second one. Once the job is indexed, the page manifest
+    of the file is updated for the incremental ingest of its next revision.
+
+    Returns:
+        tuple: (query engine, IngestProgress), or None when the job does not exist.
+    """
+    with _job_ingests_lock:
+        if job_id in _job_ingests:
+            return _job_ingests[job_id]
+        job = get_job(job_id)
+        if job is None:
+            return None
+        with open(job["input_path"], "rb") as f:
+            pdf_bytes = f.read()
+        progress = IngestProgress(count_pdf_pages(pdf_bytes))
+        previous_collection = job["params"].get("previous_collection")
+        collection, complete = prepare_collection(pdf_bytes, keep=(previous_collection,) if previous_collection else ())
+        if complete:
+            _job_ingests[job_id] = _reuse_ingested(collection, progress, top_k)
+            return _job_ingests[job_id]
+        index = create_index(collection)
+        _job_ingests[job_id] = get_query_engine_from_index(index, top_k), progress
+
+    def run():
+        try:
+            indexed = {}
+            with span("ingest", filename=job["filename"], pages=progress.total_pages, job_id=job_id):
+                plan = index_job_batches(job_id, index, collection, progress, indexed)
+            mark_complete(collection)
+            save_manifest(job["filename"], collection.name, plan["fingerprints"], indexed)
+            progress.finish()
+        except Exception as e:
+            print("Ingest job failed", e)
+            progress.finish(error=e)
+
+    threading.Thread(target=run, name=f"ingest-job-{job_id}", daemon=True).start()
+    return _job_ingests[job_id]
+
+
+def start_ingest_job(file, top_k=RETRIEVAL_TOP_K):
+    """
+    Queue an ingest job for an uploaded PDF and start indexing its output.
+
+    A document that was fully ingested before is reopened from its collection without
+    queueing a job. A new revision of a file ingested before only has its changed pages
+    processed, the rest is copied from the previous revision's collection.
+
+    Returns:
+        tuple: (job id or None, query engine, IngestProgress)
+    """
+    pdf_bytes = read_file_bytes(file)
+    manifest = load_manifest(file.name)
+    previous = find_collection(manifest["collection"]) if manifest else None
+    if previous is not None and not is_complete(previous):
+        previous = None
+    collection, complete = prepare_collection(pdf_bytes, keep=(previous.name,) if previous else ())
+    if complete:
+        progress = IngestProgress(count_pdf_pages(pdf_bytes))
+        return (None, *_reuse_ingested(collection, progress, top_k))
+    params = {"previous_collection": previous.name} if previous is not None and previous.name != collection.name else {}
+    job_id = submit_job("ingest", pdf_bytes, file.name, params)
+    return (job_id, *attach_ingest_job(job_id, top_k))
@@ -9,6 +9,11 @@ def delete_all_files_in_folder(folder_path="image_blocks"):
     else:
         print(f"The folder '{folder_path}' does not exist.")
 
+def delete_files(file_paths):
+    for file_path in file_paths:
+        if file_path and os.path.isfile(file_path):
+            os.remove(file_path)
+
 def save_uploaded_files(uploaded_files):
     """
     Function to save the uploaded files to the local directory
@@ -43,4 +48,23 @@ def save_uploaded_files(uploaded_files):
         
         saved_file_paths.append(file_path)
 
-    return saved_file_paths
\ No newline at end of file
+    return saved_file_paths
+
+def read_file_bytes(file):
+    """
+    Function to read the full contents of an uploaded file without moving its read position
+    Args:
+    file: Streamlit UploadedFile, file-like object or path
+    Returns:
+    bytes: The file contents
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    position = file.tell()
+    file.seek(0)
+    data = file.read()
+    file.seek(position)
+    return data
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import time
+
+from constants import CHROMA_COLLECTION_TTL_SECONDS, CHROMA_MAX_COLLECTIONS
+from resources import get_chroma_client
+
+
+def collection_name_for(pdf_bytes):
+    """
+    Name of the collection holding a document, derived from its content hash.
+    """
+    return f"doc-{hashlib.sha256(pdf_bytes).hexdigest()[:48]}"
+
+
+def open_collection(name):
+    """
+    Get or create a document collection and record that it was just used.
+    """
+    now = time.time()
+    collection = get_chroma_client().get_or_create_collection(name, metadata={"created": now, "last_used": now, "complete": False})
+    metadata = dict(collection.metadata or {})
+    metadata["last_used"] = now
+    collection.modify(metadata=metadata)
+    return collection
+
+
+def is_complete(collection):
+    return bool((collection.metadata or {}).get("complete"))
+
+
+def mark_complete(collection):
+    """
+    Flag a collection as fully ingested, so later uploads of the document reuse it.
+    """
+    metadata = dict(collection.metadata or {})
+    metadata["complete"] = True
+    collection.modify(metadata=metadata)
+
+
+def pin_collection(collection):
+    """
+    Exempt a collection from eviction, e.g. one of a pre-indexed corpus.
+    """
+    metadata = dict(collection.metadata or {})
+    metadata["pinned"] = True
+    collection.modify(metadata=metadata)
+
+
+def find_collection(name):
+    """
+    An existing collection, or None, without creating it or touching its last use.
+    """
+    try:
+        return get_chroma_client().get_collection(name)
+    except ValueError:
+        return None
+
+
+def _shift_pages(metadata, offset):
+    for key in ("page_number", "page_end"):
+        if isinstance(metadata.get(key), int):
+            metadata[key] += offset
+
+
+def copy_documents(source, target, page_offsets, batch_size=500):
+    """
+    Copy the nodes of documents, embeddings included, from one collection into another,
+    moving their page numbers by the offset given per document.
+
+    Args:
+        source (Collection): Collection to copy from.
+        target (Collection): Collection to copy into.
+        page_offsets (dict): doc_id -> page offset.
+
+    Returns:
+        int: Number of nodes copied.
+    """
+    doc_ids = list(page_offsets)
+    copied = 0
+    for start in range(0, len(doc_ids), batch_size):
+        nodes = source.get(
+            where={"document_id": {"$in": doc_ids[start:start + batch_size]}},
+            include=["embeddings", "documents", "metadatas"],
+        )
+        for metadata in nodes["metadatas"]:
+            offset = page_offsets[metadata["document_id"]]
+            if not offset:
+                continue
+            _shift_pages(metadata, offset)
+            # The node is rebuilt from _node_content at query time, shift its copy too
+            node_content = json.loads(metadata["_node_content"])
+            _shift_pages(node_content.get("metadata", {}), offset)
+            metadata["_node_content"] = json.dumps(node_content)
+        if nodes["ids"]:
+            target.upsert(
+                ids=nodes["ids"], embeddings=nodes["embeddings"], documents=nodes["documents"], metadatas=nodes["metadatas"]
+            )
+            copied += len(nodes["ids"])
+    return copied
+
+
+def drop_collection(name):
+    """
+    Delete a document collection in one call, whatever its size.
+    """
+    try:
+        get_chroma_client().delete_collection(name)
+        print(f"Dropped collection {name}")
+    except ValueError:
+        pass
+
+
+def evict_collections(keep=(), max_collections=CHROMA_MAX_COLLECTIONS, ttl_seconds=CHROMA_COLLECTION_TTL_SECONDS):
+    """
+    Drop document collections unused for longer than ttl_seconds, then the least
+    recently used ones beyond max_collections. Collections named in keep and pinned
+    collections are never dropped.
+    """
+    now = time.time()
+    collections = [
+        (float((collection.metadata or {}).get("last_used", 0)), collection.name)
+        for collection in get_chroma_client().list_collections()
+        if collection.name.startswith("doc-") and collection.name not in keep
+        and not (collection.metadata or {}).get("pinned")
+    ]
+    collections.sort(reverse=True)
+
+    remaining = max(0, max_collections - len(keep))
+    for position, (last_used, name) in enumerate(collections):
+        if now - last_used > ttl_seconds or position >= remaining:
+            drop_collection(name)
@@ -0,0 +1,312 @@
+"""
+Background worker for the jobs queued by the app (ingest and PPT conversion).
+
+The app starts JOB_WORKERS of these processes itself; set JOBS_EMBEDDED_WORKERS=0 to run
+them separately instead, on the same machine:
+
+    python worker.py --workers 4
+
+Ingest jobs partition, chunk and describe a document, and hand the finished documents
+over to the app as JSON batch files in the job folder. The app process embeds and inserts
+them, because the embedded Chroma store must only be written from one process.
+"""
+import argparse
+import asyncio
+import atexit
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import threading
+import time
+
+from constants import (
+    IMAGE_FOLDER,
+    JOB_WORKERS,
+    JOBS_HEARTBEAT_SECONDS,
+    JOBS_POLL_SECONDS,
+    PARTITION_MAX_WORKERS,
+    WARMUP_ON_STARTUP,
+)
+from instrumentation import span
+from jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    JobCancelled,
+    claim_next_job,
+    finish_job,
+    job_files_dir,
+    purge_finished_jobs,
+    requeue_stale_jobs,
+    update_progress,
+)
+from rate_limiter import share_limits_across_processes
+from resources import get_partition_pool, warm_up_worker
+
+
+def _read_job_input(job):
+    with open(job["input_path"], "rb") as f:
+        pdf_file = io.BytesIO(f.read())
+    pdf_file.name = job["filename"]
+    return pdf_file
+
+
+def job_image_dir(job):
+    """
+    Folder for the image blocks of a job. Jobs running side by side would otherwise
+    overwrite and delete each other's figures, which unstructured names by page only.
+    """
+    return os.path.join(IMAGE_FOLDER, job["id"])
+
+
+def _partition_summary(partition_report):
+    return {key: partition_report[key] for key in ("cache_hit", "strategy_summary") if key in partition_report}
+
+
+def _write_json(path, data):
+    # Written under a temporary name first, so the app never reads half a file
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def _write_batch(path, end_page, pages_processed, documents):
+    _write_json(path, {
+        "end_page": end_page,
+        "pages_processed": pages_processed,
+        "documents": [{"doc_id": doc.doc_id, "text": doc.text, "metadata": doc.metadata} for doc in documents],
+    })
+
+
+def run_ingest_job(job):
+    """
+    Turn a PDF into documents range by range, writing one batch file per range.
+
+    With a previous revision of the document in params["previous_collection"], only the
+    pages that changed since are processed. The plan file written first tells the app
+    which documents to copy over from the previous revision.
+
+    Returns:
+        dict: Job result with the number of batches and pages.
+    """
+    # Handler modules are imported here: the app imports this module to start the pool
+    from document_stream import stream_documents
+    from pypdf import PdfReader
+
+    from incremental_ingest import load_manifest, page_fingerprints, plan_incremental_ingest
+    from partitioning import extract_pdf_pages
+
+    pdf_file = _read_job_input(job)
+    pdf_bytes = pdf_file.getvalue()
+    files_dir = job_files_dir(job["id"])
+    update_progress(job["id"], stage="fingerprinting", progress=0.0)
+
+    fingerprints = page_fingerprints(pdf_bytes)
+    total_pages = len(fingerprints)
+    previous_collection = job["params"].get("previous_collection")
+    manifest = load_manifest(job["filename"]) if previous_collection else None
+    if manifest and manifest["collection"] != previous_collection:
+        manifest = None
+    plan = plan_incremental_ingest(manifest, fingerprints)
+    plan.update({"previous_collection": previous_collection if manifest else None, "fingerprints": fingerprints})
+    _write_json(os.path.join(files_dir, "plan.json"), plan)
+    pages_to_process = sum(last - first + 1 for first, last in plan["page_runs"])
+    if manifest:
+        print(f"Re-ingesting {pages_to_process} of {total_pages} pages of {job['filename']}, "
+              f"reusing {len(plan['reuse'])} documents")
+
+    partition_report = {}
+    batches = 0
+    pages_processed = 0
+
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+
+    async def run():
+        nonlocal batches, pages_processed
+        for first, last in plan["page_runs"]:
+            if first == 1 and last == total_pages:
+                run_file = pdf_file
+            else:
+                run_file = io.BytesIO(extract_pdf_pages(reader, first, last))
+                run_file.name = job["filename"]
+            # Doc ids of this job must not collide with the ones reused from the previous revision
+            documents_stream = stream_documents(
+                run_file, job["filename"], image_output_dir=job_image_dir(job), partition_report=partition_report,
+                page_offset=first - 1, doc_id_prefix=f"{job['id'][:8]}-{first}-",
+            )
+            run_start = pages_processed
+            async for end_page, documents in documents_stream:
+                batches += 1
+                pages_processed = run_start + min(end_page, last) - first + 1
+                _write_batch(os.path.join(files_dir, f"batch-{batches:05d}.json"), end_page, pages_processed, documents)
+                update_progress(
+                    job["id"],
+                    stage="processing",
+                    progress=pages_processed / pages_to_process if pages_to_process else 1.0,
+                    message=f"Processed {pages_processed} of {pages_to_process} pages",
+                    result={"batches": batches, "total_pages": total_pages},
+                )
+
+    update_progress(job["id"], stage="partitioning", message=f"{pages_to_process} of {total_pages} pages to process")
+    asyncio.run(run())
+    return {
+        "batches": batches,
+        "total_pages": total_pages,
+        "processed_pages": pages_to_process,
+        "reused_documents": len(plan["reuse"]),
+        "partition_report": _partition_summary(partition_report),
+    }
+
+
+def run_ppt_job(job):
+    """
+    Convert a PDF into a presentation stored in the job folder.
+
+    Returns:
+        dict: Job result with the deck path and the partition and PPT reports.
+    """
+    from partitioning import partition_pdf_elements
+    from ppt_utils import create_ppt_file
+    from utils import delete_files
+
+    pdf_file = _read_job_input(job)
+    update_progress(job["id"], stage="partitioning", progress=0.1)
+    partition_report = {}
+    elements_list = partition_pdf_elements(pdf_file, image_output_dir=job_image_dir(job), report=partition_report)
+
+    update_progress(job["id"], stage="building slides", progress=0.6)
+    ppt_report = {}
+    ppt_path = None
+    try:
+        ppt_path = create_ppt_file(elements_list, report=ppt_report)
+        deck_path = os.path.join(job_files_dir(job["id"]), "presentation.pptx")
+        shutil.move(ppt_path, deck_path)
+        ppt_path = None
+    finally:
+        # The job's images are removed with its image folder by run_job
+        delete_files([ppt_path])
+    return {"ppt_path": deck_path, "ppt_report": ppt_report, "partition_report": _partition_summary(partition_report)}
+
+
+JOB_HANDLERS = {
+    "ingest": run_ingest_job,
+    "ppt": run_ppt_job,
+}
+
+
+def _send_heartbeats(job_id, stop, interval=JOBS_HEARTBEAT_SECONDS):
+    # Keeps long stages (a large partition) from looking like a dead worker
+    while not stop.wait(interval):
+        try:
+            update_progress(job_id)
+        except JobCancelled:
+            # The handler notices at its next progress update
+            pass
+
+
+def run_job(job):
+    stop = threading.Event()
+    threading.Thread(target=_send_heartbeats, args=(job["id"], stop), daemon=True).start()
+    start_time = time.time()
+    try:
+        with span("job", kind=job["kind"], job_id=job["id"]):
+            result = JOB_HANDLERS[job["kind"]](job)
+        finish_job(job["id"], DONE, result=result)
+        print(f"Job {job['id']} ({job['kind']}) done in {time.time() - start_time:.1f}s")
+    except JobCancelled:
+        finish_job(job["id"], CANCELLED)
+        print(f"Job {job['id']} ({job['kind']}) cancelled")
+    except Exception as e:
+        finish_job(job["id"], FAILED, error=f"{type(e).__name__}: {e}")
+        print(f"Job {job['id']} ({job['kind']}) failed", e)
+    finally:
+        stop.set()
+        shutil.rmtree(job_image_dir(job), ignore_errors=True)
+
+
+def run_worker(worker_id=None, poll_seconds=JOBS_POLL_SECONDS, process_count=JOB_WORKERS):
+    """
+    Take jobs off the queue and run them, one at a time, until the process is stopped.
+
+    Args:
+        process_count (int): Number of worker processes sharing the OpenAI rate limits
+            and the CPU cores for partitioning.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    # Exit through atexit on terminate, so the partition pool of this worker is shut down too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Each worker keeps to its share of the limits, so together they stay within the account's
+    share_limits_across_processes(process_count)
+    # The first call sizes the pool: the workers split the cores instead of each taking all of them
+    partition_workers = max(1, PARTITION_MAX_WORKERS // max(1, process_count))
+    get_partition_pool(partition_workers)
+    if WARMUP_ON_STARTUP:
+        warm_up_worker(partition_workers)
+    print(f"Worker {worker_id} waiting for jobs")
+    while True:
+        requeue_stale_jobs()
+        job = claim_next_job(worker_id, kinds=list(JOB_HANDLERS))
+        if job is None:
+            purge_finished_jobs()
+            time.sleep(poll_seconds)
+            continue
+        print(f"Worker {worker_id} running job {job['id']} ({job['kind']}, {job['filename']})")
+        run_job(job)
+
+
+_worker_processes = []
+_worker_pool_lock = threading.Lock()
+
+
+def start_worker_pool(workers=JOB_WORKERS):
+    """
+    Start the worker processes once per app process; they are stopped when it exits.
+
+    Returns:
+        list: The worker processes.
+    """
+    with _worker_pool_lock:
+        if not _worker_processes:
+            # Not daemonic: the workers start process pools of their own for partitioning
+            context = multiprocessing.get_context("spawn")
+            for idx in range(workers):
+                process = context.Process(
+                    target=run_worker,
+                    args=(f"{socket.gethostname()}-{os.getpid()}-{idx}",),
+                    kwargs={"process_count": workers},
+                    name=f"job-worker-{idx}",
+                )
+                process.start()
+                _worker_processes.append(process)
+            atexit.register(stop_worker_pool)
+            print(f"Started {workers} job workers")
+        return _worker_processes
+
+
+def stop_worker_pool():
+    # Interrupted jobs are requeued by the next worker once their heartbeat goes stale
+    for process in _worker_processes:
+        process.terminate()
+    for process in _worker_processes:
+        process.join(timeout=5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="Number of worker processes")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        run_worker(process_count=1)
+    else:
+        start_worker_pool(args.workers)
+        try:
+            for process in _worker_processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass